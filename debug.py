@@ -12,7 +12,7 @@ import pandas as pd
 import pickle
 import logging
 import os
-from trader import Binance_API, config, env, models, processes, utils
+from trader import Binance_API, config, env, ledgers, models, processes, state, utils
 
 log_path = 'measurements/debug.log'
 
@@ -73,9 +73,9 @@ def initiate_algorithm_debug():
         file = 'balance'
         utils.dump_as_csv(balance, config.balance_path)
 
-        # Dump TradedCurrency.pickle
-        file = 'TradedCurrency.pickle'
-        utils.dump_as_pickle(TradedCurrency, config.TradedCurrency_path)
+        # Save the state of TradedCurrency
+        file = 'TradedCurrency state'
+        state.dump_state(TradedCurrency)
     except:
         logger.info(f'\nError: Wrong measurements path {file} {config.TradedCurrency_path}')
         return
@@ -101,7 +101,7 @@ def cra_stage0():
 
     logger.info('Continue applying hedge mode strategy')
 
-    TradedCurrency = utils.load_pickle(config.TradedCurrency_path)
+    TradedCurrency = state.load_state()
     is_cross = processes.check_api_keys_functional(TradedCurrency)
     processes.check_margin_type(TradedCurrency, is_cross)    
     processes.check_position_mode()
@@ -220,9 +220,7 @@ def cra_open_positions(real_mode=False):
     account_balance = Binance_API.get_futures_account_balance() 
     if not TradedCurrency.real_mode:
         account_balance['balance'] = TradedCurrency.capital
-    df_balance = utils.read_csv(config.balance_path)
-    df_balance = df_balance.append(account_balance, ignore_index=True)
-    utils.dump_as_csv(df_balance, config.balance_path)
+    ledgers.balance_ledger.append([account_balance])
 
     # Update next_timestamp
     TradedCurrency.next_timestamp += TradedCurrency.timedelta
@@ -230,7 +228,7 @@ def cra_open_positions(real_mode=False):
     logger.info(f"Final capital: {TradedCurrency.capital}")
 
     TradedCurrency.update_capital()
-    utils.dump_as_pickle(TradedCurrency, config.TradedCurrency_path)
+    state.dump_state(TradedCurrency)
     
     logger.info("continue_recurrent_algorithm (opening positions): debug done. All variables printed")
     logger.info("Returning TradedCurrency")
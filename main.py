@@ -11,18 +11,18 @@ import os
 from trader import config
 from trader import processes
 from trader import env
+from trader import retries
+from trader import state
 
 def main(data, context):
     # `data` and `context` are not used in this project, but are required
     # for the code to be compatible with Cloud Function
 
+    # Warm instances reuse loaded modules: retries deadline must be reset on every invocation
+    retries.start_invocation()
+
     # Case : initializing the algorithm
-    if env.is_local():
-        TC_path = config.TradedCurrency_path
-    else:
-        TC_path = config.bucket_dir / config.TradedCurrency_path
-    
-    if not TC_path.exists():
+    if not state.exists():
         if not config.measurements_path.exists():
             os.mkdir(config.measurements_path)
         processes.initiate_algorithm()
@@ -11,15 +11,21 @@ import time as tm
 import hmac
 import json
 import hashlib
+import uuid
+import functools
+import threading
 import requests
+import requests.adapters
 from urllib.parse import quote_from_bytes, urlencode
 
 try:
     from trader import utils
     from trader import config
+    from trader import retries
 except:
     import utils
     import config
+    import retries
 
 
 def read_keys():
@@ -45,37 +51,391 @@ def hashing(query_string: str):
     return hmac_signature.hexdigest()
 
 
+class HTTPClient(object):
+    """
+    Keep-alive HTTP client shared by every request sent to Binance.
+    Connections are pooled so that consecutive calls reuse the same TCP/TLS connection.
+    """
+
+    def __init__(self, pool_connections=config.HTTP_POOL_CONNECTIONS, pool_maxsize=config.HTTP_POOL_MAXSIZE,
+                 connect_timeout=config.HTTP_CONNECT_TIMEOUT, read_timeout=config.HTTP_READ_TIMEOUT):
+        self.timeout = (connect_timeout, read_timeout)
+        self.adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=False
+        )
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.session.headers.update({
+            'Content-Type': 'application/json;charset=utf-8',
+            'X-MBX-APIKEY': KEY
+        })
+        return
+
+    def request(self, http_method: str, url: str, params={}):
+        """ Send a request through the pooled session and return the raw response """
+        response = self.session.request(http_method, url, params=params, timeout=self.timeout)
+        LIMITER.update(response.headers, response.status_code)
+        return response
+
+    def connection_stats(self):
+        """
+        Returns connection reuse counters aggregated over every host in the pool.
+
+        Response:
+            {
+                'requests' (int): number of requests sent through the pool
+                'connections' (int): number of TCP/TLS connections opened
+                'reused' (int): number of requests served by an already opened connection
+            }
+        """
+        n_requests, n_connections = 0, 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            n_requests += pool.num_requests
+            n_connections += pool.num_connections
+        return {
+            'requests': n_requests,
+            'connections': n_connections,
+            'reused': n_requests - n_connections
+        }
+
+    def close(self):
+        self.session.close()
+        return
+
+
+CLIENT = HTTPClient()
+
+
 def dispatch_request(http_method: str):
-    """ Prepare a request with given http method """
-    session = requests.Session()
-    session.headers.update({
-        'Content-Type': 'application/json;charset=utf-8',
-        'X-MBX-APIKEY': KEY
-    })
-    return {
-        'GET': session.get,
-        'DELETE': session.delete,
-        'PUT': session.put,
-        'POST': session.post,
-    }.get(http_method, 'GET')
+    """ Prepare a request with given http method on the shared pooled client """
+    if http_method not in ['GET', 'DELETE', 'PUT', 'POST']:
+        http_method = 'GET'
+    return functools.partial(CLIENT.request, http_method)
+
+
+def get_connection_stats():
+    """ Returns connection reuse counters of the shared HTTP client """
+    return CLIENT.connection_stats()
+
+
+# RATE LIMITS
+# -----------
+# Binance limits the request weight per minute per IP and the number of orders per 10s/1min per account.
+# Every request books its cost before being sent; used weight and order counts are then corrected
+# from the X-MBX-USED-WEIGHT-1M and X-MBX-ORDER-COUNT-* response headers.
+# Market data polling may only use part of the weight budget so that order placement and
+# cancellation always have some left, even when retries pile up.
+
+PRIORITY_ORDER = 0
+PRIORITY_ACCOUNT = 1
+PRIORITY_MARKET_DATA = 2
+
+WEIGHT_SHARES = {
+    PRIORITY_ORDER: 1,
+    PRIORITY_ACCOUNT: config.ACCOUNT_WEIGHT_SHARE,
+    PRIORITY_MARKET_DATA: config.MARKET_DATA_WEIGHT_SHARE,
+}
+
+REQUEST_WEIGHTS = {
+    ('GET', '/fapi/v1/ping'): 1,
+    ('GET', '/fapi/v1/time'): 1,
+    ('GET', '/fapi/v1/exchangeInfo'): 1,
+    ('GET', '/fapi/v1/trades'): 5,
+    ('GET', '/fapi/v1/historicalTrades'): 20,
+    ('GET', '/fapi/v1/ticker/price'): 1,
+    ('GET', '/fapi/v1/premiumIndex'): 1,
+    ('GET', '/fapi/v2/balance'): 5,
+    ('GET', '/fapi/v1/positionSide/dual'): 30,
+    ('POST', '/fapi/v1/positionSide/dual'): 1,
+    ('POST', '/fapi/v1/order'): 1,
+    ('GET', '/fapi/v1/order'): 1,
+    ('DELETE', '/fapi/v1/order'): 1,
+    ('POST', '/fapi/v1/batchOrders'): 5,
+    ('DELETE', '/fapi/v1/batchOrders'): 1,
+    ('GET', '/fapi/v1/openOrders'): 1,
+    ('DELETE', '/fapi/v1/allOpenOrders'): 1,
+    ('POST', '/fapi/v1/leverage'): 1,
+    ('POST', '/fapi/v1/marginType'): 1,
+    ('GET', '/fapi/v2/positionRisk'): 5,
+    ('GET', '/fapi/v1/commissionRate'): 20,
+    ('POST', '/fapi/v1/listenKey'): 1,
+    ('PUT', '/fapi/v1/listenKey'): 1,
+    ('DELETE', '/fapi/v1/listenKey'): 1,
+}
+
+ORDER_ENDPOINTS = [
+    ('POST', '/fapi/v1/order'),
+    ('DELETE', '/fapi/v1/order'),
+    ('POST', '/fapi/v1/batchOrders'),
+    ('DELETE', '/fapi/v1/batchOrders'),
+    ('DELETE', '/fapi/v1/allOpenOrders'),
+]
+
+# Server time is left out on purpose: signing requests depends on it
+MARKET_DATA_ENDPOINTS = [
+    '/fapi/v1/ping', '/fapi/v1/exchangeInfo', '/fapi/v1/depth', '/fapi/v1/trades', '/fapi/v1/historicalTrades',
+    '/fapi/v1/klines', '/fapi/v1/continuousKlines', '/fapi/v1/ticker/price', '/fapi/v1/premiumIndex',
+]
+
+
+def get_request_weight(http_method: str, url_path: str, payload={}):
+    """ Returns the weight Binance charges for a request (limit dependent for klines and order book) """
+    if url_path in ['/fapi/v1/klines', '/fapi/v1/continuousKlines']:
+        limit = payload.get('limit', 500)
+        return 1 if limit < 100 else 2 if limit < 500 else 5 if limit <= 1000 else 10
+    if url_path == '/fapi/v1/depth':
+        limit = payload.get('limit', 500)
+        return 2 if limit <= 50 else 5 if limit <= 100 else 10 if limit <= 500 else 20
+    return REQUEST_WEIGHTS.get((http_method, url_path), 1)
+
+
+def get_request_priority(http_method: str, url_path: str):
+    if (http_method, url_path) in ORDER_ENDPOINTS:
+        return PRIORITY_ORDER
+    if url_path in MARKET_DATA_ENDPOINTS:
+        return PRIORITY_MARKET_DATA
+    return PRIORITY_ACCOUNT
+
+
+def get_order_count(http_method: str, url_path: str, payload={}):
+    """ Returns the number of orders a request counts for against the order rate limits """
+    if (http_method, url_path) == ('POST', '/fapi/v1/order'):
+        return 1
+    if (http_method, url_path) == ('POST', '/fapi/v1/batchOrders'):
+        return len(json.loads(payload['batchOrders']))
+    return 0
+
+
+class RateLimiter(object):
+    """
+    Request weight and order count scheduler shared by the sync and async clients.
+    Windows follow Binance's fixed intervals (each minute, each 10 seconds).
+    """
+
+    def __init__(self, weight_limit=config.REQUEST_WEIGHT_LIMIT,
+                 order_limit_10s=config.ORDER_COUNT_LIMIT_10S, order_limit_1m=config.ORDER_COUNT_LIMIT_1M):
+        self.weight_limit = weight_limit
+        self.order_limits = {10: order_limit_10s, 60: order_limit_1m}
+        self.lock = threading.Lock()
+        self.used_weight = 0
+        self.order_counts = {10: 0, 60: 0}
+        self.windows = {10: None, 60: None}
+        self.blocked_until = 0
+        self.n_delayed = {PRIORITY_ORDER: 0, PRIORITY_ACCOUNT: 0, PRIORITY_MARKET_DATA: 0}
+        self.delayed_time = 0
+        return
+
+    def roll_windows(self, now: float):
+        for length in [10, 60]:
+            window = int(now // length)
+            if window != self.windows[length]:
+                self.windows[length] = window
+                self.order_counts[length] = 0
+                if length == 60:
+                    self.used_weight = 0
+        return
+
+    def reserve(self, http_method: str, url_path: str, payload={}):
+        """
+        Book the cost of a request if it fits in the budget of its priority.
+
+        Response:
+            0 if the request can be sent now, else the number of seconds to wait before trying again
+        """
+        now = tm.time()
+        weight = get_request_weight(http_method, url_path, payload)
+        priority = get_request_priority(http_method, url_path)
+        n_orders = get_order_count(http_method, url_path, payload)
+        with self.lock:
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self.roll_windows(now)
+            if self.used_weight + weight > WEIGHT_SHARES[priority] * self.weight_limit:
+                return 60 - now % 60
+            for length in [10, 60]:
+                if n_orders and self.order_counts[length] + n_orders > self.order_limits[length]:
+                    return length - now % length
+            self.used_weight += weight
+            for length in [10, 60]:
+                self.order_counts[length] += n_orders
+        return 0
+
+    def record_delay(self, http_method: str, url_path: str, delay: float):
+        with self.lock:
+            self.n_delayed[get_request_priority(http_method, url_path)] += 1
+            self.delayed_time += delay
+        return
+
+    def acquire(self, http_method: str, url_path: str, payload={}):
+        """ Block until the request fits in the budget """
+        delay = self.reserve(http_method, url_path, payload)
+        while delay > 0:
+            self.record_delay(http_method, url_path, delay)
+            tm.sleep(delay)
+            delay = self.reserve(http_method, url_path, payload)
+        return
+
+    def update(self, headers, status_code: int):
+        """ Align local counters on the usage reported by Binance """
+        now = tm.time()
+        with self.lock:
+            self.roll_windows(now)
+            used_weight = headers.get('X-MBX-USED-WEIGHT-1M')
+            if used_weight is not None:
+                self.used_weight = max(self.used_weight, int(used_weight))
+            for length, label in [(10, 'X-MBX-ORDER-COUNT-10S'), (60, 'X-MBX-ORDER-COUNT-1M')]:
+                order_count = headers.get(label)
+                if order_count is not None:
+                    self.order_counts[length] = max(self.order_counts[length], int(order_count))
+            if status_code in [418, 429]:
+                # 429: too many requests, 418: IP banned. Both come with the time to wait in Retry-After
+                retry_after = headers.get('Retry-After')
+                retry_after = int(retry_after) if retry_after is not None else 60 - now % 60
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+        return
+
+    def stats(self):
+        with self.lock:
+            return {
+                'used weight': self.used_weight,
+                'order count 10s': self.order_counts[10],
+                'order count 1m': self.order_counts[60],
+                'delayed order requests': self.n_delayed[PRIORITY_ORDER],
+                'delayed account requests': self.n_delayed[PRIORITY_ACCOUNT],
+                'delayed market data requests': self.n_delayed[PRIORITY_MARKET_DATA],
+                'delayed time': self.delayed_time,
+            }
+
+
+LIMITER = RateLimiter()
+
+
+def get_rate_limit_stats():
+    """ Returns current used weight, order counts and delays applied by the rate limiter """
+    return LIMITER.stats()
 
 
-def send_signed_request(http_method: str, url_path: str, payload={}):
+class ServerClock(object):
+    """
+    Local estimate of Binance server time.
+    The offset between the local monotonic clock and the server clock is measured with an NTP-style
+    midpoint estimate: the server stamp is assumed to be taken halfway through the round trip,
+    and the sample with the shortest round trip is kept.
+    """
+
+    def __init__(self, resync_interval=config.CLOCK_RESYNC_INTERVAL, n_samples=config.CLOCK_SYNC_SAMPLES):
+        self.resync_interval = resync_interval
+        self.n_samples = n_samples
+        self.offset = None # ms to add to the local monotonic clock to obtain server time
+        self.round_trip = None # ms, round trip of the retained sample
+        self.last_sync = None # local monotonic time of the last sync (s)
+        self.lock = threading.Lock()
+        return
+
+    def sync(self):
+        best_offset, best_round_trip = None, None
+        for _ in range(self.n_samples):
+            t0 = tm.monotonic()
+            server_time = get_server_time()
+            t1 = tm.monotonic()
+            round_trip = (t1 - t0) * 1000
+            if best_round_trip is None or round_trip < best_round_trip:
+                best_round_trip = round_trip
+                best_offset = server_time - (t0 + t1) / 2 * 1000
+        self.offset = best_offset
+        self.round_trip = best_round_trip
+        self.last_sync = tm.monotonic()
+        return self.offset
+
+    def is_stale(self):
+        return self.last_sync is None or tm.monotonic() - self.last_sync > self.resync_interval
+
+    def now(self):
+        """ Returns current server time in milliseconds, resyncing first if the offset is stale """
+        if self.is_stale():
+            with self.lock:
+                # Concurrent callers wait for a single sync instead of each sending their own
+                if self.is_stale():
+                    self.sync()
+        return int(tm.monotonic() * 1000 + self.offset)
+
+
+CLOCK = ServerClock()
+
+
+def get_synced_server_time():
+    """ Returns current time in milliseconds on the Binance server, estimated from the local synced clock """
+    return CLOCK.now()
+
+
+def send_signed_request(http_method: str, url_path: str, payload={}, query_string=None):
     """ 
     Prepare and send a signed request.
     Use this function to obtain private user info, manage trades and track accounts.
+    The timestamp is taken from the local synced clock. If Binance rejects it (code -1021),
+    the clock is resynced and the request is sent once more.
+    query_string is the payload already encoded (pre-armed requests): only the timestamp and signature are left to add.
     """
+    response = _send_signed_query(http_method, url_path, payload, query_string)
+    if is_timestamp_error(response):
+        CLOCK.sync()
+        response = _send_signed_query(http_method, url_path, payload, query_string)
+    return response
+
+
+def _send_signed_query(http_method: str, url_path: str, payload={}, query_string=None):
+    LIMITER.acquire(http_method, url_path, payload)
+    if query_string is None:
+        query_string = encode_signed_payload(payload)
+    params = {'url': build_signed_url(url_path, query_string), 'params': {}}
+    response = dispatch_request(http_method)(**params)
+    return response.json()
+
+
+def encode_signed_payload(payload={}):
     query_string = urlencode(payload)
     # Replace single quotes to double quotes
-    query_string = query_string.replace('%27', '%22')
+    return query_string.replace('%27', '%22')
+
+
+def build_signed_url(url_path: str, query_string: str):
+    """ Stamp an encoded query string with the synced server time and sign it """
     if query_string:
-        query_string = "{}&timestamp={}".format(query_string, get_server_time())
+        query_string = "{}&timestamp={}".format(query_string, CLOCK.now())
     else:
-        query_string = 'timestamp={}'.format(get_server_time())
-    url = BASE_URL + url_path + '?' + query_string + '&signature=' + hashing(query_string)
-    params = {'url': url, 'params': {}}
-    response = dispatch_request(http_method)(**params)
-    return response.json()
+        query_string = 'timestamp={}'.format(CLOCK.now())
+    return BASE_URL + url_path + '?' + query_string + '&signature=' + hashing(query_string)
+
+
+def build_public_url(url_path: str, payload={}):
+    query_string = urlencode(payload, True)
+    url = BASE_URL + url_path
+    if query_string:
+        url = url + '?' + query_string
+    return url
+
+
+def is_timestamp_error(response):
+    """ Returns True if Binance rejected the request timestamp (outside of recvWindow) """
+    return isinstance(response, dict) and response.get('code') == -1021
+
+
+def prewarm():
+    """
+    Get ready for a time critical request: resync the server clock, which also opens
+    (or keeps alive) the pooled connection the request will be sent through.
+
+    Response:
+        round trip of the retained clock sample in milliseconds
+    """
+    with CLOCK.lock:
+        CLOCK.sync()
+    return CLOCK.round_trip
 
 
 def send_public_request(url_path: str, payload={}):
@@ -83,14 +443,226 @@ def send_public_request(url_path: str, payload={}):
     Prepare and send an unsigned request.
     Use this function to obtain public market data
     """
-    query_string = urlencode(payload, True)
-    url = BASE_URL + url_path
-    if query_string:
-        url = url + '?' + query_string
+    LIMITER.acquire('GET', url_path, payload)
+    url = build_public_url(url_path, payload)
     response = dispatch_request('GET')(url=url)
     return response.json()
 
 
+def send_api_key_request(http_method: str, url_path: str, payload={}):
+    """
+    Prepare and send a request authenticated by the API key only (no signature).
+    Use this function to manage user data streams
+    """
+    LIMITER.acquire(http_method, url_path, payload)
+    url = build_public_url(url_path, payload)
+    response = dispatch_request(http_method)(url=url)
+    return response.json()
+
+
+# PARSING RESPONSES
+# -----------------
+# Shared by the synchronous functions below and by Binance_API_async
+
+ORDER_FLOAT_LABELS = ['cumQty', 'cumQuote', 'executedQty', 'avgPrice', 'origQty', 'price', 'stopPrice', 'activatePrice', 'priceRate']
+
+
+def parse_order_book(order_book: dict, limit: int):
+    for i in range(limit):
+        order_book['bids'][i] = [np.float64(order_book['bids'][i][0]), np.float64(order_book['bids'][i][1])]
+        order_book['asks'][i] = [np.float64(order_book['asks'][i][0]), np.float64(order_book['asks'][i][1])]
+    return order_book
+
+
+def parse_trades(trades: list):
+    for trade in trades:
+        trade['price'] = np.float64(trade['price'])
+        trade['qty'] = np.float64(trade['qty'])
+        trade['quoteQty'] = np.float64(trade['quoteQty'])
+    return trades
+
+
+def parse_klines(klines: list):
+    for i in range(len(klines)):
+        klines[i] = [
+            klines[i][0],
+            np.float64(klines[i][1]),
+            np.float64(klines[i][2]),
+            np.float64(klines[i][3]),
+            np.float64(klines[i][4]),
+            np.float64(klines[i][5]),
+            klines[i][6],
+            np.float64(klines[i][7]),
+            klines[i][8],
+            np.float64(klines[i][9]),
+            np.float64(klines[i][10]),
+        ]
+    return klines
+
+
+KLINE_DTYPE = np.dtype([
+    ('open_time', np.int64),
+    ('open_price', np.float64),
+    ('high_price', np.float64),
+    ('low_price', np.float64),
+    ('close_price', np.float64),
+    ('volume', np.float64),
+    ('close_time', np.int64),
+    ('quote_volume', np.float64),
+    ('number_of_trades', np.int64),
+    ('taker_buy_volume', np.float64),
+    ('taker_buy_quote_volume', np.float64),
+])
+
+
+def decode_klines(klines: list):
+    """
+    Decode a klines payload into a columnar structured array (fields named as config.OHLC_COLUMNS).
+    Strings are converted by NumPy while the array is built, with no per-element Python float.
+    """
+    n_fields = len(KLINE_DTYPE.names)
+    return np.array([tuple(kline[:n_fields]) for kline in klines], dtype=KLINE_DTYPE)
+
+
+def parse_account_balance(account_balance: list):
+    """ Convert numeric fields to float and return the USDT balance (or None) """
+    for balance in account_balance:
+        balance['balance'] = np.float64(balance['balance'])
+        balance['crossWalletBalance'] = np.float64(balance['crossWalletBalance'])
+        balance['crossUnPnl'] = np.float64(balance['crossUnPnl'])
+        balance['availableBalance'] = np.float64(balance['availableBalance'])
+        balance['maxWithdrawAmount'] = np.float64(balance['maxWithdrawAmount'])
+        balance['updateTime'] = np.float64(balance['updateTime'])
+    for balance in account_balance:
+        if balance['asset'] == 'USDT':
+            return balance
+    return None
+
+
+def parse_order(order: dict):
+    for label in order.keys():
+        if label in ORDER_FLOAT_LABELS:
+            order[label] = np.float64(order[label])
+    return order
+
+
+def get_successful_orders(orders: list):
+    """ Returns [{'orderId', 'pair'}] for every order of a batch response that was actually created """
+    successful_orders = []
+    for order in orders:
+        if 'orderId' in order.keys():
+            order_info = {
+                'orderId': order['orderId'],
+                'pair': order['symbol']
+            }
+            successful_orders.append(order_info)
+    return successful_orders
+
+
+def encode_batch_orders(all_order_settings: list):
+    all_orders = [json.dumps(order) for order in all_order_settings]
+    return '[' + ','.join(all_orders) + ']'
+
+
+FINAL_ORDER_STATUSES = ['CANCELED', 'FILLED', 'EXPIRED']
+
+
+def is_order(response):
+    return isinstance(response, dict) and 'orderId' in response.keys()
+
+
+def is_batch_success(response, n_orders: int):
+    """ Returns True if every order of a batch has been created """
+    return isinstance(response, list) and len(get_successful_orders(response)) == n_orders
+
+
+def is_margin_type_set(response):
+    # -4046: 'No need to change margin type.'
+    return isinstance(response, dict) and response.get('code') in [200, -4046]
+
+
+def with_client_order_id(order_settings: dict):
+    """
+    Returns a copy of order_settings with a client order id.
+    The id makes order creation idempotent: after an ambiguous failure the order can be looked up
+    before being sent again.
+    """
+    order_settings = dict(order_settings)
+    if not 'newClientOrderId' in order_settings.keys():
+        order_settings['newClientOrderId'] = uuid.uuid4().hex
+    return order_settings
+
+
+def parse_order_update(order_update: dict):
+    """
+    Convert the 'o' field of an ORDER_TRADE_UPDATE user data stream event to the format returned by query_order
+    """
+    return {
+        'symbol': order_update['s'],
+        'orderId': order_update['i'],
+        'clientOrderId': order_update['c'],
+        'side': order_update['S'],
+        'positionSide': order_update['ps'],
+        'type': order_update['o'],
+        'origType': order_update['ot'],
+        'timeInForce': order_update['f'],
+        'status': order_update['X'],
+        'price': order_update['p'],
+        'avgPrice': order_update['ap'],
+        'stopPrice': order_update['sp'],
+        'origQty': order_update['q'],
+        'executedQty': order_update['z'],
+        'reduceOnly': order_update['R'],
+        'closePosition': order_update['cp'],
+        'workingType': order_update['wt'],
+        'updateTime': order_update['T'],
+    }
+
+
+def parse_account_update(account_update: dict):
+    """
+    Convert the 'a' field of an ACCOUNT_UPDATE user data stream event.
+
+    Response:
+        balances (dict): {asset: {'balance', 'crossWalletBalance'}}
+        positions (dict): {(symbol, positionSide): {'positionAmt', 'entryPrice', 'unRealizedProfit', 'marginType'}}
+    """
+    balances = dict()
+    for balance in account_update['B']:
+        balances[balance['a']] = {'balance': np.float64(balance['wb']), 'crossWalletBalance': np.float64(balance['cw'])}
+    positions = dict()
+    for position in account_update['P']:
+        positions[(position['s'], position['ps'])] = {
+            'positionAmt': np.float64(position['pa']),
+            'entryPrice': np.float64(position['ep']),
+            'unRealizedProfit': np.float64(position['up']),
+            'marginType': position['mt'],
+        }
+    return balances, positions
+
+
+def parse_position_information(positions: list):
+    for position in positions:
+        position['entryPrice'] = np.float64(position['entryPrice'])
+        position['isolatedMargin'] = np.float64(position['isolatedMargin'])
+        position['leverage'] = np.float64(position['leverage'])
+        position['liquidationPrice'] = np.float64(position['liquidationPrice'])
+        position['maxNotionalValue'] = np.float64(position['maxNotionalValue'])
+        position['markPrice'] = np.float64(position['markPrice'])
+        position['positionAmt'] = np.float64(position['positionAmt'])
+        position['unRealizedProfit'] = np.float64(position['unRealizedProfit'])
+        position['notional'] = np.float64(position['notional'])
+        position['isolatedWallet'] = np.float64(position['isolatedWallet'])
+        position['isAutoAddMargin'] = False if position['isAutoAddMargin'] == 'false' else True
+    return positions
+
+
+def parse_commission_rate(rates: dict):
+    rates['makerCommissionRate'] = np.float64(rates['makerCommissionRate'])
+    rates['takerCommissionRate'] = np.float64(rates['takerCommissionRate'])
+    return rates
+
+
 # GENERAL ENDPOINTS
 # -----------------
 
@@ -138,10 +710,7 @@ def get_order_book(pair: str, limit=20):
     url_path = '/fapi/v1/depth'
     params = {'symbol': pair.upper(), 'limit': limit}
     order_book = send_public_request(url_path, params)
-    for i in range(limit):
-        order_book['bids'][i] = [np.float64(order_book['bids'][i][0]), np.float64(order_book['bids'][i][1])]
-        order_book['asks'][i] = [np.float64(order_book['asks'][i][0]), np.float64(order_book['asks'][i][1])]
-    return order_book
+    return parse_order_book(order_book, limit)
 
 
 def get_recent_trades(pair: str, limit=20):
@@ -167,11 +736,7 @@ def get_recent_trades(pair: str, limit=20):
     url_path = '/fapi/v1/trades'
     params = {'symbol': pair.upper(), 'limit': limit}
     trades = send_public_request(url_path, params)
-    for trade in trades:
-        trade['price'] = np.float64(trade['price'])
-        trade['qty'] = np.float64(trade['qty'])
-        trade['quoteQty'] = np.float64(trade['quoteQty'])
-    return trades
+    return parse_trades(trades)
 
 
 def get_old_trades(pair: str, limit=100, fromId=None):
@@ -201,14 +766,10 @@ def get_old_trades(pair: str, limit=100, fromId=None):
         params['fromId'] = fromId
     trades = send_public_request(url_path, params)
     # Convert str to float
-    for trade in trades:
-        trade['price'] = np.float64(trade['price'])
-        trade['qty'] = np.float64(trade['qty'])
-        trade['quoteQty'] = np.float64(trade['quoteQty'])
-    return trades
+    return parse_trades(trades)
 
 
-def get_klines(pair: str, intervals: str, startTime=None, endTime=None, limit=1500):
+def get_klines(pair: str, intervals: str, startTime=None, endTime=None, limit=1500, as_array=False):
     """
     Get candlestick bars (called klines) for a symbol. Klines are uniquely identified by their open time.
     If startTime and endTime are not sent, the most recent klines are returned.
@@ -220,6 +781,7 @@ def get_klines(pair: str, intervals: str, startTime=None, endTime=None, limit=15
         startTime (unix timestamp): start time in ms unix timestamp (inclusive)
         endTime (unix timestamp): end time in ms unix timestamp (inclusive)
         limit (int): less or equal to 1500
+        as_array (bool): return a structured array of KLINE_DTYPE instead of a list of lists
 
     Response:
         list of lists [
@@ -245,25 +807,13 @@ def get_klines(pair: str, intervals: str, startTime=None, endTime=None, limit=15
     if endTime != None:
         params['endTime'] = endTime
     klines = send_public_request(url_path, params)
+    if as_array:
+        return decode_klines(klines)
     # Convert str to float
-    for i in range(len(klines)):
-        klines[i] = [
-            klines[i][0],
-            np.float64(klines[i][1]),
-            np.float64(klines[i][2]),
-            np.float64(klines[i][3]),
-            np.float64(klines[i][4]),
-            np.float64(klines[i][5]),
-            klines[i][6],
-            np.float64(klines[i][7]),
-            klines[i][8],
-            np.float64(klines[i][9]),
-            np.float64(klines[i][10]),
-        ]
-    return klines
+    return parse_klines(klines)
 
 
-def get_contract_klines(pair: str, intervals: str, contractType='PERPETUAL', startTime=None, endTime=None, limit=1500):
+def get_contract_klines(pair: str, intervals: str, contractType='PERPETUAL', startTime=None, endTime=None, limit=1500, as_array=False):
     """
     Get candlestick bars (called klines) for a specific contract type and symbol. Klines are uniquely identified by their open time.
     If startTime and endTime are not sent, the most recent klines are returned.
@@ -276,6 +826,7 @@ def get_contract_klines(pair: str, intervals: str, contractType='PERPETUAL', sta
         startTime (unix timestamp): start time in ms unix timestamp (inclusive)
         endTime (unix timestamp): end time in ms unix timestamp (inclusive)
         limit (int): less or equal to 1500
+        as_array (bool): return a structured array of KLINE_DTYPE instead of a list of lists
 
     Response:
         list of lists [
@@ -301,22 +852,10 @@ def get_contract_klines(pair: str, intervals: str, contractType='PERPETUAL', sta
     if endTime != None:
         params['endTime'] = endTime
     klines = send_public_request(url_path, params)
+    if as_array:
+        return decode_klines(klines)
     # Convert str to float
-    for i in range(len(klines)):
-        klines[i] = [
-            klines[i][0],
-            np.float64(klines[i][1]),
-            np.float64(klines[i][2]),
-            np.float64(klines[i][3]),
-            np.float64(klines[i][4]),
-            np.float64(klines[i][5]),
-            klines[i][6],
-            np.float64(klines[i][7]),
-            klines[i][8],
-            np.float64(klines[i][9]),
-            np.float64(klines[i][10]),
-        ]
-    return klines
+    return parse_klines(klines)
 
 
 def get_price(pair: str):
@@ -336,6 +875,22 @@ def get_price(pair: str):
     return price
 
 
+def get_mark_price(pair: str):
+    """
+    Get mark price for a symbol (price used by Binance to trigger MARK_PRICE conditional orders).
+
+    Arguments:
+        pair (str): single pair
+
+    Response:
+        markPrice (float)
+    """
+    url_path = '/fapi/v1/premiumIndex'
+    params = {'symbol': pair}
+    premium_index = send_public_request(url_path, params)
+    return np.float64(premium_index['markPrice'])
+
+
 # ACCOUNT ENDPOINTS
 # -----------------
 
@@ -365,17 +920,7 @@ def get_futures_account_balance(recvWindow=1500):
     params = {'recvWindow': recvWindow}
     account_balance = send_signed_request('GET', url_path, params)
     # convert numeric fields to float
-    for balance in account_balance:
-        balance['balance'] = np.float64(balance['balance'])
-        balance['crossWalletBalance'] = np.float64(balance['crossWalletBalance'])
-        balance['crossUnPnl'] = np.float64(balance['crossUnPnl'])
-        balance['availableBalance'] = np.float64(balance['availableBalance'])
-        balance['maxWithdrawAmount'] = np.float64(balance['maxWithdrawAmount'])
-        balance['updateTime'] = np.float64(balance['updateTime'])
-    for balance in account_balance:
-        if balance['asset'] == 'USDT':
-            return balance
-    return None
+    return parse_account_balance(account_balance)
 
 
 def is_hedge_mode(recvWindow=1500):
@@ -460,16 +1005,14 @@ def create_order(order_settings: dict):
         }
     """
     url_path = '/fapi/v1/order'
-    order = send_signed_request('POST', url_path, order_settings)
-    if not 'orderId' in order.keys():
-        print(f'Error in Binance_API.create_order()\nOrder creation failed\n{order}')
-        return create_order(order_settings)
-
-    labels_to_convert = ['cumQty', 'cumQuote', 'executedQty', 'avgPrice', 'origQty', 'price', 'stopPrice', 'activatePrice', 'priceRate']
-    for label in order.keys():
-        if label in labels_to_convert:
-            order[label] = np.float64(order[label])
-    return order
+    order_settings = with_client_order_id(order_settings)
+    order = retries.call_with_retry(
+        'create_order',
+        send=lambda: send_signed_request('POST', url_path, order_settings),
+        is_success=is_order,
+        recover=lambda: find_order(order_settings['symbol'], order_settings['newClientOrderId'])
+    )
+    return parse_order(order)
 
 
 def place_multiple_orders(all_order_settings: list, recvWindow=1500):
@@ -520,35 +1063,61 @@ def place_multiple_orders(all_order_settings: list, recvWindow=1500):
             "priceProtect": true            // if conditional order trigger is protected   
         }
     """
-    url_path = '/fapi/v1/batchOrders'
     if len(all_order_settings) > 5 or len(all_order_settings) < 1:
         return None
-    all_orders = [json.dumps(order) for order in all_order_settings]
-    all_orders = '[' + ','.join(all_orders) + ']'
-    params = {'batchOrders': all_orders, 'recvWindow': recvWindow}
-    orders = send_signed_request('POST', url_path, params)
+    return send_multiple_orders(prepare_multiple_orders(all_order_settings, recvWindow))
+
+
+def prepare_multiple_orders(all_order_settings: list, recvWindow=1500):
+    """
+    Assign client order ids to a batch of orders and encode it, ahead of sending it with send_multiple_orders.
+
+    Response:
+        {
+            'orders' (list of dict): order settings with their client order ids
+            'params' (dict): request payload
+            'query_string' (str): encoded payload, without timestamp nor signature
+        }
+    """
+    all_order_settings = [with_client_order_id(order_settings) for order_settings in all_order_settings]
+    params = {'batchOrders': encode_batch_orders(all_order_settings), 'recvWindow': recvWindow}
+    return {'orders': all_order_settings, 'params': params, 'query_string': encode_signed_payload(params)}
 
-    # Check that all orders jave been successfully created simultaneously
-    successful_orders = []
-    for order in orders:
-        if 'orderId' in order.keys():
-            order_info = {
-                'orderId': order['orderId'],
-                'pair': order['symbol']
-            }
-            successful_orders.append(order_info)
-    if len(successful_orders) != len(all_order_settings):
-        for order in successful_orders:
-            cancel_order(order['pair'], order['orderId'])
-        print(f'Error in Binance_API.place_multiple_orders()\nOrders creation failed\n{orders}')
-        return place_multiple_orders(all_order_settings)
-
-    labels_to_convert = ['cumQty', 'cumQuote', 'executedQty', 'avgPrice', 'origQty', 'price', 'stopPrice', 'activatePrice', 'priceRate']
-    for i in range(len(orders)):
-        for label in orders[i].keys():
-            if label in labels_to_convert:
-                orders[i][label] = np.float64(orders[i][label])
-    return orders
+
+def send_multiple_orders(batch: dict):
+    """
+    Send a batch prepared by prepare_multiple_orders: only a timestamp and a signature are computed before posting.
+
+    Response:
+        list of orders, see place_multiple_orders
+    """
+    url_path = '/fapi/v1/batchOrders'
+    all_order_settings = batch['orders']
+
+    def send():
+        orders = send_signed_request('POST', url_path, batch['params'], batch['query_string'])
+        # Check that all orders jave been successfully created simultaneously, else undo the partial batch
+        if isinstance(orders, list) and not is_batch_success(orders, len(all_order_settings)):
+            for order in get_successful_orders(orders):
+                cancel_order(order['pair'], order['orderId'])
+        return orders
+
+    def recover():
+        orders = [find_order(order['symbol'], order['newClientOrderId']) for order in all_order_settings]
+        if all(order is not None for order in orders):
+            return orders
+        for order in orders:
+            if order is not None:
+                cancel_order(order['symbol'], order['orderId'])
+        return None
+
+    orders = retries.call_with_retry(
+        'place_multiple_orders',
+        send=send,
+        is_success=lambda response: is_batch_success(response, len(all_order_settings)),
+        recover=recover
+    )
+    return [parse_order(order) for order in orders]
 
 
 def query_order(pair: str, orderId: int, recvWindow=1500):
@@ -565,11 +1134,24 @@ def query_order(pair: str, orderId: int, recvWindow=1500):
     """
     url_path = '/fapi/v1/order'
     params = {'symbol': pair, 'orderId': orderId, 'recvWindow': recvWindow}
+    return retries.call_with_retry(
+        'query_order',
+        send=lambda: send_signed_request('GET', url_path, params),
+        is_success=is_order
+    )
+
+
+def find_order(pair: str, clientOrderId: str, recvWindow=1500):
+    """
+    Look an order up by its client order id, without retrying.
+
+    Response:
+        order, or None if Binance does not know this order
+    """
+    url_path = '/fapi/v1/order'
+    params = {'symbol': pair, 'origClientOrderId': clientOrderId, 'recvWindow': recvWindow}
     order = send_signed_request('GET', url_path, params)
-    if not 'orderId' in order.keys():
-        print(f'Error in Binance_API.query_order()\nOrder query failed\n{order}')
-        return query_order(pair, orderId)
-    return order
+    return order if is_order(order) else None
 
 
 def query_current_all_open_orders(pair: str, recvWindow=1500):
@@ -604,17 +1186,65 @@ def cancel_order(pair: str, orderId: int, recvWindow=1500):
     """
     url_path = '/fapi/v1/order'
     params = {'symbol': pair, 'orderId': orderId, 'recvWindow': recvWindow}
-    response = send_signed_request('DELETE', url_path, params)
-    if 'orderId' in response.keys() and 'status' in response.keys():
-        if response['orderId'] == orderId and response['status'] == 'CANCELED':
-            return response    
-    elif not ('orderId' in response.keys() and 'status' in response.keys()):
-        querried_order = query_order(pair, orderId)
-        if querried_order['status'] == 'CANCELED':
-            return querried_order
-        print(f'Error in Binance_API.cancel_order()\nOrder cancellation failed\n{response}')
-        return cancel_order(pair, orderId)
 
+    def send():
+        response = send_signed_request('DELETE', url_path, params)
+        if not is_order(response):
+            # The order may have been cancelled by a previous attempt, or filled in the meantime
+            querried_order = query_order(pair, orderId)
+            if querried_order['status'] in FINAL_ORDER_STATUSES:
+                return querried_order
+        return response
+
+    return retries.call_with_retry(
+        'cancel_order',
+        send=send,
+        is_success=lambda response: is_order(response) and response['status'] in FINAL_ORDER_STATUSES
+    )
+
+
+def cancel_multiple_orders(pair: str, orderIds: list, recvWindow=1500):
+    """
+    Cancel up to 10 active orders in a single request.
+
+    Arguments:
+        pair (str): single pair
+        orderIds (list of int): Ids of the orders to cancel
+        recvWindow (int): time in milliseconds after which the request must be aborted
+
+    Response:
+        list of orders details, in the same order as orderIds
+    """
+    url_path = '/fapi/v1/batchOrders'
+    if len(orderIds) > 10 or len(orderIds) < 1:
+        return []
+    params = {'symbol': pair, 'orderIdList': json.dumps(orderIds).replace(' ', ''), 'recvWindow': recvWindow}
+
+    def send():
+        response = send_signed_request('DELETE', url_path, params)
+        if not isinstance(response, list):
+            return response
+        # Orders which could not be cancelled may have been filled or cancelled in the meantime
+        return [order if is_order(order) else query_order(pair, orderId) for orderId, order in zip(orderIds, response)]
+
+    return retries.call_with_retry(
+        'cancel_multiple_orders',
+        send=send,
+        is_success=lambda response: isinstance(response, list) and all(is_order(order) and order['status'] in FINAL_ORDER_STATUSES for order in response)
+    )
+
+
+def replace_orders(pair: str, orderIds: list, all_order_settings: list, recvWindow=1500):
+    """
+    Replace active orders by new ones with one batch of orders and one batch of cancellations.
+    New orders are placed first so that a position is never left without a working stop.
+
+    Response:
+        [placed orders, cancelled orders]
+    """
+    placed_orders = place_multiple_orders(all_order_settings, recvWindow)
+    cancelled_orders = cancel_multiple_orders(pair, orderIds, recvWindow)
+    return [placed_orders, cancelled_orders]
 
 
 def cancel_all_open_orders(pair: str, recvWindow=1500):
@@ -667,7 +1297,7 @@ def change_margin_type(pair: str, marginType: str, recvWindow=1500):
         recvWindow (int): time in milliseconds after which the request must be aborted.
 
     Response:
-        True if margin type changed successfully, else False
+        True once margin type is set (raises retries.RetryError if it cannot be set)
     """
     # Check if marginType needs to be changed
     current_marginType = get_current_position_information(pair)[0]['marginType']
@@ -676,11 +1306,12 @@ def change_margin_type(pair: str, marginType: str, recvWindow=1500):
         return True
     url_path = '/fapi/v1/marginType'
     params = {'symbol': pair, 'marginType': marginType, 'recvWindow': recvWindow}
-    response = send_signed_request('POST', url_path, params)
-    if not response['code'] == '200':
-        return change_margin_type(pair, marginType)
-    else:
-        return response['code'] == '200'
+    retries.call_with_retry(
+        'change_margin_type',
+        send=lambda: send_signed_request('POST', url_path, params),
+        is_success=is_margin_type_set
+    )
+    return True
 
 
 def get_current_position_information(pair: str, recvWindow=1500):
@@ -711,19 +1342,7 @@ def get_current_position_information(pair: str, recvWindow=1500):
     params = {'symbol': pair, 'recvWindow': recvWindow}
     positions = send_signed_request('GET', url_path, params)
     # Convert to floats
-    for position in positions:
-        position['entryPrice'] = np.float64(position['entryPrice'])
-        position['isolatedMargin'] = np.float64(position['isolatedMargin'])
-        position['leverage'] = np.float64(position['leverage'])
-        position['liquidationPrice'] = np.float64(position['liquidationPrice'])
-        position['maxNotionalValue'] = np.float64(position['maxNotionalValue'])
-        position['markPrice'] = np.float64(position['markPrice'])
-        position['positionAmt'] = np.float64(position['positionAmt'])
-        position['unRealizedProfit'] = np.float64(position['unRealizedProfit'])
-        position['notional'] = np.float64(position['notional'])
-        position['isolatedWallet'] = np.float64(position['isolatedWallet'])
-        position['isAutoAddMargin'] = False if position['isAutoAddMargin'] == 'false' else True
-    return positions
+    return parse_position_information(positions)
 
 
 def is_margin_cross(pair: str, recvWindow=1500):
@@ -741,12 +1360,34 @@ def get_commission_rate(pair: str, recvWindow=1500):
     """
     url_path = '/fapi/v1/commissionRate'
     params = {'symbol': pair, 'recvWindow': recvWindow}
-    try:
-        rates = send_signed_request('GET', url_path, params)
-        rates['makerCommissionRate'] = np.float64(rates['makerCommissionRate'])
-        rates['takerCommissionRate'] = np.float64(rates['takerCommissionRate'])
-        return rates
-    except:
-        return get_commission_rate(pair, recvWindow)
-    
-    
\ No newline at end of file
+    rates = retries.call_with_retry(
+        'get_commission_rate',
+        send=lambda: send_signed_request('GET', url_path, params),
+        is_success=lambda response: isinstance(response, dict) and 'takerCommissionRate' in response.keys()
+    )
+    return parse_commission_rate(rates)
+
+
+# USER DATA STREAM ENDPOINTS
+# --------------------------
+
+def create_listen_key():
+    """
+    Start a user data stream, or extend the validity of the active one.
+
+    Response:
+        listenKey (str): valid for 60 minutes unless kept alive
+    """
+    response = send_api_key_request('POST', '/fapi/v1/listenKey')
+    return response['listenKey']
+
+
+def keep_alive_listen_key():
+    """ Extend the validity of the active user data stream by 60 minutes """
+    response = send_api_key_request('PUT', '/fapi/v1/listenKey')
+    return response == {}
+
+
+def close_listen_key():
+    response = send_api_key_request('DELETE', '/fapi/v1/listenKey')
+    return response == {}
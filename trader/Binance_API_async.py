@@ -0,0 +1,425 @@
+# SSX999 Project Hedge
+
+# Augustin BRISSART
+# GitHub: @augustin999
+
+# June 2021
+
+
+import json
+import numpy as np
+import atexit
+import asyncio
+import threading
+import aiohttp
+
+try:
+    from trader import Binance_API
+    from trader import config
+    from trader import retries
+except:
+    import Binance_API
+    import config
+    import retries
+
+
+# SETTING UP CLIENT
+# -----------------
+
+class AsyncClient(object):
+    """
+    aiohttp counterpart of Binance_API.HTTPClient.
+    The session is opened lazily inside the running event loop and kept alive between calls.
+    """
+
+    def __init__(self, pool_maxsize=config.HTTP_POOL_MAXSIZE,
+                 connect_timeout=config.HTTP_CONNECT_TIMEOUT, read_timeout=config.HTTP_READ_TIMEOUT):
+        self.pool_maxsize = pool_maxsize
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.session = None
+        return
+
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_maxsize)
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={
+                    'Content-Type': 'application/json;charset=utf-8',
+                    'X-MBX-APIKEY': Binance_API.KEY
+                }
+            )
+        return self.session
+
+    async def request(self, http_method: str, url: str):
+        async with self.get_session().request(http_method, url) as response:
+            Binance_API.LIMITER.update(response.headers, response.status)
+            return await response.json(content_type=None)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+        return
+
+
+CLIENT = AsyncClient()
+
+
+# RUNNING COROUTINES FROM SYNCHRONOUS CODE
+# ----------------------------------------
+# A single background event loop is kept for the lifetime of the process so that
+# the aiohttp session (and its pooled connections) survives between two calls.
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name='binance-async', daemon=True)
+            thread.start()
+    return _loop
+
+
+def close():
+    """ Close the aiohttp session if the background event loop was ever started """
+    if _loop is not None and _loop.is_running():
+        run(CLIENT.close())
+    return
+
+
+atexit.register(close)
+
+
+def run(coroutine):
+    """ Run a coroutine on the background event loop and block until its result is available """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result()
+
+
+async def gather(*coroutines, return_exceptions=False):
+    return await asyncio.gather(*coroutines, return_exceptions=return_exceptions)
+
+
+def run_concurrently(*coroutines, return_exceptions=False):
+    """
+    Run independent coroutines concurrently from synchronous code.
+
+    Arguments:
+        return_exceptions (bool): return the exception of a failed coroutine in its place, instead of raising it
+
+    Response:
+        list of results, in the same order as the given coroutines
+    """
+    return run(gather(*coroutines, return_exceptions=return_exceptions))
+
+
+# SENDING REQUESTS
+# ----------------
+
+async def acquire(http_method: str, url_path: str, payload={}):
+    """ Wait without blocking the event loop until the request fits in the rate limiter budget """
+    delay = Binance_API.LIMITER.reserve(http_method, url_path, payload)
+    while delay > 0:
+        Binance_API.LIMITER.record_delay(http_method, url_path, delay)
+        await asyncio.sleep(delay)
+        delay = Binance_API.LIMITER.reserve(http_method, url_path, payload)
+    return
+
+
+async def send_signed_request(http_method: str, url_path: str, payload={}):
+    """ Asynchronous counterpart of Binance_API.send_signed_request """
+    if Binance_API.CLOCK.is_stale():
+        # Synchronising the clock relies on the blocking client: keep it out of the event loop
+        await asyncio.get_event_loop().run_in_executor(None, Binance_API.CLOCK.now)
+    query_string = Binance_API.encode_signed_payload(payload)
+    await acquire(http_method, url_path, payload)
+    url = Binance_API.build_signed_url(url_path, query_string)
+    response = await CLIENT.request(http_method, url)
+    if Binance_API.is_timestamp_error(response):
+        await asyncio.get_event_loop().run_in_executor(None, Binance_API.CLOCK.sync)
+        await acquire(http_method, url_path, payload)
+        url = Binance_API.build_signed_url(url_path, query_string)
+        response = await CLIENT.request(http_method, url)
+    return response
+
+
+async def send_public_request(url_path: str, payload={}):
+    """ Asynchronous counterpart of Binance_API.send_public_request """
+    await acquire('GET', url_path, payload)
+    url = Binance_API.build_public_url(url_path, payload)
+    return await CLIENT.request('GET', url)
+
+
+async def send_api_key_request(http_method: str, url_path: str, payload={}):
+    """ Asynchronous counterpart of Binance_API.send_api_key_request """
+    await acquire(http_method, url_path, payload)
+    url = Binance_API.build_public_url(url_path, payload)
+    return await CLIENT.request(http_method, url)
+
+
+# GENERAL ENDPOINTS
+# -----------------
+
+async def test_connectivity():
+    ping = await send_public_request('/fapi/v1/ping')
+    return ping == {}
+
+
+async def get_server_time():
+    response = await send_public_request('/fapi/v1/time')
+    return response['serverTime']
+
+
+async def get_exchange_info():
+    return await send_public_request('/fapi/v1/exchangeInfo')
+
+
+# MARKET ENDPOINTS
+# ----------------
+
+async def get_order_book(pair: str, limit=20):
+    params = {'symbol': pair.upper(), 'limit': limit}
+    order_book = await send_public_request('/fapi/v1/depth', params)
+    return Binance_API.parse_order_book(order_book, limit)
+
+
+async def get_recent_trades(pair: str, limit=20):
+    params = {'symbol': pair.upper(), 'limit': limit}
+    trades = await send_public_request('/fapi/v1/trades', params)
+    return Binance_API.parse_trades(trades)
+
+
+async def get_old_trades(pair: str, limit=100, fromId=None):
+    params = {'symbol': pair.upper(), 'limit': limit}
+    if fromId != None:
+        params['fromId'] = fromId
+    trades = await send_public_request('/fapi/v1/historicalTrades', params)
+    return Binance_API.parse_trades(trades)
+
+
+async def get_klines(pair: str, intervals: str, startTime=None, endTime=None, limit=1500, as_array=False):
+    params = {'symbol': pair.upper(), 'interval': intervals, 'limit': limit}
+    if startTime != None:
+        params['startTime'] = startTime
+    if endTime != None:
+        params['endTime'] = endTime
+    klines = await send_public_request('/fapi/v1/klines', params)
+    if as_array:
+        return Binance_API.decode_klines(klines)
+    return Binance_API.parse_klines(klines)
+
+
+async def get_contract_klines(pair: str, intervals: str, contractType='PERPETUAL', startTime=None, endTime=None, limit=1500, as_array=False):
+    params = {'pair': pair.upper(), 'interval': intervals, 'limit': limit, 'contractType': contractType}
+    if startTime != None:
+        params['startTime'] = startTime
+    if endTime != None:
+        params['endTime'] = endTime
+    klines = await send_public_request('/fapi/v1/continuousKlines', params)
+    if as_array:
+        return Binance_API.decode_klines(klines)
+    return Binance_API.parse_klines(klines)
+
+
+async def get_price(pair: str):
+    ticker = await send_public_request('/fapi/v1/ticker/price', {'symbol': pair})
+    return np.float64(ticker['price'])
+
+
+async def get_mark_price(pair: str):
+    premium_index = await send_public_request('/fapi/v1/premiumIndex', {'symbol': pair})
+    return np.float64(premium_index['markPrice'])
+
+
+# ACCOUNT ENDPOINTS
+# -----------------
+
+async def get_futures_account_balance(recvWindow=1500):
+    account_balance = await send_signed_request('GET', '/fapi/v2/balance', {'recvWindow': recvWindow})
+    return Binance_API.parse_account_balance(account_balance)
+
+
+async def is_hedge_mode(recvWindow=1500):
+    response = await send_signed_request('GET', '/fapi/v1/positionSide/dual', {'recvWindow': recvWindow})
+    return response['dualSidePosition']
+
+
+async def create_order(order_settings: dict):
+    order_settings = Binance_API.with_client_order_id(order_settings)
+    order = await retries.call_with_retry_async(
+        'create_order',
+        send=lambda: send_signed_request('POST', '/fapi/v1/order', order_settings),
+        is_success=Binance_API.is_order,
+        recover=lambda: find_order(order_settings['symbol'], order_settings['newClientOrderId'])
+    )
+    return Binance_API.parse_order(order)
+
+
+async def place_multiple_orders(all_order_settings: list, recvWindow=1500):
+    if len(all_order_settings) > 5 or len(all_order_settings) < 1:
+        return None
+    all_order_settings = [Binance_API.with_client_order_id(order_settings) for order_settings in all_order_settings]
+    params = {'batchOrders': Binance_API.encode_batch_orders(all_order_settings), 'recvWindow': recvWindow}
+
+    async def send():
+        orders = await send_signed_request('POST', '/fapi/v1/batchOrders', params)
+        if isinstance(orders, list) and not Binance_API.is_batch_success(orders, len(all_order_settings)):
+            successful_orders = Binance_API.get_successful_orders(orders)
+            await gather(*[cancel_order(order['pair'], order['orderId']) for order in successful_orders])
+        return orders
+
+    async def recover():
+        orders = await gather(*[find_order(order['symbol'], order['newClientOrderId']) for order in all_order_settings])
+        if all(order is not None for order in orders):
+            return orders
+        await gather(*[cancel_order(order['symbol'], order['orderId']) for order in orders if order is not None])
+        return None
+
+    orders = await retries.call_with_retry_async(
+        'place_multiple_orders',
+        send=send,
+        is_success=lambda response: Binance_API.is_batch_success(response, len(all_order_settings)),
+        recover=recover
+    )
+    return [Binance_API.parse_order(order) for order in orders]
+
+
+async def query_order(pair: str, orderId: int, recvWindow=1500):
+    params = {'symbol': pair, 'orderId': orderId, 'recvWindow': recvWindow}
+    return await retries.call_with_retry_async(
+        'query_order',
+        send=lambda: send_signed_request('GET', '/fapi/v1/order', params),
+        is_success=Binance_API.is_order
+    )
+
+
+async def find_order(pair: str, clientOrderId: str, recvWindow=1500):
+    params = {'symbol': pair, 'origClientOrderId': clientOrderId, 'recvWindow': recvWindow}
+    order = await send_signed_request('GET', '/fapi/v1/order', params)
+    return order if Binance_API.is_order(order) else None
+
+
+async def query_orders(pair: str, orderIds: list, recvWindow=1500):
+    """
+    Check the status of several orders concurrently.
+
+    Response:
+        list of orders, in the same order as orderIds
+    """
+    return await gather(*[query_order(pair, orderId, recvWindow) for orderId in orderIds])
+
+
+async def query_current_all_open_orders(pair: str, recvWindow=1500):
+    orders = await send_signed_request('GET', '/fapi/v1/openOrders', {'symbol': pair, 'recvWindow': recvWindow})
+    return [{'orderId': order['orderId'], 'status': order['status']} for order in orders]
+
+
+async def cancel_order(pair: str, orderId: int, recvWindow=1500):
+    params = {'symbol': pair, 'orderId': orderId, 'recvWindow': recvWindow}
+
+    async def send():
+        response = await send_signed_request('DELETE', '/fapi/v1/order', params)
+        if not Binance_API.is_order(response):
+            querried_order = await query_order(pair, orderId)
+            if querried_order['status'] in Binance_API.FINAL_ORDER_STATUSES:
+                return querried_order
+        return response
+
+    return await retries.call_with_retry_async(
+        'cancel_order',
+        send=send,
+        is_success=lambda response: Binance_API.is_order(response) and response['status'] in Binance_API.FINAL_ORDER_STATUSES
+    )
+
+
+async def cancel_orders(pair: str, orderIds: list, recvWindow=1500):
+    """ Cancel several orders concurrently """
+    return await gather(*[cancel_order(pair, orderId, recvWindow) for orderId in orderIds])
+
+
+async def cancel_multiple_orders(pair: str, orderIds: list, recvWindow=1500):
+    if len(orderIds) > 10 or len(orderIds) < 1:
+        return []
+    params = {'symbol': pair, 'orderIdList': json.dumps(orderIds).replace(' ', ''), 'recvWindow': recvWindow}
+
+    async def send():
+        response = await send_signed_request('DELETE', '/fapi/v1/batchOrders', params)
+        if not isinstance(response, list):
+            return response
+        return await gather(*[
+            asyncio.sleep(0, order) if Binance_API.is_order(order) else query_order(pair, orderId)
+            for orderId, order in zip(orderIds, response)
+        ])
+
+    return await retries.call_with_retry_async(
+        'cancel_multiple_orders',
+        send=send,
+        is_success=lambda response: isinstance(response, list) and all(Binance_API.is_order(order) and order['status'] in Binance_API.FINAL_ORDER_STATUSES for order in response)
+    )
+
+
+async def replace_orders(pair: str, orderIds: list, all_order_settings: list, recvWindow=1500):
+    """ Asynchronous counterpart of Binance_API.replace_orders """
+    placed_orders = await place_multiple_orders(all_order_settings, recvWindow)
+    cancelled_orders = await cancel_multiple_orders(pair, orderIds, recvWindow)
+    return [placed_orders, cancelled_orders]
+
+
+async def create_and_query_order(order_settings: dict):
+    """ Send in a new order, then return its state as known by Binance once acknowledged """
+    order = await create_order(order_settings)
+    return await query_order(order_settings['symbol'], order['orderId'])
+
+
+async def cancel_all_open_orders(pair: str, recvWindow=1500):
+    response = await send_signed_request('DELETE', '/fapi/v1/allOpenOrders', {'symbol': pair, 'recvWindow': recvWindow})
+    return response['code'] == 200
+
+
+async def change_initial_leverage(pair: str, leverage: int, recvWindow=1500):
+    params = {'symbol': pair, 'leverage': leverage, 'recvWindow': recvWindow}
+    leverage_set = await send_signed_request('POST', '/fapi/v1/leverage', params)
+    leverage_set['maxNotionalValue'] = np.float64(leverage_set['maxNotionalValue'])
+    return leverage_set
+
+
+async def get_current_position_information(pair: str, recvWindow=1500):
+    positions = await send_signed_request('GET', '/fapi/v2/positionRisk', {'symbol': pair, 'recvWindow': recvWindow})
+    return Binance_API.parse_position_information(positions)
+
+
+async def is_margin_cross(pair: str, recvWindow=1500):
+    positions = await get_current_position_information(pair, recvWindow)
+    return positions[0]['marginType'] == 'cross'
+
+
+async def get_commission_rate(pair: str, recvWindow=1500):
+    params = {'symbol': pair, 'recvWindow': recvWindow}
+    rates = await retries.call_with_retry_async(
+        'get_commission_rate',
+        send=lambda: send_signed_request('GET', '/fapi/v1/commissionRate', params),
+        is_success=lambda response: isinstance(response, dict) and 'takerCommissionRate' in response.keys()
+    )
+    return Binance_API.parse_commission_rate(rates)
+
+
+# USER DATA STREAM ENDPOINTS
+# --------------------------
+
+async def create_listen_key():
+    response = await send_api_key_request('POST', '/fapi/v1/listenKey')
+    return response['listenKey']
+
+
+async def keep_alive_listen_key():
+    response = await send_api_key_request('PUT', '/fapi/v1/listenKey')
+    return response == {}
+
+
+async def close_listen_key():
+    response = await send_api_key_request('DELETE', '/fapi/v1/listenKey')
+    return response == {}
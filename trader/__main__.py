@@ -0,0 +1,13 @@
+# SSX999 Project Hedge
+
+# Augustin BRISSART
+# GitHub: @augustin999
+
+# June 2021
+
+
+from trader import daemon
+
+
+if __name__ == '__main__':
+    daemon.main()
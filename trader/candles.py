@@ -0,0 +1,192 @@
+# SSX999 Project Hedge
+
+# Augustin BRISSART
+# GitHub: @augustin999
+
+# June 2021
+
+
+import os
+import threading
+import numpy as np
+
+try:
+    from trader import Binance_API
+    from trader import config
+    from trader import env
+    from trader import utils
+except:
+    import Binance_API
+    import config
+    import env
+    import utils
+
+
+INTERVAL_MS = {
+    '1m': 60 * 1000,
+    '3m': 3 * 60 * 1000,
+    '5m': 5 * 60 * 1000,
+    '15m': 15 * 60 * 1000,
+    '30m': 30 * 60 * 1000,
+    '1h': 60 * 60 * 1000,
+    '2h': 2 * 60 * 60 * 1000,
+    '4h': 4 * 60 * 60 * 1000,
+    '6h': 6 * 60 * 60 * 1000,
+    '8h': 8 * 60 * 60 * 1000,
+    '12h': 12 * 60 * 60 * 1000,
+    '1d': 24 * 60 * 60 * 1000,
+    '3d': 3 * 24 * 60 * 60 * 1000,
+    '1w': 7 * 24 * 60 * 60 * 1000,
+}
+
+
+class CandleStore(object):
+    """
+    Append-only store of closed candles for one (pair, contract type, interval).
+
+    Candles are kept as fixed-size Binance_API.KLINE_DTYPE records in a binary file, in open_time order.
+    Reads are memory-mapped, so live trading and offline research can share the same files.
+    Updates only fetch candles closed after the last stored one.
+    Candles received on a market stream are appended directly (see streams.MarketStream).
+    On GCP, the file lives in the bucket and is memory-mapped from a local copy. Appends are composed onto the
+    bucket file, which is rewritten from the local copy once it holds CANDLES_MAX_COMPONENTS components.
+    """
+
+    def __init__(self, pair: str, interval: str, contractType='PERPETUAL', history=config.CANDLES_HISTORY):
+        self.pair = pair
+        self.interval = interval
+        self.contractType = contractType
+        self.interval_ms = INTERVAL_MS[interval]
+        self.history = history
+        self.name = f'{pair}_{contractType}_{interval}.bin'
+        self.path = config.klines_path / self.name
+        self.local_path = config.klines_cache_path / self.name
+        self.pulled = env.is_local()
+        self.last_open_time = None
+        self.lock = threading.RLock()
+        return
+
+    def pull(self):
+        """ Make the local copy match the bucket file (GCP only, once per process) """
+        os.makedirs(config.klines_cache_path, exist_ok=True)
+        size = utils.get_size(self.path)
+        local_size = os.path.getsize(self.local_path) if os.path.exists(self.local_path) else None
+        if size is None:
+            open(self.local_path, 'wb').close()
+        elif size != local_size:
+            utils.download_to_file(self.path, self.local_path)
+        self.pulled = True
+        return
+
+    def read(self):
+        """
+        Returns every stored candle as a read-only memory-mapped structured array.
+        """
+        if not self.pulled:
+            self.pull()
+        if not os.path.exists(self.local_path) or os.path.getsize(self.local_path) == 0:
+            return np.empty(0, dtype=Binance_API.KLINE_DTYPE)
+        return np.memmap(self.local_path, dtype=Binance_API.KLINE_DTYPE, mode='r')
+
+    def get_last_open_time(self):
+        if self.last_open_time is None:
+            candles = self.read()
+            if len(candles) > 0:
+                self.last_open_time = int(candles['open_time'][-1])
+        return self.last_open_time
+
+    def append(self, candles: np.ndarray):
+        if len(candles) == 0:
+            return
+        with self.lock:
+            self._append(candles)
+        return
+
+    def _append(self, candles: np.ndarray):
+        content = candles.astype(Binance_API.KLINE_DTYPE).tobytes()
+        if env.is_local():
+            os.makedirs(config.klines_path, exist_ok=True)
+            utils.append_bytes(content, self.local_path)
+        else:
+            if not self.pulled:
+                self.pull()
+            info = utils.get_info(self.path)
+            if info is not None and info['components'] >= config.CANDLES_MAX_COMPONENTS:
+                # A composite object cannot grow past 1024 components: it is written again as one object
+                with open(self.local_path, 'rb') as _file:
+                    utils.write_bytes(_file.read() + content, self.path)
+            else:
+                utils.append_bytes(content, self.path)
+            with open(self.local_path, 'ab') as _file:
+                _file.write(content)
+        self.last_open_time = int(candles['open_time'][-1])
+        return
+
+    def append_closed(self, candle):
+        """
+        Append one closed candle if it directly follows the last stored one.
+
+        Response:
+            True if appended, else False (the next update fetches it)
+        """
+        with self.lock:
+            last_open_time = self.get_last_open_time()
+            if last_open_time is None or int(candle['open_time']) != last_open_time + self.interval_ms:
+                return False
+            self._append(np.atleast_1d(candle))
+        return True
+
+    def update(self, server_time=None):
+        """
+        Fetch every candle closed since the last stored one, page by page, and append it.
+        An empty store is seeded with `history` candles.
+
+        Response:
+            number of candles appended
+        """
+        with self.lock:
+            return self._update(server_time)
+
+    def _update(self, server_time=None):
+        if not self.pulled:
+            self.pull()
+        server_time = Binance_API.get_synced_server_time() if server_time is None else server_time
+        last_open_time = self.get_last_open_time()
+        if last_open_time is None:
+            start = (server_time // self.interval_ms - self.history) * self.interval_ms
+        else:
+            start = last_open_time + self.interval_ms
+        n_appended = 0
+        # Nothing to fetch as long as the next candle is not closed
+        while start + self.interval_ms <= server_time:
+            candles = Binance_API.get_contract_klines(
+                self.pair, self.interval, contractType=self.contractType,
+                startTime=start, limit=1500, as_array=True
+            )
+            candles = candles[(candles['open_time'] >= start) & (candles['close_time'] < server_time)]
+            if len(candles) == 0:
+                break
+            self.append(candles)
+            n_appended += len(candles)
+            start = int(candles['open_time'][-1]) + self.interval_ms
+        return n_appended
+
+    def load(self, limit=None, update=True):
+        """
+        Returns the latest `limit` closed candles (all of them if limit is None), updating the store first.
+        """
+        if update:
+            self.update()
+        candles = self.read()
+        return candles if limit is None else candles[-limit:]
+
+
+_stores = dict()
+
+
+def get_store(pair: str, interval: str, contractType='PERPETUAL'):
+    """ Returns the store of a (pair, interval, contract type), shared across the process """
+    key = (pair, interval, contractType)
+    if not key in _stores.keys():
+        _stores[key] = CandleStore(pair, interval, contractType)
+    return _stores[key]
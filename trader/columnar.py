@@ -0,0 +1,310 @@
+# SSX999 Project Hedge
+
+# Augustin BRISSART
+# GitHub: @augustin999
+
+# June 2021
+
+
+import io
+import sys
+import json
+import time as tm
+import numpy as np
+import pandas as pd
+from typing import Union
+from pathy.base import Pathy
+from pathlib import Path
+
+try:
+    from trader import config
+    from trader import utils
+except:
+    import config
+    import utils
+
+
+# Columnar ledgers: rows are stored as compressed NumPy archives (one typed array per column),
+# partitioned by pair and by month: <columnar_path>/<ledger>/pair=BTCUSDT/month=2021-08/part-00001.npz
+# Every append writes new part files. A manifest (_manifest.json) lists the parts with their row count,
+# the min/max of their numeric columns and the distinct values of their text columns, so that queries
+# only read the partitions, files and columns they need.
+# The parts of a partition are merged into one once a month holds COLUMNAR_MAX_PARTS of them, and once the
+# month is over (on the first append to a later month of the pair): a month ends up as a single file.
+# Archives are written with numpy only (pyarrow is not a dependency of the project).
+
+FLOAT = 'float'
+INT = 'int' # missing values are stored as 0
+BOOL = 'bool'
+STR = 'str'
+
+MAX_DISTINCT_VALUES = 32 # text columns with more distinct values in a file are not used to skip it
+
+# {ledger name: ({column: type}, time column)}, columns which are not typed are stored as text
+SCHEMAS = {
+    'trade_ledger': ({
+        'entry time': FLOAT, 'exit time': FLOAT, 'id': INT, 'entry': FLOAT, 'exit': FLOAT, 'qty': FLOAT,
+        'leverage': INT, 'stop loss': FLOAT, 'take profit': FLOAT, 'actualised': BOOL, 'covered fees': INT,
+        'abs capital gain %': FLOAT, 'abs capital gain': FLOAT, 'capital gain': FLOAT, 'fees': FLOAT, 'net capital gain': FLOAT,
+    }, 'entry time'),
+    'order_ledger': ({
+        'orderId': INT, 'price': FLOAT, 'avgPrice': FLOAT, 'origQty': FLOAT, 'executedQty': FLOAT,
+        'cumQuote': FLOAT, 'stopPrice': FLOAT, 'time': INT, 'updateTime': INT,
+    }, 'updateTime'),
+    'account_balance': ({
+        'balance': FLOAT, 'crossWalletBalance': FLOAT, 'crossUnPnl': FLOAT, 'availableBalance': FLOAT,
+        'maxWithdrawAmount': FLOAT, 'marginAvailable': FLOAT, 'updateTime': INT,
+    }, 'updateTime'),
+    'entry_latency': ({
+        'boundary': INT, 'sent': INT, 'ack': INT, 'latency': INT, 'round trip': INT, 'clock round trip': FLOAT,
+    }, 'boundary'),
+}
+
+
+def to_ms(times):
+    """ Times in ms, for times in s or in ms (ledgers hold both) """
+    times = np.asarray(times, dtype=np.float64)
+    return np.where(times > 1e11, times, 1000 * times)
+
+
+def to_ms_bound(time):
+    if time is None:
+        return None
+    if isinstance(time, (int, float, np.number)):
+        return float(to_ms(time))
+    return float(1000 * pd.Timestamp(time).timestamp())
+
+
+def get_month(time_ms: float):
+    return pd.Timestamp(time_ms, unit='ms').strftime('%Y-%m')
+
+
+def to_array(values: list, kind: str):
+    if kind == FLOAT:
+        return np.array([to_float(value) for value in values], dtype=np.float64)
+    if kind == INT:
+        return np.array([int(to_float(value)) if not np.isnan(to_float(value)) else 0 for value in values], dtype=np.int64)
+    if kind == BOOL:
+        return np.array([value in [True, 'True', 'true', 1] for value in values], dtype=np.bool_)
+    return np.array(['' if is_missing(value) else str(value) for value in values], dtype=np.str_)
+
+
+def is_missing(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+def to_float(value):
+    try:
+        return float(value) if not is_missing(value) and value != '' else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class ColumnarStore(object):
+    """
+    Columnar storage of a ledger.
+
+    Attributes:
+        name (str): ledger name, see SCHEMAS
+        columns (list): columns of the ledger, followed by 'pair'
+        types (dict): {column: FLOAT, INT, BOOL or STR}
+        time_column (str): column the month partitions and time ranges apply to
+        root: directory of the ledger
+        manifest (dict): {'files': [file entries]}, loaded on first use
+    """
+
+    def __init__(self, name: str, columns: list, root: Union[Path, Pathy], pair=config.PAIR):
+        types, time_column = SCHEMAS[name]
+        self.name = name
+        self.columns = [column for column in columns if column != 'pair'] + ['pair']
+        self.types = {column: types.get(column, STR) for column in self.columns}
+        self.time_column = time_column
+        self.root = root
+        self.pair = pair
+        self.manifest = None
+        return
+
+    def get_manifest_path(self):
+        return self.root / '_manifest.json'
+
+    def load_manifest(self):
+        if self.manifest is None:
+            path = self.get_manifest_path()
+            self.manifest = json.loads(utils.read_bytes(path)) if utils.get_info(path) is not None else {'files': []}
+        return self.manifest
+
+    def get_partition(self, row: dict, now_ms: float):
+        time = to_float(row.get(self.time_column))
+        time_ms = now_ms if np.isnan(time) else float(to_ms(time))
+        pair = row.get('symbol') if not is_missing(row.get('symbol')) else self.pair
+        return str(pair), get_month(time_ms)
+
+    def get_stats(self, arrays: dict):
+        """ min/max of numeric columns (time column in ms) and distinct values of text columns """
+        stats = {'min': dict(), 'max': dict(), 'values': dict()}
+        for column, array in arrays.items():
+            kind = self.types[column]
+            if kind in [FLOAT, INT]:
+                values = to_ms(array) if column == self.time_column else array.astype(np.float64)
+                values = values[~np.isnan(values)]
+                if len(values) > 0:
+                    stats['min'][column], stats['max'][column] = float(values.min()), float(values.max())
+            elif kind == STR:
+                distinct = np.unique(array)
+                stats['values'][column] = distinct.tolist() if len(distinct) <= MAX_DISTINCT_VALUES else None
+        return stats
+
+    def append(self, rows: list):
+        """ Write rows (dicts keyed by column) as one new part file per partition """
+        if len(rows) == 0:
+            return
+        manifest = self.load_manifest()
+        now_ms = 1000 * tm.time()
+        partitions = dict()
+        for row in rows:
+            partitions.setdefault(self.get_partition(row, now_ms), []).append(row)
+
+        for (pair, month), partition_rows in partitions.items():
+            arrays = {column: to_array([row.get(column) for row in partition_rows], self.types[column]) for column in self.columns}
+            arrays['pair'] = np.array([pair] * len(partition_rows), dtype=np.str_)
+            manifest['files'].append(self.write_part(pair, month, arrays))
+
+        merged = []
+        for pair, month in self.get_partitions_to_compact(list(partitions.keys())):
+            merged += self.compact(pair, month)
+        utils.write_bytes(json.dumps(manifest, separators=(',', ':')).encode('utf-8'), self.get_manifest_path())
+        # Merged parts are deleted once the manifest no longer lists them
+        for path in merged:
+            utils.delete(self.root / path)
+        return
+
+    def get_parts(self, pair: str, month: str):
+        return [entry for entry in self.load_manifest()['files'] if entry['pair'] == pair and entry['month'] == month]
+
+    def write_part(self, pair: str, month: str, arrays: dict):
+        """ Write a part file of a partition, returns its manifest entry """
+        numbers = [int(entry['path'].rsplit('-', 1)[1].split('.')[0]) for entry in self.get_parts(pair, month)]
+        relative_path = f'pair={pair}/month={month}/part-{max(numbers, default=0) + 1:05d}.npz'
+        content = io.BytesIO()
+        np.savez_compressed(content, **{str(i): arrays[column] for i, column in enumerate(self.columns)})
+        utils.write_bytes(content.getvalue(), self.root / relative_path)
+        entry = {'path': relative_path, 'pair': pair, 'month': month, 'rows': len(arrays[self.columns[0]])}
+        entry.update(self.get_stats(arrays))
+        return entry
+
+    def get_partitions_to_compact(self, appended: list):
+        """
+        Partitions to merge after an append to the partitions appended: those holding COLUMNAR_MAX_PARTS parts,
+        and the months with several parts before the latest month appended to for their pair.
+        """
+        latest = dict()
+        for pair, month in appended:
+            latest[pair] = max(month, latest.get(pair, month))
+        counts = dict()
+        for entry in self.load_manifest()['files']:
+            key = (entry['pair'], entry['month'])
+            counts[key] = counts.get(key, 0) + 1
+        return [
+            (pair, month) for (pair, month), count in counts.items()
+            if count >= config.COLUMNAR_MAX_PARTS or (count > 1 and pair in latest.keys() and month < latest[pair])
+        ]
+
+    def compact(self, pair: str, month: str):
+        """
+        Merge the parts of a partition into one part file, in place of the first one in the manifest.
+
+        Response:
+            paths of the parts merged, to delete once the manifest is written
+        """
+        manifest = self.load_manifest()
+        parts = self.get_parts(pair, month)
+        if len(parts) <= 1:
+            return []
+        archives = [np.load(io.BytesIO(utils.read_bytes(self.root / entry['path'])), allow_pickle=False) for entry in parts]
+        arrays = {column: np.concatenate([archive[str(i)] for archive in archives]) for i, column in enumerate(self.columns)}
+        entry = self.write_part(pair, month, arrays)
+        index = manifest['files'].index(parts[0])
+        manifest['files'] = [part for part in manifest['files'] if not part in parts]
+        manifest['files'].insert(index, entry)
+        return [part['path'] for part in parts]
+
+    def is_relevant(self, entry: dict, start_ms, end_ms, pairs, where: dict):
+        """ False if the statistics of a part file show it holds no row matching the query """
+        if pairs is not None and not entry['pair'] in pairs:
+            return False
+        if start_ms is not None and (entry['month'] < get_month(start_ms) or entry['max'].get(self.time_column, np.inf) < start_ms):
+            return False
+        if end_ms is not None and (entry['month'] > get_month(end_ms) or entry['min'].get(self.time_column, -np.inf) > end_ms):
+            return False
+        for column, value in where.items():
+            values = entry['values'].get(column)
+            if values is not None and not str(value) in values:
+                return False
+        return True
+
+    def query(self, start=None, end=None, columns=None, where=None, pairs=None):
+        """
+        Rows of the ledger matching a query. Only the part files which may hold matching rows are read,
+        and only the columns needed.
+
+        Arguments:
+            start, end (pd.Timestamp, str or time in s or ms): time range of the time column (bounds included)
+            columns (list): columns returned (all columns if None)
+            where (dict): {column: value} equality filters, eg. {'type': 'LONG', 'triggered on': 'TAKE PROFIT'}
+            pairs (list): pairs returned (all pairs if None)
+
+        Response:
+            DataFrame of the matching rows, in the order they were written
+        """
+        where = dict() if where is None else where
+        columns = self.columns if columns is None else list(columns)
+        needed = list(dict.fromkeys(columns + list(where.keys()) + [self.time_column]))
+        start_ms, end_ms = to_ms_bound(start), to_ms_bound(end)
+
+        frames = []
+        for entry in self.load_manifest()['files']:
+            if not self.is_relevant(entry, start_ms, end_ms, pairs, where):
+                continue
+            archive = np.load(io.BytesIO(utils.read_bytes(self.root / entry['path'])), allow_pickle=False)
+            arrays = {column: archive[str(self.columns.index(column))] for column in needed}
+            mask = np.ones(entry['rows'], dtype=np.bool_)
+            times = to_ms(arrays[self.time_column]) if self.types[self.time_column] in [FLOAT, INT] else None
+            if start_ms is not None and times is not None:
+                mask &= times >= start_ms
+            if end_ms is not None and times is not None:
+                mask &= times <= end_ms
+            for column, value in where.items():
+                mask &= arrays[column] == (str(value) if self.types[column] == STR else value)
+            frames.append(pd.DataFrame({column: arrays[column][mask] for column in columns}))
+        if len(frames) == 0:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
+
+    def read(self):
+        return self.query()
+
+
+def convert_csv(path: Union[Path, Pathy], store: ColumnarStore):
+    """
+    One-shot conversion of a CSV ledger (eg. an existing trade_ledger.csv) into a columnar store.
+
+    Response:
+        number of rows converted
+    """
+    df = utils.read_csv(path)
+    rows = [{column: value for column, value in row.items() if not is_missing(value)} for row in df.to_dict('records')]
+    store.append(rows)
+    return len(rows)
+
+
+if __name__ == '__main__':
+    # python -m trader.columnar <ledger name> <csv path>, eg. python -m trader.columnar trade_ledger measurements/trade_ledger.csv
+    name, path = sys.argv[1], sys.argv[2]
+    columns = {
+        'trade_ledger': config.TRADE_LEDGER_COLUMNS,
+        'order_ledger': config.ORDER_LEDGER_COLUMNS,
+        'account_balance': config.ACCOUNT_BALANCE_COLUMNS,
+        'entry_latency': config.ENTRY_LATENCY_COLUMNS,
+    }[name]
+    store = ColumnarStore(name, columns, config.columnar_path / name)
+    print(f'{convert_csv(path, store)} rows of {path} converted into {store.root}')
@@ -7,6 +7,7 @@
 
 
 import os
+import tempfile
 from pathlib import Path
 from pathy import Pathy
 
@@ -27,7 +28,15 @@ if env.is_local():
     order_ledger_path = measurements_path / 'order_ledger.csv'
     trade_ledger_path = measurements_path / 'trade_ledger.csv'
     balance_path = measurements_path / 'account_balance.csv'
-    TradedCurrency_path = measurements_path / 'TradedCurrency.pickle'
+    entry_latency_path = measurements_path / 'entry_latency.csv'
+    TradedCurrency_path = measurements_path / 'TradedCurrency.json'
+    TradedCurrency_journal_path = measurements_path / 'TradedCurrency.journal'
+    legacy_TradedCurrency_path = measurements_path / 'TradedCurrency.pickle'
+    klines_path = measurements_path / 'klines'
+    klines_cache_path = klines_path
+    ledger_spool_path = measurements_path / 'ledger.spool'
+    columnar_path = measurements_path / 'columnar'
+    database_path = measurements_path / 'hedge.sqlite3'
 
 else:
     gcs_bucket = env.get_var('GCP_BUCKET')
@@ -41,7 +50,19 @@ else:
     order_ledger_path = measurements_path / 'order_ledger.csv'
     trade_ledger_path = measurements_path / 'trade_ledger.csv'
     balance_path = measurements_path / 'account_balance.csv'
-    TradedCurrency_path = Pathy('measurements') / 'TradedCurrency.pickle'
+    entry_latency_path = measurements_path / 'entry_latency.csv'
+    TradedCurrency_path = Pathy('measurements') / 'TradedCurrency.json'
+    TradedCurrency_journal_path = Pathy('measurements') / 'TradedCurrency.journal'
+    legacy_TradedCurrency_path = Pathy('measurements') / 'TradedCurrency.pickle'
+    klines_path = Pathy('measurements') / 'klines'
+    # Candles are memory-mapped from a local copy of the bucket files
+    klines_cache_path = Path(tempfile.gettempdir()) / 'klines'
+    # Ledger rows waiting for the end of the tick are spooled on the local disk
+    ledger_spool_path = Path(tempfile.gettempdir()) / 'ledger.spool'
+    columnar_path = measurements_path / 'columnar'
+    # SQLite needs a local disk: the SQLite backends are meant for local and daemon deployments,
+    # the database does not outlive the instance here
+    database_path = Path(tempfile.gettempdir()) / 'hedge.sqlite3'
 
 # ****************** BEGINNING OF PARAMETERS TO SET ****************** #
 BASE = 'BTC'
@@ -60,6 +81,47 @@ REAL_MODE = False # True will perform the strategy on Binance
 
 FAST_PERIOD = 4
 SLOW_PERIOD = 10
+
+HTTP_POOL_CONNECTIONS = 4 # number of hosts kept in the connection pool
+HTTP_POOL_MAXSIZE = 10 # number of keep-alive connections per host
+HTTP_CONNECT_TIMEOUT = 3.05 # seconds
+HTTP_READ_TIMEOUT = 10 # seconds
+
+CLOCK_RESYNC_INTERVAL = 300 # seconds between two server time synchronisations
+CLOCK_SYNC_SAMPLES = 3 # server time requests per synchronisation
+
+REQUEST_WEIGHT_LIMIT = 2400 # Binance Futures request weight per minute
+ORDER_COUNT_LIMIT_10S = 300 # orders per 10 seconds
+ORDER_COUNT_LIMIT_1M = 1200 # orders per minute
+ACCOUNT_WEIGHT_SHARE = 0.9 # share of the weight budget account queries may use
+MARKET_DATA_WEIGHT_SHARE = 0.7 # share of the weight budget market data polling may use
+
+RETRY_MAX_ATTEMPTS = 6 # attempts per request before giving up
+RETRY_BASE_DELAY = 0.25 # seconds, doubled on every attempt (with random jitter)
+RETRY_MAX_DELAY = 8 # seconds
+INVOCATION_BUDGET = 520 # seconds, Cloud Function timeout (540s) minus a safety margin
+
+CANDLES_HISTORY = 1500 # candles fetched to seed an empty candle store
+CANDLES_MAX_COMPONENTS = 1000 # appends composed onto a candle file in the bucket before it is rewritten from the local copy (GCS allows 1024 components)
+
+DAEMON_PRICE_POLL_INTERVAL = 1 # seconds between two ticker prices in daemon mode (python -m trader)
+DAEMON_CANDLE_DELAY = 0.5 # seconds waited after a candle boundary before fetching the closed candle
+DAEMON_TICK_BUDGET = 60 # seconds, retry deadline of one daemon tick
+DAEMON_USE_STREAM = True # daemon mode: react to market streams instead of polling the ticker
+
+STREAM_STALE_AFTER = 5 # seconds without message before stream data falls back on REST requests
+STREAM_RECONNECT_MAX_DELAY = 30 # seconds
+USER_STREAM_KEEPALIVE_INTERVAL = 1800 # seconds, a listenKey expires after 60 minutes without keepalive
+
+ENTRY_ARM_LEAD = 5 # seconds before next_timestamp at which entry orders are prepared
+
+STATE_JOURNAL_MAX_ENTRIES = 240 # state changes journaled before a new snapshot of the state is written
+
+LEDGER_SEGMENT_SIZE = 1000000 # bytes, a new ledger segment is started past this size
+LEDGER_MAX_COMPONENTS = 1000 # appends composed onto a ledger segment in the bucket (GCS allows 1024 components)
+COLUMNAR_MAX_PARTS = 48 # part files of a month of a columnar ledger before they are merged into one (months already over are merged on the next append)
+LEDGER_BACKEND = 'csv' # 'csv' (append-only CSV segments), 'columnar' (partitioned NumPy archives, see columnar.py) or 'sqlite' (see database.py)
+STATE_BACKEND = 'files' # 'files' (JSON snapshot and journal, see state.py) or 'sqlite' (see database.py)
 # ******************* END OF PARAMETERS TO SET ******************* #
 
 
@@ -83,6 +145,7 @@ TRADE_LEDGER_COLUMNS = [
     'abs capital gain', 'capital gain',
     'fees', 'net capital gain'
 ]
+ENTRY_LATENCY_COLUMNS = ['boundary', 'sent', 'ack', 'latency', 'round trip', 'clock round trip']
 ACCOUNT_BALANCE_COLUMNS = [
     'accountAlias', 'asset',
     'balance', 'crossWalletBalance',
@@ -0,0 +1,294 @@
+# SSX999 Project Hedge
+
+# Augustin BRISSART
+# GitHub: @augustin999
+
+# June 2021
+
+
+import os
+import signal
+import logging
+import threading
+
+try:
+    from trader import Binance_API
+    from trader import config
+    from trader import entry
+    from trader import ledgers
+    from trader import market
+    from trader import processes
+    from trader import retries
+    from trader import state
+    from trader import streams
+except:
+    import Binance_API
+    import config
+    import entry
+    import ledgers
+    import market
+    import processes
+    import retries
+    import state
+    import streams
+
+logger = logging.getLogger('trader')
+
+
+# PERSISTING STATE
+# ----------------
+
+class StateWriter(object):
+    """
+    Persist the traded currency from a background thread.
+    The state is taken when submitted (see state.to_state), only the latest state waiting to be written is kept.
+    It is written to a state store (see state.get_store), as the changes since the last state written.
+    The ledger rows of the tick (ledgers.buffer) are written by the same thread (see state.write_tick), so that ticks never wait for storage.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.pending = None
+        self.flush_ledgers = False
+        self.writing = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name='state-writer', daemon=True)
+        self.thread.start()
+        return
+
+    def submit(self, TradedCurrency):
+        content = state.to_state(TradedCurrency)
+        changed = self.store.has_changed(content)
+        flush_ledgers = ledgers.buffer.has_pending()
+        if not changed and not flush_ledgers:
+            return
+        with self.condition:
+            if changed:
+                self.pending = content
+            self.flush_ledgers = self.flush_ledgers or flush_ledgers
+            self.condition.notify_all()
+        return
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.flush_ledgers:
+                    self.condition.wait()
+                content, self.pending = self.pending, None
+                flush_ledgers, self.flush_ledgers = self.flush_ledgers, False
+                self.writing = True
+            try:
+                state.write_tick(self.store, content, flush_ledgers)
+            except Exception:
+                logger.exception(f'Error: Cannot write {self.store.path}')
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """ Block until every submitted state is written """
+        with self.condition:
+            return self.condition.wait_for(lambda: self.pending is None and not self.flush_ledgers and not self.writing, timeout)
+
+
+# PRICE EVENTS
+# ------------
+
+def get_trigger_bounds(TradedCurrency):
+    """ Returns the price interval out of which a check of the open positions is needed """
+    return TradedCurrency.trigger_index.get_bounds()
+
+
+def is_price_event(TradedCurrency, price: float):
+    lower, upper = get_trigger_bounds(TradedCurrency)
+    return price < lower or price > upper
+
+
+# RUNNING THE DAEMON
+# ------------------
+
+class Daemon(object):
+    """
+    Long-running alternative to the Cloud Function entry point (python -m trader).
+
+    The traded currency is kept in memory and the same processes are run:
+    - manage_open_positions on every closed 1m candle, and as soon as the price reaches a trigger level,
+    - open_new_positions right after next_timestamp, with entry orders armed ENTRY_ARM_LEAD seconds before.
+    The state is persisted by a StateWriter after every tick which changed it.
+
+    With a market stream, the daemon is woken up by closed candles and trigger level crosses.
+    Without it (or while it is stale), the ticker price is polled.
+    """
+
+    def __init__(self, TradedCurrency, stream=None):
+        self.TradedCurrency = TradedCurrency
+        self.stream = stream
+        self.writer = StateWriter(state.get_store())
+        self.stopped = threading.Event()
+        self.wake = threading.Event()
+        self.snapshot = None
+        self.armed = None
+        self.armed_boundary = None
+        self.next_minute = None
+        self.bounds = get_trigger_bounds(TradedCurrency)
+        if stream is not None:
+            stream.on_candle(self.on_stream_candle)
+            stream.on_price(self.on_stream_price)
+        return
+
+    def stop(self, *args):
+        self.stopped.set()
+        self.wake.set()
+        return
+
+    def persist(self):
+        self.TradedCurrency.update_capital()
+        try:
+            processes.add_account_balance(self.TradedCurrency)
+        except Exception:
+            logger.exception('Error: Cannot get the account balance')
+        self.bounds = get_trigger_bounds(self.TradedCurrency)
+        self.writer.submit(self.TradedCurrency)
+        return
+
+    def on_stream_candle(self, interval: str, candle):
+        if interval == '1m':
+            self.wake.set()
+        return
+
+    def on_stream_price(self, price: float):
+        # Called for every book ticker update: only compares against the bounds cached after the last tick
+        if price < self.bounds[0] or price > self.bounds[1]:
+            self.wake.set()
+        return
+
+    def is_streaming(self):
+        return self.stream is not None and not self.stream.is_stale()
+
+    def get_price(self):
+        return self.stream.get_price() if self.stream is not None else Binance_API.get_price(self.TradedCurrency.pair)
+
+    def sleep_until(self, server_time: float):
+        """ Sleep until a server time (ms), a stream event or until the daemon is stopped. Returns False if stopped. """
+        delay = (server_time - Binance_API.get_synced_server_time()) / 1000
+        if delay > 0:
+            self.wake.wait(delay)
+        self.wake.clear()
+        return not self.stopped.is_set()
+
+    def is_candle_closed(self, server_time: float):
+        """ True once the 1m candle ending at next_minute is closed (received on the stream, or after a delay) """
+        if server_time >= self.next_minute + 1000 * config.DAEMON_CANDLE_DELAY:
+            return True
+        if not self.is_streaming():
+            return False
+        candle = self.stream.get_last_closed_candle('1m')
+        return candle is not None and int(candle['close_time']) >= self.next_minute - 1
+
+    def on_candle(self):
+        """ A 1m candle closed: same checks as a scheduled run """
+        retries.start_invocation(config.DAEMON_TICK_BUDGET)
+        self.snapshot = market.load_snapshot(self.TradedCurrency.pair, self.TradedCurrency.timeframe, self.stream)
+        self.TradedCurrency.update_ema(self.snapshot.ohlc)
+        self.TradedCurrency = processes.manage_open_positions(self.TradedCurrency, self.snapshot)
+        self.persist()
+        return
+
+    def on_price(self, price: float):
+        """ The price reached a trigger level: positions are checked against the live price """
+        retries.start_invocation(config.DAEMON_TICK_BUDGET)
+        self.snapshot.set_price(price)
+        self.TradedCurrency = processes.manage_open_positions(self.TradedCurrency, self.snapshot)
+        self.persist()
+        return
+
+    def get_arm_time(self):
+        """ Server time (ms) at which the entry orders of next_timestamp are prepared, None once they are """
+        boundary = int(1000 * self.TradedCurrency.next_timestamp.timestamp())
+        if self.armed_boundary == boundary:
+            return None
+        if self.TradedCurrency.n_open_positions >= self.TradedCurrency.max_open_positions:
+            return None
+        return boundary - 1000 * config.ENTRY_ARM_LEAD
+
+    def on_arm(self):
+        """ next_timestamp is close: prepare its entry orders """
+        retries.start_invocation(config.DAEMON_TICK_BUDGET)
+        # Armed once per boundary: if it fails, orders are prepared after the boundary
+        self.armed_boundary = int(1000 * self.TradedCurrency.next_timestamp.timestamp())
+        self.armed = entry.arm(self.TradedCurrency, self.snapshot)
+        return
+
+    def on_timestamp(self):
+        """ next_timestamp is reached: look for a new position once its candle is available """
+        retries.start_invocation(config.DAEMON_TICK_BUDGET)
+        processes.load_boundary_snapshot(self.TradedCurrency, self.snapshot, wait=self.stopped.wait)
+        TradedCurrency = processes.open_new_positions(self.TradedCurrency, self.snapshot, self.armed)
+        if TradedCurrency is None:
+            # Same as a scheduled run: the boundary is handled again on the next tick
+            return
+        self.TradedCurrency = TradedCurrency
+        self.persist()
+        return
+
+    def run(self):
+        logger.info('Running hedge mode strategy as a daemon')
+        processes.check_account_settings(self.TradedCurrency)
+        self.on_candle()
+        minute = 60 * 1000
+        self.next_minute = (Binance_API.get_synced_server_time() // minute + 1) * minute
+        while not self.stopped.is_set():
+            try:
+                wake_time = self.next_minute + 1000 * config.DAEMON_CANDLE_DELAY
+                if not self.is_streaming():
+                    wake_time = min(wake_time, Binance_API.get_synced_server_time() + 1000 * config.DAEMON_PRICE_POLL_INTERVAL)
+                arm_time = self.get_arm_time()
+                if arm_time is not None:
+                    wake_time = min(wake_time, arm_time)
+                if not self.sleep_until(wake_time):
+                    break
+                server_time = Binance_API.get_synced_server_time()
+                boundary = 1000 * self.TradedCurrency.next_timestamp.timestamp()
+                arm_time = self.get_arm_time()
+                if arm_time is not None and arm_time <= server_time < boundary:
+                    self.on_arm()
+                if self.is_candle_closed(server_time):
+                    closed_until = self.next_minute
+                    self.next_minute = (max(server_time, self.next_minute) // minute + 1) * minute
+                    self.on_candle()
+                    # next_timestamp is a minute boundary too
+                    if closed_until >= boundary:
+                        self.on_timestamp()
+                else:
+                    price = self.get_price()
+                    if is_price_event(self.TradedCurrency, price):
+                        self.on_price(price)
+            except Exception:
+                # The daemon outlives errors of a single tick, which is retried on the next one
+                logger.exception('Error: daemon tick failed')
+                self.stopped.wait(config.DAEMON_PRICE_POLL_INTERVAL)
+        if self.stream is not None:
+            self.stream.stop()
+        streams.stop_user_stream()
+        self.writer.flush()
+        logger.info('Daemon stopped')
+        return
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    if not state.exists():
+        if not config.measurements_path.exists():
+            os.mkdir(config.measurements_path)
+        processes.initiate_algorithm()
+    TradedCurrency = state.load_state()
+    stream = None
+    if config.DAEMON_USE_STREAM:
+        stream = streams.MarketStream(TradedCurrency.pair, ['1m', TradedCurrency.timeframe]).start()
+        if TradedCurrency.real_mode:
+            streams.start_user_stream()
+    daemon = Daemon(TradedCurrency, stream)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    daemon.run()
+    return
@@ -0,0 +1,241 @@
+# SSX999 Project Hedge
+
+# Augustin BRISSART
+# GitHub: @augustin999
+
+# June 2021
+
+
+import os
+import time as tm
+import sqlite3
+import threading
+import contextlib
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+try:
+    from trader import columnar
+    from trader import config
+except:
+    import columnar
+    import config
+
+
+# SQLite database of the state and the ledgers (STATE_BACKEND = 'sqlite', LEDGER_BACKEND = 'sqlite').
+# The database is opened in WAL mode: a write only appends to the log, and readers (eg. an analysis
+# notebook) are not blocked by the trader. It needs a local disk, see config.database_path.
+#
+# Tables:
+#     state (key, value): top-level keys of the state (see state.to_state), one JSON value per key
+#     positions (slot, position, contracts): one row per position slot, JSON values
+#     trades, orders, balances, entry_latencies: one row per ledger row, typed columns (columnar.SCHEMAS),
+#         plus 'pair' and 'time_ms' (time column in ms), indexed on time and on the usual filters
+#
+# Analytics run in SQL, eg.
+#     get_database().execute('SELECT type, SUM("net capital gain") FROM trades GROUP BY type')
+
+SQL_TYPES = {
+    columnar.FLOAT: 'REAL',
+    columnar.INT: 'INTEGER',
+    columnar.BOOL: 'INTEGER',
+    columnar.STR: 'TEXT',
+}
+
+# {ledger name: (table, indexed columns besides pair and time)}
+LEDGER_TABLES = {
+    'trade_ledger': ('trades', ['type', 'triggered on', 'id']),
+    'order_ledger': ('orders', ['orderId', 'status']),
+    'account_balance': ('balances', []),
+    'entry_latency': ('entry_latencies', []),
+}
+
+STATE_SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS positions (slot INTEGER PRIMARY KEY, position TEXT, contracts TEXT)',
+]
+
+
+def quote(name: str):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def to_sql_value(value, kind: str):
+    if kind == columnar.FLOAT:
+        value = columnar.to_float(value)
+        return None if np.isnan(value) else value
+    if kind == columnar.INT:
+        value = columnar.to_float(value)
+        return None if np.isnan(value) else int(value)
+    if kind == columnar.BOOL:
+        return None if columnar.is_missing(value) or value == '' else int(value in [True, 'True', 'true', 1])
+    return None if columnar.is_missing(value) else str(value)
+
+
+class Database(object):
+    """
+    Connection to the SQLite database, shared by the threads of the process.
+
+    Attributes:
+        path (Path): database file (config.database_path)
+        connection: sqlite3 connection in autocommit mode, opened on first use
+        depth (int): nesting depth of the current transaction
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.connection = None
+        self.depth = 0
+        self.lock = threading.RLock()
+        return
+
+    def connect(self):
+        with self.lock:
+            if self.connection is None:
+                os.makedirs(Path(self.path).parent, exist_ok=True)
+                connection = sqlite3.connect(str(self.path), isolation_level=None, check_same_thread=False)
+                connection.execute('PRAGMA journal_mode=WAL')
+                # In WAL mode, a commit is durable once the log is synced at checkpoints: a crash of the process loses nothing
+                connection.execute('PRAGMA synchronous=NORMAL')
+                for statement in STATE_SCHEMA:
+                    connection.execute(statement)
+                self.connection = connection
+            return self.connection
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Context of a transaction, committed when the outermost context exits and rolled back on an exception.
+        Nested contexts join the transaction they are in. The other threads wait until it is over.
+        """
+        with self.lock:
+            connection = self.connect()
+            if self.depth == 0:
+                connection.execute('BEGIN IMMEDIATE')
+            self.depth += 1
+            try:
+                yield connection
+            except BaseException:
+                self.depth -= 1
+                if self.depth == 0:
+                    connection.execute('ROLLBACK')
+                raise
+            self.depth -= 1
+            if self.depth == 0:
+                connection.execute('COMMIT')
+        return
+
+    def execute(self, statement: str, parameters=()):
+        """ Returns the rows of a statement, as tuples """
+        with self.lock:
+            return self.connect().execute(statement, parameters).fetchall()
+
+    def read_sql(self, statement: str, parameters=()):
+        """ Returns the rows of a statement as a DataFrame """
+        with self.lock:
+            return pd.read_sql_query(statement, self.connect(), params=parameters)
+
+
+class LedgerTable(object):
+    """
+    Table of a ledger. The table is created on first use, columns missing from an existing table are added.
+
+    Attributes:
+        table (str): table name, see LEDGER_TABLES
+        columns (list): columns of the ledger, followed by 'pair'
+        types (dict): {column: columnar type}
+        time_column (str): column time_ms is computed from
+    """
+
+    def __init__(self, database: Database, name: str, columns: list, pair=config.PAIR):
+        types, time_column = columnar.SCHEMAS[name]
+        self.database = database
+        self.table, self.indexed = LEDGER_TABLES[name]
+        self.columns = [column for column in columns if column != 'pair'] + ['pair']
+        self.types = {column: types.get(column, columnar.STR) for column in self.columns}
+        self.time_column = time_column
+        self.pair = pair
+        self.created = False
+        return
+
+    def create(self, connection):
+        if self.created:
+            return
+        definitions = ', '.join(f'{quote(column)} {SQL_TYPES[self.types[column]]}' for column in self.columns)
+        connection.execute(f'CREATE TABLE IF NOT EXISTS {self.table} ({definitions}, time_ms INTEGER NOT NULL)')
+        existing = [row[1] for row in connection.execute(f'PRAGMA table_info({self.table})').fetchall()]
+        for column in self.columns:
+            if not column in existing:
+                connection.execute(f'ALTER TABLE {self.table} ADD COLUMN {quote(column)} {SQL_TYPES[self.types[column]]}')
+        connection.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_time ON {self.table} (time_ms)')
+        connection.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_pair_time ON {self.table} (pair, time_ms)')
+        for column in self.indexed:
+            name = f'{self.table}_' + ''.join(character if character.isalnum() else '_' for character in column)
+            connection.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {self.table} ({quote(column)})')
+        self.created = True
+        return
+
+    def to_record(self, row: dict, now_ms: int):
+        row = dict(row)
+        if columnar.is_missing(row.get('pair')):
+            row['pair'] = row.get('symbol') if not columnar.is_missing(row.get('symbol')) else self.pair
+        time = columnar.to_float(row.get(self.time_column))
+        time_ms = now_ms if np.isnan(time) else int(columnar.to_ms(time))
+        return [to_sql_value(row.get(column), self.types[column]) for column in self.columns] + [time_ms]
+
+    def insert(self, rows: list):
+        """ Insert rows (dicts keyed by column), in one transaction """
+        if len(rows) == 0:
+            return
+        now_ms = int(1000 * tm.time())
+        names = ', '.join([quote(column) for column in self.columns] + ['time_ms'])
+        placeholders = ', '.join(['?'] * (len(self.columns) + 1))
+        with self.database.transaction() as connection:
+            self.create(connection)
+            connection.executemany(
+                f'INSERT INTO {self.table} ({names}) VALUES ({placeholders})',
+                [self.to_record(row, now_ms) for row in rows],
+            )
+        return
+
+    def query(self, start=None, end=None, columns=None, where=None, pairs=None):
+        """
+        Rows of the ledger matching a query, selected by SQLite on the indexes of the table.
+        Arguments and response as columnar.ColumnarStore.query
+        """
+        where = dict() if where is None else where
+        columns = self.columns if columns is None else list(columns)
+        conditions, parameters = [], []
+        start_ms, end_ms = columnar.to_ms_bound(start), columnar.to_ms_bound(end)
+        if start_ms is not None:
+            conditions.append('time_ms >= ?')
+            parameters.append(start_ms)
+        if end_ms is not None:
+            conditions.append('time_ms <= ?')
+            parameters.append(end_ms)
+        if pairs is not None:
+            conditions.append(f'pair IN ({", ".join(["?"] * len(pairs))})')
+            parameters += list(pairs)
+        for column, value in where.items():
+            conditions.append(f'{quote(column)} = ?')
+            parameters.append(to_sql_value(value, self.types[column]))
+        statement = f'SELECT {", ".join(quote(column) for column in columns)} FROM {self.table}'
+        if len(conditions) > 0:
+            statement += ' WHERE ' + ' AND '.join(conditions)
+        with self.database.transaction() as connection:
+            self.create(connection)
+        return self.database.read_sql(statement + ' ORDER BY rowid', parameters)
+
+    def read(self):
+        return self.query()
+
+
+_databases = dict()
+
+
+def get_database(path: Path = config.database_path):
+    key = str(path)
+    if not key in _databases.keys():
+        _databases[key] = Database(path)
+    return _databases[key]
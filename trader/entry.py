@@ -0,0 +1,106 @@
+# SSX999 Project Hedge
+
+# Augustin BRISSART
+# GitHub: @augustin999
+
+# June 2021
+
+
+import logging
+
+try:
+    from trader import Binance_API
+    from trader import config
+    from trader import ledgers
+except:
+    import Binance_API
+    import config
+    import ledgers
+
+logger = logging.getLogger('trader')
+
+
+# Entry orders are sent right after a candle boundary, on the crossover of the candle which just closed.
+# Everything which does not depend on that candle is prepared in the last seconds before the boundary,
+# so that the boundary itself only costs the candle, the crossover test, one signature and one batch POST.
+
+LATENCY_COLUMNS = config.ENTRY_LATENCY_COLUMNS
+
+
+class ArmedEntry(object):
+    """
+    Entry orders of the next candle boundary, prepared ahead of it.
+
+    Arming resyncs the server clock (which warms the pooled connection), sizes the long and short
+    MARKET orders on the latest price, encodes their batch and builds the take profit and stop loss templates.
+
+    Attributes:
+        boundary (int): next_timestamp in ms
+        price (float): price used to size the orders
+        batch (dict): entry batch encoded by Binance_API.prepare_multiple_orders
+        templates (list): orders of Currency.prepare_activation_templates
+        latency (dict): timings of the last fire (LATENCY_COLUMNS, in ms)
+    """
+
+    def __init__(self, TradedCurrency, snapshot):
+        self.boundary = int(1000 * TradedCurrency.next_timestamp.timestamp())
+        self.n_open_positions = TradedCurrency.n_open_positions
+        self.clock_round_trip = Binance_API.prewarm()
+        self.price = snapshot.get_price(refresh=True)
+        orders = TradedCurrency.prepare_initial_orders(price=self.price)
+        self.batch = Binance_API.prepare_multiple_orders(orders, recvWindow=2000)
+        self.templates = TradedCurrency.prepare_activation_templates()
+        self.latency = None
+        return
+
+    def is_valid(self, TradedCurrency):
+        """ An armed entry is only fired at its own boundary, if no position was opened or closed meanwhile """
+        boundary = int(1000 * TradedCurrency.next_timestamp.timestamp())
+        return self.boundary == boundary and self.n_open_positions == TradedCurrency.n_open_positions
+
+    def fire(self):
+        """
+        Post the entry batch.
+
+        Response:
+            list of orders, see Binance_API.place_multiple_orders
+        """
+        sent = Binance_API.get_synced_server_time()
+        contracts = Binance_API.send_multiple_orders(self.batch)
+        ack = Binance_API.get_synced_server_time()
+        self.latency = {
+            'boundary': self.boundary,
+            'sent': sent,
+            'ack': ack,
+            'latency': ack - self.boundary,
+            'round trip': ack - sent,
+            'clock round trip': round(self.clock_round_trip, 3),
+        }
+        record_latency(self.latency)
+        return contracts
+
+
+def arm(TradedCurrency, snapshot):
+    """
+    Prepare the entry orders of the next boundary.
+
+    Response:
+        ArmedEntry, or None in simulation mode or if it could not be prepared (orders are then prepared at the boundary)
+    """
+    if not TradedCurrency.real_mode:
+        return None
+    try:
+        return ArmedEntry(TradedCurrency, snapshot)
+    except Exception as error:
+        print(f'Error: entry orders cannot be armed before {TradedCurrency.next_timestamp}\n{error}')
+        return None
+
+
+def record_latency(latency: dict):
+    """ Add the timings of an entry to entry_latency.csv (written with the other ledgers at the end of the tick) """
+    logger.info(f"Entry acknowledged {latency['latency']} ms after the boundary ({latency['round trip']} ms round trip)")
+    try:
+        ledgers.latency_ledger.add([latency])
+    except Exception as error:
+        print(f'Error: Cannot spool the entry latency\n{error}')
+    return
@@ -0,0 +1,149 @@
+# SSX999 Project Hedge
+
+# Augustin BRISSART
+# GitHub: @augustin999
+
+# June 2021
+
+
+import numpy as np
+
+
+def ema_alpha(period: int):
+    return 2 / (period + 1)
+
+
+def ema_series(close_prices: np.ndarray, period: int):
+    """
+    EMA of a whole close price series, equivalent to ta.trend.ema_indicator (the first `period`-1 values are NaN).
+    """
+    alpha = ema_alpha(period)
+    ema = np.empty(len(close_prices), dtype=np.float64)
+    value = None
+    for i, close_price in enumerate(close_prices):
+        value = close_price if value is None else value + alpha * (close_price - value)
+        ema[i] = value
+    ema[:period-1] = np.nan
+    return ema
+
+
+class CrossTrigger(object):
+    """
+    Close price of a forming candle at which the fast EMA crosses the slow EMA.
+
+    Attributes:
+        close_time (int): close time of the forming candle in ms
+        price (float): crossing close price
+        side (str): 'crossover' if a close above price crosses the EMAs, 'crossunder' if a close below does
+    """
+
+    def __init__(self, close_time: int, price: float, side: str):
+        self.close_time = close_time
+        self.price = price
+        self.side = side
+        return
+
+    def check(self, close_price: float):
+        """ Returns the cross ('crossover' or 'crossunder') a close of the forming candle at close_price would make, else None """
+        if self.side == 'crossover':
+            return 'crossover' if close_price >= self.price else None
+        return 'crossunder' if close_price <= self.price else None
+
+    def __repr__(self):
+        return f'CrossTrigger({self.side} at {self.price:.2f}, close time {self.close_time})'
+
+
+class EMACross(object):
+    """
+    Running fast and slow EMAs of closed candles, updated in O(1) per candle.
+
+    Values follow the same recursion as ta.trend.ema_indicator (pandas ewm with adjust=False),
+    seeded on the first close of the history. Seeding on a long history makes the running values
+    match a full-history EMA.
+    """
+
+    def __init__(self, fast_period: int, slow_period: int, interval_ms: int):
+        self.fast_period = fast_period
+        self.slow_period = slow_period
+        self.fast_alpha = ema_alpha(fast_period)
+        self.slow_alpha = ema_alpha(slow_period)
+        self.interval_ms = interval_ms
+        self.fast, self.slow = None, None
+        self.prev_fast, self.prev_slow = None, None
+        self.n_candles = 0
+        self.last_open_time = None
+        self.last_close_price = None
+        return
+
+    def update(self, open_time: int, close_price: float):
+        """ Feed the next closed candle """
+        self.prev_fast, self.prev_slow = self.fast, self.slow
+        if self.fast is None:
+            self.fast, self.slow = close_price, close_price
+        else:
+            self.fast += self.fast_alpha * (close_price - self.fast)
+            self.slow += self.slow_alpha * (close_price - self.slow)
+        self.n_candles += 1
+        self.last_open_time = int(open_time)
+        self.last_close_price = float(close_price)
+        return
+
+    def seed(self, candles: np.ndarray):
+        """ Reset the EMAs and compute them again over a history of closed candles """
+        self.fast, self.slow = None, None
+        self.prev_fast, self.prev_slow = None, None
+        self.n_candles = 0
+        self.last_open_time = None
+        for open_time, close_price in zip(candles['open_time'], candles['close_price']):
+            self.update(open_time, float(close_price))
+        return
+
+    def catch_up(self, candles: np.ndarray):
+        """
+        Feed every candle more recent than the last one processed.
+        If a candle is missing in between, the EMAs are seeded again on the whole history.
+
+        Response:
+            number of new candles processed
+        """
+        if self.last_open_time is None:
+            self.seed(candles)
+            return len(candles)
+        new_candles = candles[candles['open_time'] > self.last_open_time]
+        if len(new_candles) == 0:
+            return 0
+        open_times = np.concatenate([[self.last_open_time], new_candles['open_time']])
+        if np.any(np.diff(open_times) != self.interval_ms):
+            self.seed(candles)
+            return len(new_candles)
+        for open_time, close_price in zip(new_candles['open_time'], new_candles['close_price']):
+            self.update(open_time, float(close_price))
+        return len(new_candles)
+
+    def is_ready(self):
+        return self.prev_fast is not None and self.n_candles >= self.slow_period + 1
+
+    def is_crossover(self):
+        """ Fast EMA crossed above the slow EMA on the last closed candle """
+        return self.is_ready() and self.prev_fast < self.prev_slow and self.fast >= self.slow
+
+    def is_crossunder(self):
+        """ Fast EMA crossed under the slow EMA on the last closed candle """
+        return self.is_ready() and self.prev_fast > self.prev_slow and self.fast <= self.slow
+
+    def get_trigger(self):
+        """
+        Solve for the close of the forming candle at which the EMAs cross.
+        With a and b the fast and slow alphas, the next EMAs are fast + a*(close - fast) and slow + b*(close - slow),
+        they are equal for close = ((1-b)*slow - (1-a)*fast) / (a - b). As a > b, the difference of the next EMAs
+        increases with close: the EMAs cross over for a close above that price, or under for a close below it.
+
+        Response:
+            CrossTrigger, or None if the EMAs cannot cross on the forming candle
+        """
+        if self.fast is None or self.n_candles < self.slow_period or self.fast == self.slow:
+            return None
+        a, b = self.fast_alpha, self.slow_alpha
+        price = ((1-b)*self.slow - (1-a)*self.fast) / (a - b)
+        close_time = self.last_open_time + 2*self.interval_ms - 1
+        return CrossTrigger(close_time, price, 'crossover' if self.fast < self.slow else 'crossunder')
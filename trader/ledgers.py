@@ -0,0 +1,361 @@
+# SSX999 Project Hedge
+
+# Augustin BRISSART
+# GitHub: @augustin999
+
+# June 2021
+
+
+import io
+import os
+import re
+import csv
+import json
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from typing import Union
+from pathy.base import Pathy
+from pathlib import Path
+
+try:
+    from trader import columnar
+    from trader import config
+    from trader import database
+    from trader import utils
+except:
+    import columnar
+    import config
+    import database
+    import utils
+
+logger = logging.getLogger('trader')
+
+
+# Ledgers are append-only CSV files: new rows are appended at the end of the last segment without reading
+# or rewriting the file (composed onto the blob in the bucket, see utils.append_bytes).
+# A ledger is split in segments: trade_ledger.csv, then trade_ledger.00001.csv, trade_ledger.00002.csv...
+# A new segment is started when the last one is full (LEDGER_SEGMENT_SIZE, or LEDGER_MAX_COMPONENTS
+# composed objects in the bucket) or when its header is not the schema of the ledger.
+# Segments keep the layout written by pandas (unnamed index column first, left empty), so that
+# utils.read_csv reads every one of them.
+#
+# Rows produced during a tick are added to a LedgerBuffer and written at the end of the tick,
+# in one append per ledger (see state.write_tick).
+
+
+class Ledger(object):
+    """
+    Append-only CSV ledger with a fixed schema.
+
+    Attributes:
+        name (str): name of the first segment without extension (eg. 'trade_ledger')
+        path: first segment of the ledger (eg. config.trade_ledger_path)
+        columns (list): schema, rows are written in this column order and other keys are left out
+        segment (int): segment rows are appended to, None until the segments were listed
+        checked (int): last segment whose header was checked against the schema
+    """
+
+    def __init__(self, path: Union[Path, Pathy], columns: list):
+        self.name = path.stem
+        self.path = path
+        self.columns = list(columns)
+        self.header = config.CSV_SEP + config.CSV_SEP.join(self.columns)
+        self.segment = None
+        self.checked = None
+        return
+
+    def get_segment_path(self, segment: int):
+        if segment == 0:
+            return self.path
+        return self.path.with_name(f'{self.path.stem}.{segment:05d}{self.path.suffix}')
+
+    def get_segments(self):
+        """ Returns the numbers of the existing segments, in order """
+        pattern = re.compile(rf'^{re.escape(self.path.stem)}(?:\.(\d+))?{re.escape(self.path.suffix)}$')
+        segments = []
+        for name in utils.list_names(self.path.parent, self.path.stem):
+            match = pattern.match(name)
+            if match is not None:
+                segments.append(int(match.group(1) or 0))
+        return sorted(segments)
+
+    def has_schema(self, path):
+        head = utils.read_head(path, len(self.header) + 2).decode('utf-8')
+        return head.splitlines()[0] == self.header if len(head) > 0 else False
+
+    def get_append_path(self):
+        """
+        Returns the segment new rows are appended to, and True if that segment does not exist yet.
+        """
+        if self.segment is None:
+            self.segment = max(self.get_segments(), default=0)
+        path = self.get_segment_path(self.segment)
+        info = utils.get_info(path)
+        if info is None:
+            return path, True
+        is_full = info['size'] >= config.LEDGER_SEGMENT_SIZE or info['components'] >= config.LEDGER_MAX_COMPONENTS
+        if not is_full and self.checked != self.segment:
+            is_full = not self.has_schema(path)
+            self.checked = self.segment
+        if is_full:
+            self.segment += 1
+            return self.get_segment_path(self.segment), True
+        return path, False
+
+    def format_rows(self, rows: list):
+        _file = io.StringIO()
+        writer = csv.writer(_file, delimiter=config.CSV_SEP, lineterminator='\n')
+        for row in rows:
+            writer.writerow([''] + ['' if row.get(column) is None else row[column] for column in self.columns])
+        return _file.getvalue()
+
+    def append(self, rows: list):
+        """
+        Append rows (dicts keyed by column) at the end of the ledger, in O(1) whatever the size of the ledger.
+        """
+        if len(rows) == 0:
+            return
+        path, is_new = self.get_append_path()
+        content = self.format_rows(rows)
+        if is_new:
+            content = self.header + '\n' + content
+        utils.append_bytes(content.encode('utf-8'), path)
+        return
+
+    def add(self, rows: list):
+        """ Buffer rows until the end of the tick (see LedgerBuffer) """
+        buffer.add(self, rows)
+        return
+
+    def create(self):
+        """ Write an empty first segment (header only) """
+        utils.write_bytes((self.header + '\n').encode('utf-8'), self.path)
+        self.segment = 0
+        self.checked = 0
+        return
+
+    def read(self):
+        """ Returns the whole ledger as a DataFrame (every segment, in order) """
+        frames = [utils.read_csv(self.get_segment_path(segment)) for segment in self.get_segments()]
+        if len(frames) == 0:
+            return pd.DataFrame(columns=self.columns)
+        return pd.concat(frames, ignore_index=True)
+
+
+class ColumnarLedger(Ledger):
+    """
+    Ledger stored in a columnar.ColumnarStore (LEDGER_BACKEND = 'columnar'), partitioned by pair and month.
+    Rows are buffered and flushed like the rows of CSV ledgers. Use query to read a time range or a subset of rows.
+    """
+
+    def __init__(self, path: Union[Path, Pathy], columns: list):
+        super().__init__(path, columns)
+        self.store = columnar.ColumnarStore(self.name, self.columns, config.columnar_path / self.name)
+        return
+
+    def append(self, rows: list):
+        self.store.append(rows)
+        return
+
+    def create(self):
+        return
+
+    def read(self):
+        return self.store.read()
+
+    def query(self, start=None, end=None, columns=None, where=None, pairs=None):
+        """ See columnar.ColumnarStore.query """
+        return self.store.query(start, end, columns, where, pairs)
+
+
+class SQLiteLedger(Ledger):
+    """
+    Ledger stored in a table of the SQLite database (LEDGER_BACKEND = 'sqlite'), see database.LedgerTable.
+    Rows are buffered like the rows of CSV ledgers and inserted in the transaction of the end of the tick.
+    """
+
+    def __init__(self, path: Union[Path, Pathy], columns: list):
+        super().__init__(path, columns)
+        self.table = database.LedgerTable(database.get_database(), self.name, self.columns)
+        return
+
+    def append(self, rows: list):
+        self.table.insert(rows)
+        return
+
+    def create(self):
+        return
+
+    def read(self):
+        return self.table.read()
+
+    def query(self, start=None, end=None, columns=None, where=None, pairs=None):
+        """ See columnar.ColumnarStore.query """
+        return self.table.query(start, end, columns, where, pairs)
+
+
+# BUFFERING ROWS
+# --------------
+
+def to_json_type(value):
+    # NumPy scalars of positions and candles
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+class LedgerBuffer(object):
+    """
+    Rows added during a tick, written by flush in one append per ledger.
+
+    Every add is also appended to a local spool file (one JSON line per add, synced to disk).
+    Rows are removed from the spool once written to their ledger, the rows left in the spool by a process
+    which stopped before its flush are written by the next flush. A flush interrupted between the append and
+    the update of the spool writes its rows again: rows are written at least once.
+
+    Attributes:
+        spool_path (Path): local spool file (config.ledger_spool_path)
+        pending (list): (ledger name, rows) not written yet, in order
+        balance_requested (bool): a row of the account balance has to be added before the next flush
+    """
+
+    def __init__(self, spool_path: Path):
+        self.spool_path = spool_path
+        self.pending = []
+        self.balance_requested = False
+        self.recovered = False
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        return
+
+    def recover(self):
+        """ Put the rows left in the spool by a previous process back in front of the pending rows """
+        if self.recovered:
+            return
+        self.recovered = True
+        if not os.path.exists(self.spool_path):
+            return
+        spooled = []
+        with open(self.spool_path, 'r', encoding='utf-8') as _file:
+            for line in _file:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    # Last line cut by the interrupted process
+                    break
+                spooled.append((item['ledger'], item['rows']))
+        if len(spooled) > 0:
+            logger.info(f'{sum(len(rows) for _, rows in spooled)} ledger rows recovered from {self.spool_path}')
+        self.pending = spooled + self.pending
+        return
+
+    def write_spool(self):
+        content = ''.join(json.dumps({'ledger': name, 'rows': rows}, default=to_json_type) + '\n' for name, rows in self.pending)
+        temporary_path = str(self.spool_path) + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as _file:
+            _file.write(content)
+            _file.flush()
+            os.fsync(_file.fileno())
+        os.replace(temporary_path, self.spool_path)
+        return
+
+    def add(self, ledger: Ledger, rows: list):
+        if len(rows) == 0:
+            return
+        line = json.dumps({'ledger': ledger.name, 'rows': rows}, default=to_json_type) + '\n'
+        with self.lock:
+            self.recover()
+            self.pending.append((ledger.name, rows))
+            with open(self.spool_path, 'a', encoding='utf-8') as _file:
+                _file.write(line)
+                _file.flush()
+                os.fsync(_file.fileno())
+        return
+
+    def has_pending(self):
+        with self.lock:
+            self.recover()
+            return len(self.pending) > 0
+
+    def write_pending(self, strict=False):
+        """
+        Write the pending rows, one append per ledger, without removing them from the pending rows (see release).
+        Rows of a ledger which cannot be written are kept for the next flush. Called with flush_lock held.
+
+        Arguments:
+            strict (bool): raise the error of a ledger which cannot be written instead of going on with the others
+
+        Response:
+            list of the pending items written
+        """
+        with self.lock:
+            self.recover()
+            batch = list(self.pending)
+        names = []
+        for name, _ in batch:
+            if not name in names:
+                names.append(name)
+        written = []
+        for name in names:
+            items = [item for item in batch if item[0] == name]
+            rows = [row for _, item_rows in items for row in item_rows]
+            try:
+                _ledgers[name].append(rows)
+            except Exception:
+                logger.exception(f'Error: Cannot write {len(rows)} rows to {name}, kept for the next flush')
+                if strict:
+                    raise
+                continue
+            written += items
+        return written
+
+    def release(self, items: list):
+        """
+        Remove written items from the pending rows and from the spool. Called with flush_lock held.
+
+        Response:
+            number of rows released
+        """
+        if len(items) == 0:
+            return 0
+        released = set(id(item) for item in items)
+        with self.lock:
+            self.pending = [item for item in self.pending if not id(item) in released]
+            self.write_spool()
+        return sum(len(rows) for _, rows in items)
+
+    def flush(self):
+        """
+        Write the pending rows, one append per ledger. Rows of a ledger which cannot be written are kept for the next flush.
+
+        Response:
+            number of rows written
+        """
+        with self.flush_lock:
+            return self.release(self.write_pending())
+
+
+_ledgers = dict()
+
+
+BACKENDS = {
+    'csv': Ledger,
+    'columnar': ColumnarLedger,
+    'sqlite': SQLiteLedger,
+}
+
+
+def register(path: Union[Path, Pathy], columns: list):
+    ledger = BACKENDS[config.LEDGER_BACKEND](path, columns)
+    _ledgers[ledger.name] = ledger
+    return ledger
+
+
+buffer = LedgerBuffer(config.ledger_spool_path)
+
+trade_ledger = register(config.trade_ledger_path, config.TRADE_LEDGER_COLUMNS)
+order_ledger = register(config.order_ledger_path, config.ORDER_LEDGER_COLUMNS)
+balance_ledger = register(config.balance_path, config.ACCOUNT_BALANCE_COLUMNS)
+latency_ledger = register(config.entry_latency_path, config.ENTRY_LATENCY_COLUMNS)
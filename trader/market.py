@@ -0,0 +1,93 @@
+# SSX999 Project Hedge
+
+# Augustin BRISSART
+# GitHub: @augustin999
+
+# June 2021
+
+
+import asyncio
+
+try:
+    from trader import Binance_API_async
+    from trader import candles
+except:
+    import Binance_API_async
+    import candles
+
+
+class MarketSnapshot(object):
+    """
+    Market data of one tick, fetched once and shared by every decision taken during the tick,
+    so that all checks compare levels against the same prices.
+
+    Attributes:
+        close_price (float): close price of the last closed 1m candle
+        candle (record): last closed 1m candle (Binance_API.KLINE_DTYPE)
+        price (float): latest ticker price
+        mark_price (float): latest mark price
+        ohlc (structured array): closed candles of the strategy timeframe (candle store history)
+
+    When a live streams.MarketStream is given, prices are read from it instead of being requested.
+    """
+
+    def __init__(self, pair: str, timeframe: str, stream=None):
+        self.pair = pair
+        self.timeframe = timeframe
+        self.stream = stream
+        self.candle = None
+        self.close_price = None
+        self.price = None
+        self.mark_price = None
+        self.ohlc = None
+        return
+
+    async def fetch(self):
+        # Candle stores are file backed and synchronous: they are updated in worker threads
+        loop = asyncio.get_event_loop()
+        if self.stream is not None and not self.stream.is_stale():
+            candle, ohlc = await asyncio.gather(
+                loop.run_in_executor(None, candles.get_store(self.pair, '1m').load, 1),
+                loop.run_in_executor(None, candles.get_store(self.pair, self.timeframe).load),
+            )
+            price, mark_price = self.stream.get_price(), self.stream.get_mark_price()
+        else:
+            candle, ohlc, price, mark_price = await asyncio.gather(
+                loop.run_in_executor(None, candles.get_store(self.pair, '1m').load, 1),
+                loop.run_in_executor(None, candles.get_store(self.pair, self.timeframe).load),
+                Binance_API_async.get_price(self.pair),
+                Binance_API_async.get_mark_price(self.pair),
+            )
+        self.candle = candle[-1]
+        self.close_price = float(self.candle['close_price'])
+        self.ohlc = ohlc
+        self.price = price
+        self.mark_price = mark_price
+        return self
+
+    def load(self, force=False):
+        """
+        Fetch every market data of the snapshot concurrently.
+        Already loaded data is kept unless force is True.
+        """
+        if self.close_price is None or force:
+            Binance_API_async.run(self.fetch())
+        return self
+
+    def get_price(self, refresh=False):
+        """ Latest ticker price, fetched again if refresh is True (eg. right after an order was filled) """
+        if refresh and self.stream is not None:
+            self.price = self.stream.get_price()
+        elif refresh:
+            self.price = Binance_API_async.run(Binance_API_async.get_price(self.pair))
+        return self.price
+
+    def set_price(self, price: float):
+        """ Take a live price as the reference price of the tick (price events of the daemon mode) """
+        self.price = price
+        self.close_price = float(price)
+        return self
+
+
+def load_snapshot(pair: str, timeframe: str, stream=None):
+    return MarketSnapshot(pair, timeframe, stream).load()
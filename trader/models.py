@@ -9,18 +9,45 @@
 import time as tm
 import numpy as np
 import pandas as pd
-from ta.trend import ema_indicator
 
 try:
     from trader import config
-    from trader import utils
     from trader import Binance_API
+    from trader import candles
+    from trader import indicators
+    from trader import ledgers
+    from trader import positions
+    from trader import retries
+    from trader import streams
+    from trader import triggers
 except:
     import config
-    import utils
     import Binance_API
+    import candles
+    import indicators
+    import ledgers
+    import positions
+    import retries
+    import streams
+    import triggers
+
+
+def get_stop_price(contract, default):
+    """ stopPrice of a placed conditional order, default if the order was not placed """
+    if isinstance(contract, dict) and 'stopPrice' in contract.keys():
+        return float(contract['stopPrice'])
+    return default
+
 
 class Currency(object):
+    """
+    Traded pair, its hedged positions and their orders.
+
+    open_positions[i] is None or a positions.Pair of positions.Leg (long and short),
+    contracts[i] a positions.Pair of positions.LegOrders.
+    trigger_index (triggers.TriggerIndex) holds the stop loss, take profit and ratchet levels of the open legs
+    and the free slots: it is updated by update_triggers after every change of open_positions[i].
+    """
 
     def __init__(self, max_nb_positions, capital):
         self.base = config.BASE
@@ -40,16 +67,10 @@ class Currency(object):
         self.id = 0
         self.n_open_positions = 0
         self.max_open_positions = max_nb_positions
-        self.open_positions = dict()
-        self.contracts = dict()
-        for i in range(0, max_nb_positions):
-            self.open_positions[i] = None
-            self.contracts[i] = {
-                'long': {'order': None, 'stop loss': None, 'take profit': None},
-                'short': {'order': None, 'stop loss': None, 'take profit': None},                
-            }
-        self.LONG = []
-        self.SHORT = []
+        self.open_positions = [None] * max_nb_positions
+        self.contracts = [positions.new_contracts() for _ in range(max_nb_positions)]
+        self.trigger_index = triggers.TriggerIndex(max_nb_positions)
+        self.ema = indicators.EMACross(config.FAST_PERIOD, config.SLOW_PERIOD, candles.INTERVAL_MS[self.timeframe])
 
         t = pd.Timestamp(int(tm.time()), unit='s')
         divider = int(pd.Timedelta(config.TIMEDELTA).to_timedelta64()/10**9/60)
@@ -67,43 +88,56 @@ class Currency(object):
 
         return
 
+    def __setstate__(self, state):
+        # Currency pickled with positions and contracts as nested dicts
+        self.__dict__.update(state)
+        if isinstance(self.open_positions, dict):
+            self.open_positions = [positions.from_dicts(self.open_positions[i]) for i in sorted(self.open_positions.keys())]
+            self.contracts = [positions.from_dicts(self.contracts[i], positions.LegOrders) for i in sorted(self.contracts.keys())]
+        if not 'trigger_index' in state.keys():
+            self.trigger_index = triggers.build_index(self)
+        return
+
     def find_available_position(self):
         """
         Returns index of the first available position or None if no position can be opened.
         """
-        for i in range(0, self.max_open_positions):
-            if self.open_positions[i] == None:
-                return i
-        return None
+        return self.trigger_index.get_free_slot()
+
+    def update_triggers(self, position_idx):
+        """ Index the current levels of a position slot (after it was opened, updated or closed) """
+        self.trigger_index.update(position_idx, self.open_positions[position_idx], self.fee_rate)
+        return
 
     def update_price(self):
         price = Binance_API.get_price(self.pair)
         return price
 
     def get_latest_close_price(self):
-        # The second candle is the started yet not finished candle.
         # We want the close price of the candle that just terminated.
-        candle = Binance_API.get_klines(pair='BTCUSDT', intervals='1m', limit=2)
-        close_price = candle[0][4]
+        # The candle store only holds closed candles and fetches at most once per closed candle.
+        candle = candles.get_store(self.pair, '1m').load(limit=1)
+        close_price = candle['close_price'][-1]
         return close_price
 
-    def set_positions(self, position_idx):
+    def set_positions(self, position_idx, snapshot=None):
         t = int(tm.time())
 
         if self.real_mode:
-            long_price = np.float(self.contracts[position_idx]['long']['order']['avgPrice']) # or 'price'
-            short_price = np.float(self.contracts[position_idx]['short']['order']['avgPrice']) # or 'price'
+            long_price = np.float(self.contracts[position_idx].long.order['avgPrice']) # or 'price'
+            short_price = np.float(self.contracts[position_idx].short.order['avgPrice']) # or 'price'
             # At this stage, if self.real_mode == True, amount is supposed to be the same on long and short sides
-            qty = np.float(self.contracts[position_idx]['long']['order']['executedQty'])
+            qty = np.float(self.contracts[position_idx].long.order['executedQty'])
             amount = qty * long_price
 
-            long_stop_loss = np.float(self.contracts[position_idx]['long']['stop loss']['stopPrice'])
-            short_stop_loss = np.float(self.contracts[position_idx]['short']['stop loss']['stopPrice'])
+            # Levels whose order could not be placed are watched locally
+            long_stop_loss = get_stop_price(self.contracts[position_idx].long.stop_loss, long_price * (1 - self.stop_loss))
+            short_stop_loss = get_stop_price(self.contracts[position_idx].short.stop_loss, short_price * (1 + self.stop_loss))
 
-            long_take_profit = np.float(self.contracts[position_idx]['long']['take profit']['stopPrice'])
-            short_take_profit = np.float(self.contracts[position_idx]['short']['take profit']['stopPrice'])
+            long_take_profit = get_stop_price(self.contracts[position_idx].long.take_profit, long_price * (1 + self.take_profit))
+            short_take_profit = get_stop_price(self.contracts[position_idx].short.take_profit, short_price * (1 - self.take_profit))
         else:
-            close_price = self.get_latest_close_price()
+            close_price = snapshot.close_price if snapshot is not None else self.get_latest_close_price()
             long_price = close_price
             short_price = close_price
             amount = self.capital / (self.max_open_positions + 1 - self.n_open_positions)
@@ -114,47 +148,44 @@ class Currency(object):
             short_stop_loss = short_price * (1 + self.stop_loss)
             short_take_profit = short_price * (1 - self.take_profit)
 
-        _long = {
-            'entry time': t,
-            'exit time': 0,
-            'id': self.id,
-            'entry': long_price,
-            'exit': 0,
-            'qty': qty,
-            'leverage': self.leverage,
-            'stop loss': long_stop_loss,
-            'take profit': long_take_profit,
-            'actualised': False,
-        }
-        _short = {
-            'entry time': t,
-            'exit time': 0,
-            'id': self.id,
-            'entry': short_price,
-            'exit': 0,
-            'qty': qty,
-            'leverage': self.leverage,
-            'stop loss': short_stop_loss,
-            'take profit': short_take_profit,
-            'actualised': False,
-        }
+        _long = positions.Leg(
+            entry_time=t,
+            id=self.id,
+            entry=long_price,
+            qty=qty,
+            leverage=self.leverage,
+            stop_loss=long_stop_loss,
+            take_profit=long_take_profit,
+        )
+        _short = positions.Leg(
+            entry_time=t,
+            id=self.id,
+            entry=short_price,
+            qty=qty,
+            leverage=self.leverage,
+            stop_loss=short_stop_loss,
+            take_profit=short_take_profit,
+        )
         self.id += 1
         self.n_open_positions += 1
-        self.capital -= (_long['entry']*_long['qty']/self.leverage + _short['entry']*_short['qty']/self.leverage)
-        self.capital -= (self.fee_rate * (_long['entry']*_long['qty'] + _short['entry']*_short['qty']))
-        self.open_positions[position_idx] = {'long': _long, 'short': _short}
+        self.capital -= (_long.entry*_long.qty/self.leverage + _short.entry*_short.qty/self.leverage)
+        self.capital -= (self.fee_rate * (_long.entry*_long.qty + _short.entry*_short.qty))
+        self.open_positions[position_idx] = positions.new_position(_long, _short)
+        self.update_triggers(position_idx)
         return
 
-    def prepare_initial_orders(self):
+    def prepare_initial_orders(self, snapshot=None, price=None):
         """
         Prepare all the settings to create simultaneous LONG & SHORT orders, plus initial stop loss and take profit orders.
         At this stage, no order is actually posted on the Binance account.
         
         To optimize the probability to open two opposite positions at the same entry price,
-        the best order type is 'MARKET'.
+        the best order type is 'MARKET'. Acknowledgements are requested with the order result,
+        so that filled orders do not need to be queried again.
 
         Arguments:
-            amount (float): quote amount to allocate for the trade
+            snapshot (market.MarketSnapshot): market data of the current tick (fetched if not given)
+            price (float): reference price used to size the orders (close price of the snapshot if None)
 
         """
         # Security: garantee to not post orders in simulation mode
@@ -162,7 +193,8 @@ class Currency(object):
             return
 
         # Prepare orders
-        price = self.get_latest_close_price()
+        if price is None:
+            price = snapshot.close_price if snapshot is not None else self.get_latest_close_price()
         # We need to take into account the precision of a contract
         amount = self.capital / (self.max_open_positions + 1 - self.n_open_positions)
         qty = round(np.floor(0.45*self.leverage*amount/price * 10**config.BASE_AMOUNT_PRECISION) / (10**config.BASE_AMOUNT_PRECISION), 3)
@@ -172,28 +204,49 @@ class Currency(object):
             'side': 'BUY',
             'positionSide': 'LONG',
             'type': 'MARKET',
-            'quantity': str(qty)
+            'quantity': str(qty),
+            'newOrderRespType': 'RESULT'
         }
         short_order = {
             'symbol': self.pair,
             'side': 'SELL',
             'positionSide': 'SHORT',
             'type': 'MARKET',
-            'quantity': str(qty)
+            'quantity': str(qty),
+            'newOrderRespType': 'RESULT'
         }
         return [long_order, short_order]
         
-    def prepare_initial_activation_orders(self, position_idx):
+    def prepare_initial_activation_orders(self, position_idx, templates=None):
         """
         After long & short initial orders have been placed, this function prepares the initial stop loss and take profit orders.
+        templates are the orders of prepare_activation_templates, when they were built ahead of the entry.
         """
         # Security: garantee to not post orders in simulation mode
         if not self.real_mode:
             return
 
-        long_entry = np.float(self.contracts[position_idx]['long']['order']['avgPrice'])
-        short_entry = np.float(self.contracts[position_idx]['short']['order']['avgPrice'])
+        long_order = self.contracts[position_idx].long.order
+        short_order = self.contracts[position_idx].short.order
+        long_entry = np.float(long_order['avgPrice'])
+        short_entry = np.float(short_order['avgPrice'])
+        long_take_profit, short_take_profit, long_stop_loss, short_stop_loss = self.prepare_activation_templates() if templates is None else templates
+
+        long_order_take_profit = dict(long_take_profit, quantity=str(long_order['executedQty']), stopPrice=str(round(long_entry * (1+self.take_profit), 2)))
+        short_order_take_profit = dict(short_take_profit, quantity=str(short_order['executedQty']), stopPrice=str(round(short_entry * (1-self.take_profit), 2)))
+        long_order_stop_loss = dict(long_stop_loss, quantity=str(long_order['executedQty']), stopPrice=str(round(long_entry * (1-self.stop_loss), self.base_price_precision)))
+        short_order_stop_loss = dict(short_stop_loss, quantity=str(short_order['executedQty']), stopPrice=str(round(short_entry * (1+self.stop_loss), self.base_price_precision)))
+        orders_list = [long_order_take_profit, short_order_take_profit, long_order_stop_loss, short_order_stop_loss]
+        return orders_list
+
+    def prepare_activation_templates(self):
+        """
+        Take profit and stop loss orders of a new position, without the fields that depend on its fills
+        (quantity and stopPrice).
 
+        Response:
+            [long take profit, short take profit, long stop loss, short stop loss]
+        """
         long_order_take_profit = {
             'symbol': self.pair,
             'side': 'SELL',
@@ -201,8 +254,6 @@ class Currency(object):
             'type': 'TAKE_PROFIT_MARKET',
             'workingType': 'MARK_PRICE',
             'priceProtect': 'TRUE',
-            'quantity': str(self.contracts[position_idx]['long']['order']['executedQty']),
-            'stopPrice': str(round(long_entry * (1+self.take_profit), 2))
         }
         short_order_take_profit = {
             'symbol': self.pair,
@@ -211,11 +262,75 @@ class Currency(object):
             'type': 'TAKE_PROFIT_MARKET',
             'workingType': 'MARK_PRICE',
             'priceProtect': 'TRUE',
-            'quantity': str(self.contracts[position_idx]['short']['order']['executedQty']),
-            'stopPrice': str(round(short_entry * (1-self.take_profit), 2))
         }
-        orders_list = [long_order_take_profit, short_order_take_profit]
-        return orders_list
+        long_order_stop_loss = self.prepare_stop_loss_order('long', None, None)
+        short_order_stop_loss = self.prepare_stop_loss_order('short', None, None)
+        return [long_order_take_profit, short_order_take_profit, long_order_stop_loss, short_order_stop_loss]
+
+    def prepare_stop_loss_order(self, position_side, stop_price, quantity):
+        """
+        Exchange-side stop loss of a leg: a STOP_MARKET order closing quantity of the position side when the mark price
+        reaches stop_price. Every slot shares the LONG and SHORT positions of the pair in hedge mode: a stop only closes
+        the quantity of its own leg, never the whole position.
+        Without stop_price and quantity, the order is returned as a template.
+        """
+        stop_order = {
+            'symbol': self.pair,
+            'side': 'SELL' if position_side == 'long' else 'BUY',
+            'positionSide': position_side.upper(),
+            'type': 'STOP_MARKET',
+            'workingType': 'MARK_PRICE',
+            'priceProtect': 'TRUE',
+        }
+        if quantity is not None:
+            stop_order['quantity'] = str(quantity)
+        if stop_price is not None:
+            stop_order['stopPrice'] = str(round(stop_price, self.base_price_precision))
+        return stop_order
+
+    def get_stop_order(self, position_idx, position_side):
+        """ Returns the exchange-side stop order of a leg, or None if its stop loss is watched locally """
+        if not self.real_mode:
+            return None
+        contract = self.contracts[position_idx][position_side].stop_loss
+        if isinstance(contract, dict) and contract.get('type') == 'STOP_MARKET':
+            return contract
+        return None
+
+    def get_take_profit_order(self, position_idx, position_side):
+        """ Returns the exchange-side take profit order of a leg, or None if its take profit is watched locally """
+        if not self.real_mode:
+            return None
+        contract = self.contracts[position_idx][position_side].take_profit
+        if isinstance(contract, dict) and contract.get('type') == 'TAKE_PROFIT_MARKET':
+            return contract
+        return None
+
+    def replace_stop_loss(self, position_idx, position_side):
+        """
+        Move the exchange-side stop order of a leg to open_positions[position_idx][position_side].stop_loss,
+        with one batch of orders and one batch of cancellations.
+        If the exchange refuses the new stop (eg. it would trigger immediately), the previous stop order is
+        cancelled and the level is watched locally, as in simulation mode.
+        """
+        if not self.real_mode:
+            return
+        previous = self.get_stop_order(position_idx, position_side)
+        orderIds = [previous['orderId']] if previous is not None else []
+        stop_order = self.prepare_stop_loss_order(
+            position_side,
+            self.open_positions[position_idx][position_side].stop_loss,
+            self.contracts[position_idx][position_side].order['executedQty'],
+        )
+        try:
+            placed, _ = Binance_API.replace_orders(self.pair, orderIds, [stop_order])
+            self.contracts[position_idx][position_side].stop_loss = placed[0]
+        except retries.RetryError as error:
+            print(f'Error: stop loss of position {position_idx} ({position_side}) cannot be moved on the exchange\n{error}')
+            if len(orderIds) > 0:
+                Binance_API.cancel_multiple_orders(self.pair, orderIds)
+            self.contracts[position_idx][position_side].stop_loss = None
+        return
 
     def place_orders_simultaneously(self, order_list):
         recvWindow = 2000 if len(order_list) == 2 else 4000
@@ -223,109 +338,114 @@ class Currency(object):
         return posted_orders
     
     def cancel_order(self, orderId):
-        order = Binance_API.cancel_order(self.pair, orderId)
-        if 'status' in order.keys():
-            if order['status'] != 'CANCELED':
-                return self.cancel_order(orderId)
-            else:
-                return order
-        else:
-            return None
+        # Retries are bounded and handled by Binance_API
+        return Binance_API.cancel_order(self.pair, orderId)
 
     def place_single_order(self, order_settings):
+        # Retries are bounded and handled by Binance_API
         order = Binance_API.create_order(order_settings)
         print(order)
-        if not 'status' in order.keys():
-            return self.place_single_order(order_settings)
         return order
 
-    def is_stop_loss_activated(self, position_idx, position_side):
+    def is_stop_loss_activated(self, position_idx, position_side, snapshot=None):
         """
         Returns True if stop loss has been filled during the last time interval, else False.
+        In real mode, a leg protected by an exchange-side stop order is activated once that order is filled.
 
         Arguments:
             position_idx (int): studied position
             position_side (str): either 'long' or 'short'
+            snapshot (market.MarketSnapshot): market data of the current tick (fetched if not given)
         
         Response:
             True if stop loss activated recently, else False
         """
+        stop_order = self.get_stop_order(position_idx, position_side)
+        if stop_order is not None:
+            stop_order = streams.query_order(self.pair, stop_order['orderId'])
+            if stop_order['status'] != 'FILLED' and not stop_order['status'] in Binance_API.FINAL_ORDER_STATUSES:
+                return False
+            if stop_order['status'] == 'FILLED':
+                position = self.open_positions[position_idx][position_side]
+                return position.actualised == False or position.exit == 0
+            # The stop order was cancelled or expired on the exchange: the level is watched locally
+
+        close_price = snapshot.close_price if snapshot is not None else self.get_latest_close_price()
         if position_side == 'long':
-            case1 = self.open_positions[position_idx]['long']['actualised'] == False and self.get_latest_close_price() < self.open_positions[position_idx]['long']['stop loss']
-            case2 = self.open_positions[position_idx]['long']['actualised'] == True and self.get_latest_close_price() < self.open_positions[position_idx]['long']['stop loss']
-            case2 = case2 and self.open_positions[position_idx]['long']['exit'] == 0
+            case1 = self.open_positions[position_idx].long.actualised == False and close_price < self.open_positions[position_idx].long.stop_loss
+            case2 = self.open_positions[position_idx].long.actualised == True and close_price < self.open_positions[position_idx].long.stop_loss
+            case2 = case2 and self.open_positions[position_idx].long.exit == 0
         else:
-            case1 = self.open_positions[position_idx]['short']['actualised'] == False and self.get_latest_close_price() > self.open_positions[position_idx]['short']['stop loss']
-            case2 = self.open_positions[position_idx]['short']['actualised'] == True and self.get_latest_close_price() > self.open_positions[position_idx]['short']['stop loss']
-            case2 = case2 and self.open_positions[position_idx]['short']['exit'] == 0
+            case1 = self.open_positions[position_idx].short.actualised == False and close_price > self.open_positions[position_idx].short.stop_loss
+            case2 = self.open_positions[position_idx].short.actualised == True and close_price > self.open_positions[position_idx].short.stop_loss
+            case2 = case2 and self.open_positions[position_idx].short.exit == 0
         return case1 or case2
 
-    def is_take_profit_activated(self, position_idx, position_side):
+    def is_take_profit_activated(self, position_idx, position_side, snapshot=None):
         """
         Returns True if take profit has been filled during the last time interval, else False.
+        In real mode, a leg without take profit order on the exchange is checked against the price, as in simulation mode.
 
         Arguments:
             position_idx (int): studied position
             position_side (str): either 'long' or 'short'
+            snapshot (market.MarketSnapshot): market data of the current tick (fetched if not given)
         
         Response:
             True if take profit activated recently, else False
         """
-        if self.real_mode:
-            take_profit_contract = self.contracts[position_idx][position_side]['take profit']
-            contract_status = Binance_API.query_order(self.pair, take_profit_contract['orderId'])['status']
-            case = (self.open_positions[position_idx][position_side]['actualised'] == True and contract_status == 'FILLED')
+        take_profit_contract = self.get_take_profit_order(position_idx, position_side)
+        if take_profit_contract is not None:
+            contract_status = streams.query_order(self.pair, take_profit_contract['orderId'])['status']
+            if contract_status == 'FILLED' or not contract_status in Binance_API.FINAL_ORDER_STATUSES:
+                return (self.open_positions[position_idx][position_side].actualised == True and contract_status == 'FILLED')
+            # The take profit order was cancelled or expired on the exchange: the level is watched locally
+
+        close_price = snapshot.close_price if snapshot is not None else self.get_latest_close_price()
+        if position_side == 'long':
+            case = (self.open_positions[position_idx][position_side].actualised == True and self.open_positions[position_idx][position_side].take_profit < close_price)
         else:
-            if position_side == 'long':
-                case = (self.open_positions[position_idx][position_side]['actualised'] == True and self.open_positions[position_idx][position_side]['take profit'] < self.get_latest_close_price())
-            else:
-                case = (self.open_positions[position_idx][position_side]['actualised'] == True and self.open_positions[position_idx][position_side]['take profit'] > self.get_latest_close_price())
+            case = (self.open_positions[position_idx][position_side].actualised == True and self.open_positions[position_idx][position_side].take_profit > close_price)
         return case
 
 
     def update_ledgers(self, position_idx):
         # Update OrderLedger
         if self.real_mode:
-            order_ledger = utils.read_csv(config.order_ledger_path)
-            order_ledger = order_ledger.append(self.contracts[position_idx]['long']['order'], ignore_index=True)
-            order_ledger = order_ledger.append(self.contracts[position_idx]['long']['stop loss'], ignore_index=True)
-            order_ledger = order_ledger.append(self.contracts[position_idx]['long']['take profit'], ignore_index=True)
-            order_ledger = order_ledger.append(self.contracts[position_idx]['short']['order'], ignore_index=True)
-            order_ledger = order_ledger.append(self.contracts[position_idx]['short']['stop loss'], ignore_index=True)
-            order_ledger = order_ledger.append(self.contracts[position_idx]['short']['take profit'], ignore_index=True)
-            utils.dump_as_csv(order_ledger, config.order_ledger_path)
+            contracts = self.contracts[position_idx]
+            orders = [
+                contracts.long.order, contracts.long.stop_loss, contracts.long.take_profit,
+                contracts.short.order, contracts.short.stop_loss, contracts.short.take_profit,
+            ]
+            # Cancelled orders are recorded as 'CANCELLED' markers, not as order details
+            ledgers.order_ledger.add([order for order in orders if isinstance(order, dict)])
         return
 
 
     def close_position(self, position_idx):
         # Compute final trade stats
-        self.open_positions[position_idx]['long']['type'] = 'LONG'
-        self.open_positions[position_idx]['short']['type'] = 'SHORT'
-        self.open_positions[position_idx]['long']['abs capital gain %'] = (self.open_positions[position_idx]['long']['exit']/self.open_positions[position_idx]['long']['entry'] - 1) * self.leverage / 100
-        self.open_positions[position_idx]['short']['abs capital gain %'] = (self.open_positions[position_idx]['short']['entry']/self.open_positions[position_idx]['short']['exit'] - 1) * self.leverage / 100
-        self.open_positions[position_idx]['long']['abs capital gain'] = self.open_positions[position_idx]['long']['qty'] * self.open_positions[position_idx]['long']['entry'] * (self.open_positions[position_idx]['long']['exit']/self.open_positions[position_idx]['long']['entry'] - 1)
-        self.open_positions[position_idx]['short']['abs capital gain'] = self.open_positions[position_idx]['short']['qty'] * self.open_positions[position_idx]['short']['entry'] * (self.open_positions[position_idx]['short']['entry']/self.open_positions[position_idx]['short']['exit'] - 1)
-        self.open_positions[position_idx]['long']['fees'] = 0.0004 * self.open_positions[position_idx]['long']['qty'] * (self.open_positions[position_idx]['long']['entry'] + self.open_positions[position_idx]['long']['exit'])
-        self.open_positions[position_idx]['short']['fees'] = 0.0004 * self.open_positions[position_idx]['short']['qty'] * (self.open_positions[position_idx]['short']['entry'] + self.open_positions[position_idx]['short']['exit'])
-        self.open_positions[position_idx]['long']['net capital gain'] = self.open_positions[position_idx]['long']['abs capital gain'] - self.open_positions[position_idx]['long']['fees']
-        self.open_positions[position_idx]['short']['net capital gain'] = self.open_positions[position_idx]['short']['abs capital gain'] - self.open_positions[position_idx]['short']['fees']
+        long = self.open_positions[position_idx].long
+        short = self.open_positions[position_idx].short
+        long_trade = long.to_dict()
+        short_trade = short.to_dict()
+        long_trade['type'] = 'LONG'
+        short_trade['type'] = 'SHORT'
+        long_trade['abs capital gain %'] = (long.exit/long.entry - 1) * self.leverage / 100
+        short_trade['abs capital gain %'] = (short.entry/short.exit - 1) * self.leverage / 100
+        long_trade['abs capital gain'] = long.qty * long.entry * (long.exit/long.entry - 1)
+        short_trade['abs capital gain'] = short.qty * short.entry * (short.entry/short.exit - 1)
+        long_trade['fees'] = 0.0004 * long.qty * (long.entry + long.exit)
+        short_trade['fees'] = 0.0004 * short.qty * (short.entry + short.exit)
+        long_trade['net capital gain'] = long_trade['abs capital gain'] - long_trade['fees']
+        short_trade['net capital gain'] = short_trade['abs capital gain'] - short_trade['fees']
         # Update TradeLedger
-        trade_ledger = utils.read_csv(config.trade_ledger_path)
-        trade_ledger = trade_ledger.append(self.open_positions[position_idx]['long'], ignore_index=True)
-        trade_ledger = trade_ledger.append(self.open_positions[position_idx]['short'], ignore_index=True)
-        utils.dump_as_csv(trade_ledger, config.trade_ledger_path)
+        ledgers.trade_ledger.add([long_trade, short_trade])
         # Update capital & n_open_positions
-        long = self.open_positions[position_idx]['long']
-        short = self.open_positions[position_idx]['short']
-        self.LONG.append(long)
-        self.SHORT.append(short)
         self.update_capital()
         self.open_positions[position_idx] = None
-        self.contracts[position_idx] = {
-            'long': {'order': None, 'stop loss': None, 'take profit': None},
-            'short': {'order': None, 'stop loss': None, 'take profit': None},                
-        }
+        self.contracts[position_idx] = positions.new_contracts()
         self.n_open_positions -= 1
+        self.update_triggers(position_idx)
         return
 
     def load_latest_ohlc(self):
@@ -333,33 +453,36 @@ class Currency(object):
         Returns latest ohlc candlestick (proportional to config.SLOW_PERIOD), with computed fast and slow EMAs.
         """
         limit = 3*config.SLOW_PERIOD
-        ohlc = Binance_API.get_contract_klines(self.pair, self.timeframe, contractType='PERPETUAL', limit=limit)
-        ohlc = pd.DataFrame(ohlc, columns=config.OHLC_COLUMNS)
+        ohlc = candles.get_store(self.pair, self.timeframe).load(limit=limit)
         ohlc = ohlc[ohlc['open_time'] < 1000*self.next_timestamp.timestamp()]
-        ohlc['ema_fast'] = ema_indicator(ohlc['close_price'], config.FAST_PERIOD)
-        ohlc['ema_slow'] = ema_indicator(ohlc['close_price'], config.SLOW_PERIOD)
+        # Columns of the structured array are handed over to pandas without per-element conversion
+        ohlc = pd.DataFrame(ohlc)
+        ohlc['ema_fast'] = indicators.ema_series(ohlc['close_price'].values, config.FAST_PERIOD)
+        ohlc['ema_slow'] = indicators.ema_series(ohlc['close_price'].values, config.SLOW_PERIOD)
         return ohlc
 
-    def update_contracts(self):
-        for i in range(self.n_open_positions):
-            for position_side in ['long', 'short']:
-                sl_prev_status = self.contracts[i][position_side]['stop loss']['status']
-                tp_prev_status = self.contracts[i][position_side]['take profit']['status']
-                self.contracts[i][position_side]['stop loss'] = Binance_API.query_order(self.pair, self.contracts[i][position_side]['stop loss']['orderId'])
-                self.contracts[i][position_side]['take profit'] = Binance_API.query_order(self.pair, self.contracts[i][position_side]['take profit']['orderId'])                 
-                
-                if self.open_positions[i][position_side]['actualised'] == True:
-                    case_0 = (sl_prev_status != self.contracts[i][position_side]['stop loss']['status'])
-                    case_1 = (tp_prev_status != self.contracts[i][position_side]['take profit']['status'])
-                    if case_0 or case_1:
-                        self.update_ledgers(i)
-                        self.close_position(i)
-                
-        return
+    def update_ema(self, history=None):
+        """
+        Bring the running EMAs up to the last candle closed before next_timestamp.
+        The first call (or a call after missing candles) seeds them on the whole candle store history.
+        The close price at which the candle ending at next_timestamp crosses the EMAs is then published in self.ema_trigger.
+
+        Arguments:
+            history (structured array): closed candles of self.timeframe (eg. MarketSnapshot.ohlc), read from the store if not given
+        """
+        if getattr(self, 'ema', None) is None:
+            # Currency pickled before running EMAs were introduced
+            self.ema = indicators.EMACross(config.FAST_PERIOD, config.SLOW_PERIOD, candles.INTERVAL_MS[self.timeframe])
+        if history is None:
+            history = candles.get_store(self.pair, self.timeframe).load()
+        history = history[history['open_time'] < 1000*self.next_timestamp.timestamp()]
+        self.ema.catch_up(history)
+        self.ema_trigger = self.ema.get_trigger()
+        return self.ema
 
     def update_capital(self):
         if self.real_mode:
-            available_account_balance = Binance_API.get_futures_account_balance()
+            available_account_balance = streams.get_futures_account_balance()
             available_account_balance = available_account_balance['availableBalance']
             self.capital = available_account_balance
         return
@@ -0,0 +1,127 @@
+# SSX999 Project Hedge
+
+# Augustin BRISSART
+# GitHub: @augustin999
+
+# June 2021
+
+
+# Positions of a Currency, as small fixed-layout records instead of nested dicts.
+# Fields are attributes (position.long.stop_loss), records are also readable and writable
+# by their ledger label (position['long']['stop loss']) so that ledgers and older code keep working.
+# Records pickle as a plain tuple of values.
+
+
+class Record(object):
+    """ Base of the position records: LABELS maps ledger labels to attributes, in column order """
+    __slots__ = ()
+    LABELS = dict()
+
+    def __getitem__(self, label: str):
+        return getattr(self, self.LABELS[label])
+
+    def __setitem__(self, label: str, value):
+        setattr(self, self.LABELS[label], value)
+        return
+
+    def keys(self):
+        return self.LABELS.keys()
+
+    def get(self, label: str, default=None):
+        return getattr(self, self.LABELS[label]) if label in self.LABELS.keys() else default
+
+    def to_dict(self):
+        return {label: getattr(self, attribute) for label, attribute in self.LABELS.items()}
+
+    def __reduce__(self):
+        return (self.__class__, tuple(getattr(self, attribute) for attribute in self.__slots__))
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.to_dict()})'
+
+
+class Leg(Record):
+    """
+    One side of a hedged position.
+
+    Attributes:
+        entry_time (int): opening time in s
+        exit_time (float): closing time in s, 0 while open
+        id (int): position id, shared by both legs
+        entry (float): entry price
+        exit (float): exit price, 0 while open
+        qty (float): base quantity
+        leverage (int)
+        stop_loss (float): stop loss price
+        take_profit (float): take profit price
+        actualised (bool): True once the opposite leg was stopped (the take profit is then watched)
+        covered_fees (int): stop loss ratchets on the opposite exit price (0, 1 or 2 times the fee rate)
+        triggered_on (str): closing reason ('STOP LOSS 1', 'STOP LOSS 2', 'TAKE PROFIT')
+    """
+    __slots__ = (
+        'entry_time', 'exit_time', 'id', 'entry', 'exit', 'qty', 'leverage',
+        'stop_loss', 'take_profit', 'actualised', 'covered_fees', 'triggered_on'
+    )
+    LABELS = {
+        'entry time': 'entry_time', 'exit time': 'exit_time', 'id': 'id', 'entry': 'entry', 'exit': 'exit',
+        'qty': 'qty', 'leverage': 'leverage', 'stop loss': 'stop_loss', 'take profit': 'take_profit',
+        'actualised': 'actualised', 'covered fees': 'covered_fees', 'triggered on': 'triggered_on',
+    }
+
+    def __init__(self, entry_time=0, exit_time=0, id=0, entry=0., exit=0., qty=0., leverage=1,
+                 stop_loss=0., take_profit=0., actualised=False, covered_fees=0, triggered_on=None):
+        self.entry_time = entry_time
+        self.exit_time = exit_time
+        self.id = id
+        self.entry = entry
+        self.exit = exit
+        self.qty = qty
+        self.leverage = leverage
+        self.stop_loss = stop_loss
+        self.take_profit = take_profit
+        self.actualised = actualised
+        self.covered_fees = covered_fees
+        self.triggered_on = triggered_on
+        return
+
+
+class LegOrders(Record):
+    """ Exchange orders of a leg (order details as returned by Binance_API), None until placed """
+    __slots__ = ('order', 'stop_loss', 'take_profit')
+    LABELS = {'order': 'order', 'stop loss': 'stop_loss', 'take profit': 'take_profit'}
+
+    def __init__(self, order=None, stop_loss=None, take_profit=None):
+        self.order = order
+        self.stop_loss = stop_loss
+        self.take_profit = take_profit
+        return
+
+
+class Pair(Record):
+    """ Long and short records of a position slot, also indexed by side ('long' or 'short') """
+    __slots__ = ('long', 'short')
+    LABELS = {'long': 'long', 'short': 'short'}
+
+    def __init__(self, long, short):
+        self.long = long
+        self.short = short
+        return
+
+
+def new_position(long: Leg, short: Leg):
+    return Pair(long, short)
+
+
+def new_contracts():
+    return Pair(LegOrders(), LegOrders())
+
+
+def from_dicts(position: dict, record=Leg):
+    """ Convert a position (or its contracts) stored as {'long': dict, 'short': dict} by earlier versions """
+    if position is None or isinstance(position, Pair):
+        return position
+    sides = []
+    for side in ['long', 'short']:
+        values = {record.LABELS[label]: value for label, value in position[side].items() if label in record.LABELS.keys()}
+        sides.append(record(**values))
+    return Pair(*sides)
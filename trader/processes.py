@@ -12,14 +12,30 @@ import logging
 
 try:    
     from trader import Binance_API
+    from trader import Binance_API_async
+    from trader import candles
     from trader import config
+    from trader import entry
+    from trader import ledgers
+    from trader import market
     from trader import models
-    from trader import utils
+    from trader import retries
+    from trader import state
+    from trader import streams
+    from trader import triggers
 except:
     import Binance_API
+    import Binance_API_async
+    import candles
     import config
+    import entry
+    import ledgers
+    import market
     import models
-    import utils
+    import retries
+    import state
+    import streams
+    import triggers
 
 logger = logging.getLogger('trader')
 logger.setLevel(logging.DEBUG)
@@ -64,15 +80,16 @@ def check_position_mode():
     return
 
 
-def wait_for_next_timestamp(TradedCurrency):
+def wait_for_next_timestamp(TradedCurrency, lead=0):
+    """ Sleep until `lead` seconds before next_timestamp (server time) """
     try:
         counter = 0
-        server_time = Binance_API.get_server_time() / 1000
-        while server_time < TradedCurrency.next_timestamp.timestamp() and counter < 10:
-            sleep_time = int(TradedCurrency.next_timestamp.timestamp() - server_time + 2)
-            print(f'Sleep for {sleep_time} seconds')
+        server_time = Binance_API.get_synced_server_time() / 1000
+        while server_time < TradedCurrency.next_timestamp.timestamp() - lead and counter < 10:
+            sleep_time = TradedCurrency.next_timestamp.timestamp() - lead - server_time
+            print(f'Sleep for {sleep_time:.3f} seconds')
             tm.sleep(sleep_time)
-            server_time = Binance_API.get_server_time() / 1000
+            server_time = Binance_API.get_synced_server_time() / 1000
             counter += 1
     except:
         error_msg = f'Error: Either cannot get server time (API overloaded) or next timestamp never reached'
@@ -84,127 +101,246 @@ def wait_for_next_timestamp(TradedCurrency):
     return
 
 
-def first_long_stop_loss_activation(TradedCurrency, i):
+def load_boundary_snapshot(TradedCurrency, snapshot, wait=tm.sleep):
+    """
+    Reload the market data until the candle ending at next_timestamp is available
+    (Binance may serve it a few hundred milliseconds after the boundary).
+    """
+    boundary = 1000 * TradedCurrency.next_timestamp.timestamp()
+    for _ in range(10):
+        snapshot.load(force=True)
+        if len(snapshot.ohlc) > 0 and snapshot.ohlc['close_time'][-1] >= boundary - 1:
+            break
+        wait(config.DAEMON_CANDLE_DELAY)
+    return snapshot
+
+
+def close_leg_at_market(TradedCurrency, i, position_side):
+    """
+    Close one leg with a MARKET order while its take profit and stop loss orders are cancelled concurrently.
+    Once the leg is closed, orders which cannot be cancelled are reported: the leg is recorded as closed anyway.
+
+    Response:
+        [filled closing contract, cancelled take profit contract]
+    """
+    stop_order_settings = {
+        'symbol': TradedCurrency.pair,
+        'side': 'SELL' if position_side == 'long' else 'BUY',
+        'positionSide': position_side.upper(),
+        'type': 'MARKET',
+        'quantity': str(TradedCurrency.contracts[i][position_side].order['executedQty']),
+    }
+    take_profit = TradedCurrency.get_take_profit_order(i, position_side)
+    orderIds = [take_profit['orderId']] if take_profit is not None else []
+    stop_order = TradedCurrency.get_stop_order(i, position_side)
+    if stop_order is not None:
+        orderIds.append(stop_order['orderId'])
+    filled_contract, cancelled_orders = Binance_API_async.run_concurrently(
+        Binance_API_async.create_and_query_order(stop_order_settings),
+        Binance_API_async.cancel_multiple_orders(TradedCurrency.pair, orderIds),
+        return_exceptions=True,
+    )
+    if isinstance(filled_contract, Exception):
+        raise filled_contract
+    cancelled_take_profit = TradedCurrency.contracts[i][position_side].take_profit
+    if isinstance(cancelled_orders, Exception):
+        logger.error(f'Error: orders {orderIds} of the closed leg {position_side} of position {i} cannot be cancelled, cancel them on the exchange\n{cancelled_orders}')
+    elif take_profit is not None:
+        cancelled_take_profit = cancelled_orders[0]
+    return [filled_contract, cancelled_take_profit]
+
+
+def cancel_stop_order(TradedCurrency, i, position_side):
+    """
+    Cancel the exchange-side stop order of a leg closed by its take profit: stops are sized to their leg, the order
+    would otherwise close the quantity of the leg on the position side shared with the other slots.
+
+    Response:
+        cancelled stop order, or 'CANCELLED' if the stop loss was watched locally
+    """
+    stop_order = TradedCurrency.get_stop_order(i, position_side)
+    if stop_order is None:
+        return 'CANCELLED'
+    return Binance_API.cancel_order(TradedCurrency.pair, stop_order['orderId'])
+
+
+def close_leg(TradedCurrency, i, position_side):
+    """
+    Close a leg whose stop loss was reached.
+    If its exchange-side stop order was filled, only its take profit order is left to cancel,
+    else the leg is closed at market.
+
+    Response:
+        [filled closing contract, cancelled take profit contract]
+    """
+    stop_order = TradedCurrency.get_stop_order(i, position_side)
+    if stop_order is not None:
+        stop_order = streams.query_order(TradedCurrency.pair, stop_order['orderId'])
+        if stop_order['status'] == 'FILLED':
+            take_profit = TradedCurrency.get_take_profit_order(i, position_side)
+            if take_profit is None:
+                return [stop_order, TradedCurrency.contracts[i][position_side].take_profit]
+            return [stop_order, Binance_API.cancel_order(TradedCurrency.pair, take_profit['orderId'])]
+    return close_leg_at_market(TradedCurrency, i, position_side)
+
+
+def close_take_profit_leg(TradedCurrency, i, position_side):
+    """
+    Close a leg whose take profit was reached.
+    If its take profit order was filled, only its stop order is left to cancel,
+    else (take profit watched locally) the leg is closed at market.
+
+    Response:
+        [filled closing contract, cancelled stop loss contract]
+    """
+    take_profit = TradedCurrency.get_take_profit_order(i, position_side)
+    if take_profit is not None:
+        take_profit = streams.query_order(TradedCurrency.pair, take_profit['orderId'])
+        if take_profit['status'] == 'FILLED':
+            return [take_profit, cancel_stop_order(TradedCurrency, i, position_side)]
+    filled_contract, _ = close_leg_at_market(TradedCurrency, i, position_side)
+    return [filled_contract, 'CANCELLED']
+
+
+def first_long_stop_loss_activation(TradedCurrency, i, snapshot=None):
+    if snapshot is None:
+        snapshot = market.load_snapshot(TradedCurrency.pair, TradedCurrency.timeframe)
     if TradedCurrency.real_mode:
         # Contract is filled => update : long position (exit, exit time, actualised) & short position (stop loss, actualised)
-        stop_order_settings = {
-            'symbol': TradedCurrency.pair,
-            'side': 'SELL',
-            'positionSide': 'LONG',
-            'type': 'MARKET',
-            'quantity': str(TradedCurrency.contracts[i]['long']['order']['executedQty']),
-        }
-        filled_contract = TradedCurrency.place_single_order(stop_order_settings)
-        filled_contract = Binance_API.query_order(TradedCurrency.pair, filled_contract['orderId'])
-        TradedCurrency.contracts[i]['long']['stop loss'] = filled_contract
-        TradedCurrency.open_positions[i]['long']['exit time'] = round(tm.time(), 3)
-        TradedCurrency.open_positions[i]['long']['exit'] = np.float(filled_contract['avgPrice'])
-        TradedCurrency.open_positions[i]['long']['actualised'] = True
-        TradedCurrency.open_positions[i]['long']['triggered on'] = 'STOP LOSS 1'
-        TradedCurrency.contracts[i]['long']['take profit'] = Binance_API.cancel_order(TradedCurrency.pair, TradedCurrency.contracts[i]['long']['take profit']['orderId'])
+        filled_contract, cancelled_take_profit = close_leg(TradedCurrency, i, 'long')
+        TradedCurrency.contracts[i].long.stop_loss = filled_contract
+        TradedCurrency.open_positions[i].long.exit_time = round(tm.time(), 3)
+        TradedCurrency.open_positions[i].long.exit = np.float(filled_contract['avgPrice'])
+        TradedCurrency.open_positions[i].long.actualised = True
+        TradedCurrency.open_positions[i].long.triggered_on = 'STOP LOSS 1'
+        TradedCurrency.contracts[i].long.take_profit = cancelled_take_profit
         
-        TradedCurrency.open_positions[i]['short']['actualised'] = True
-        if TradedCurrency.update_price() < TradedCurrency.open_positions[i]['long']['exit'] * (1-2*TradedCurrency.fee_rate):
-            TradedCurrency.open_positions[i]['short']['stop loss'] = TradedCurrency.open_positions[i]['long']['exit'] * (1-2*TradedCurrency.fee_rate)
-        elif TradedCurrency.update_price() < TradedCurrency.open_positions[i]['long']['exit'] * (1-TradedCurrency.fee_rate):
-            TradedCurrency.open_positions[i]['short']['stop loss'] = TradedCurrency.open_positions[i]['long']['exit'] * (1-TradedCurrency.fee_rate)
+        TradedCurrency.open_positions[i].short.actualised = True
+        price = snapshot.get_price(refresh=TradedCurrency.real_mode)
+        if price < TradedCurrency.open_positions[i].long.exit * (1-2*TradedCurrency.fee_rate):
+            TradedCurrency.open_positions[i].short.stop_loss = TradedCurrency.open_positions[i].long.exit * (1-2*TradedCurrency.fee_rate)
+        elif price < TradedCurrency.open_positions[i].long.exit * (1-TradedCurrency.fee_rate):
+            TradedCurrency.open_positions[i].short.stop_loss = TradedCurrency.open_positions[i].long.exit * (1-TradedCurrency.fee_rate)
         else:
-            TradedCurrency.open_positions[i]['short']['stop loss'] = TradedCurrency.open_positions[i]['long']['exit']
+            TradedCurrency.open_positions[i].short.stop_loss = TradedCurrency.open_positions[i].long.exit
+        TradedCurrency.replace_stop_loss(i, 'short')
     else:
-        TradedCurrency.open_positions[i]['long']['exit'] = TradedCurrency.open_positions[i]['long']['stop loss']
-        TradedCurrency.open_positions[i]['long']['actualised'] = True
-        TradedCurrency.open_positions[i]['long']['triggered on'] = 'STOP LOSS 1'
-        TradedCurrency.open_positions[i]['long']['exit time'] = round(tm.time(), 3)
-        TradedCurrency.open_positions[i]['short']['actualised'] = True
-        if TradedCurrency.update_price() < TradedCurrency.open_positions[i]['long']['exit'] * (1-2*TradedCurrency.fee_rate):
-            TradedCurrency.open_positions[i]['short']['stop loss'] = TradedCurrency.open_positions[i]['long']['exit'] * (1-2*TradedCurrency.fee_rate)
-        elif TradedCurrency.update_price() < TradedCurrency.open_positions[i]['long']['exit'] * (1-TradedCurrency.fee_rate):
-            TradedCurrency.open_positions[i]['short']['stop loss'] = TradedCurrency.open_positions[i]['long']['exit'] * (1-TradedCurrency.fee_rate)
+        TradedCurrency.open_positions[i].long.exit = TradedCurrency.open_positions[i].long.stop_loss
+        TradedCurrency.open_positions[i].long.actualised = True
+        TradedCurrency.open_positions[i].long.triggered_on = 'STOP LOSS 1'
+        TradedCurrency.open_positions[i].long.exit_time = round(tm.time(), 3)
+        TradedCurrency.open_positions[i].short.actualised = True
+        price = snapshot.get_price(refresh=TradedCurrency.real_mode)
+        if price < TradedCurrency.open_positions[i].long.exit * (1-2*TradedCurrency.fee_rate):
+            TradedCurrency.open_positions[i].short.stop_loss = TradedCurrency.open_positions[i].long.exit * (1-2*TradedCurrency.fee_rate)
+        elif price < TradedCurrency.open_positions[i].long.exit * (1-TradedCurrency.fee_rate):
+            TradedCurrency.open_positions[i].short.stop_loss = TradedCurrency.open_positions[i].long.exit * (1-TradedCurrency.fee_rate)
         else:
-            TradedCurrency.open_positions[i]['short']['stop loss'] = TradedCurrency.open_positions[i]['long']['exit']
+            TradedCurrency.open_positions[i].short.stop_loss = TradedCurrency.open_positions[i].long.exit
 
-        money_back = TradedCurrency.open_positions[i]['long']['qty'] * TradedCurrency.open_positions[i]['long']['entry'] / TradedCurrency.open_positions[i]['long']['leverage']
-        money_back += TradedCurrency.open_positions[i]['long']['qty'] * TradedCurrency.open_positions[i]['long']['entry'] * (TradedCurrency.open_positions[i]['long']['exit']/TradedCurrency.open_positions[i]['long']['entry'] - 1)
-        money_back -= TradedCurrency.open_positions[i]['long']['qty'] * TradedCurrency.open_positions[i]['long']['exit'] * TradedCurrency.fee_rate
+        money_back = TradedCurrency.open_positions[i].long.qty * TradedCurrency.open_positions[i].long.entry / TradedCurrency.open_positions[i].long.leverage
+        money_back += TradedCurrency.open_positions[i].long.qty * TradedCurrency.open_positions[i].long.entry * (TradedCurrency.open_positions[i].long.exit/TradedCurrency.open_positions[i].long.entry - 1)
+        money_back -= TradedCurrency.open_positions[i].long.qty * TradedCurrency.open_positions[i].long.exit * TradedCurrency.fee_rate
         TradedCurrency.capital += money_back
     
     TradedCurrency.update_capital()
     return TradedCurrency
 
 
-def first_short_stop_loss_activation(TradedCurrency, i):
+def first_short_stop_loss_activation(TradedCurrency, i, snapshot=None):
+    if snapshot is None:
+        snapshot = market.load_snapshot(TradedCurrency.pair, TradedCurrency.timeframe)
     if TradedCurrency.real_mode:
         # Contract is filled => update : short position (exit, exit time, actualised) & long position (stop loss, actualised)
-        stop_order_settings = {
-            'symbol': TradedCurrency.pair,
-            'side': 'BUY',
-            'positionSide': 'SHORT',
-            'type': 'MARKET',
-            'quantity': str(TradedCurrency.contracts[i]['short']['order']['executedQty']),
-        }
-        filled_contract = TradedCurrency.place_single_order(stop_order_settings)
-        filled_contract = Binance_API.query_order(TradedCurrency.pair, filled_contract['orderId'])
-        TradedCurrency.contracts[i]['short']['stop loss'] = filled_contract
-        TradedCurrency.open_positions[i]['short']['exit time'] = round(tm.time(), 3)
-        TradedCurrency.open_positions[i]['short']['exit'] = np.float(filled_contract['avgPrice'])
-        TradedCurrency.open_positions[i]['short']['actualised'] = True
-        TradedCurrency.open_positions[i]['short']['triggered on'] = 'STOP LOSS 1'
-        TradedCurrency.contracts[i]['short']['take profit'] = Binance_API.cancel_order(TradedCurrency.pair, TradedCurrency.contracts[i]['short']['take profit']['orderId'])
-
-        TradedCurrency.open_positions[i]['long']['actualised'] = True
-        if TradedCurrency.update_price() > TradedCurrency.open_positions[i]['short']['exit'] * (1+2*TradedCurrency.fee_rate):
-            TradedCurrency.open_positions[i]['long']['stop loss'] = TradedCurrency.open_positions[i]['short']['exit'] * (1+2*TradedCurrency.fee_rate)
-        elif TradedCurrency.update_price() > TradedCurrency.open_positions[i]['short']['exit'] * (1+TradedCurrency.fee_rate):
-            TradedCurrency.open_positions[i]['long']['stop loss'] = TradedCurrency.open_positions[i]['short']['exit'] * (1+TradedCurrency.fee_rate)
+        filled_contract, cancelled_take_profit = close_leg(TradedCurrency, i, 'short')
+        TradedCurrency.contracts[i].short.stop_loss = filled_contract
+        TradedCurrency.open_positions[i].short.exit_time = round(tm.time(), 3)
+        TradedCurrency.open_positions[i].short.exit = np.float(filled_contract['avgPrice'])
+        TradedCurrency.open_positions[i].short.actualised = True
+        TradedCurrency.open_positions[i].short.triggered_on = 'STOP LOSS 1'
+        TradedCurrency.contracts[i].short.take_profit = cancelled_take_profit
+
+        TradedCurrency.open_positions[i].long.actualised = True
+        price = snapshot.get_price(refresh=TradedCurrency.real_mode)
+        if price > TradedCurrency.open_positions[i].short.exit * (1+2*TradedCurrency.fee_rate):
+            TradedCurrency.open_positions[i].long.stop_loss = TradedCurrency.open_positions[i].short.exit * (1+2*TradedCurrency.fee_rate)
+        elif price > TradedCurrency.open_positions[i].short.exit * (1+TradedCurrency.fee_rate):
+            TradedCurrency.open_positions[i].long.stop_loss = TradedCurrency.open_positions[i].short.exit * (1+TradedCurrency.fee_rate)
         else:
-            TradedCurrency.open_positions[i]['long']['stop loss'] = TradedCurrency.open_positions[i]['short']['exit']
+            TradedCurrency.open_positions[i].long.stop_loss = TradedCurrency.open_positions[i].short.exit
+        TradedCurrency.replace_stop_loss(i, 'long')
 
     else:
-        TradedCurrency.open_positions[i]['short']['exit'] = TradedCurrency.open_positions[i]['short']['stop loss'] 
-        TradedCurrency.open_positions[i]['short']['actualised'] = True
-        TradedCurrency.open_positions[i]['short']['triggered on'] = 'STOP LOSS 1'
-        TradedCurrency.open_positions[i]['short']['exit time'] = round(tm.time(), 3)
-        TradedCurrency.open_positions[i]['long']['actualised'] = True
-        if TradedCurrency.update_price() > TradedCurrency.open_positions[i]['short']['exit'] * (1+2*TradedCurrency.fee_rate):
-            TradedCurrency.open_positions[i]['long']['stop loss'] = TradedCurrency.open_positions[i]['short']['exit'] * (1+2*TradedCurrency.fee_rate)
-        elif TradedCurrency.update_price() > TradedCurrency.open_positions[i]['short']['exit'] * (1+TradedCurrency.fee_rate):
-            TradedCurrency.open_positions[i]['long']['stop loss'] = TradedCurrency.open_positions[i]['short']['exit'] * (1+TradedCurrency.fee_rate)
+        TradedCurrency.open_positions[i].short.exit = TradedCurrency.open_positions[i].short.stop_loss 
+        TradedCurrency.open_positions[i].short.actualised = True
+        TradedCurrency.open_positions[i].short.triggered_on = 'STOP LOSS 1'
+        TradedCurrency.open_positions[i].short.exit_time = round(tm.time(), 3)
+        TradedCurrency.open_positions[i].long.actualised = True
+        price = snapshot.get_price(refresh=TradedCurrency.real_mode)
+        if price > TradedCurrency.open_positions[i].short.exit * (1+2*TradedCurrency.fee_rate):
+            TradedCurrency.open_positions[i].long.stop_loss = TradedCurrency.open_positions[i].short.exit * (1+2*TradedCurrency.fee_rate)
+        elif price > TradedCurrency.open_positions[i].short.exit * (1+TradedCurrency.fee_rate):
+            TradedCurrency.open_positions[i].long.stop_loss = TradedCurrency.open_positions[i].short.exit * (1+TradedCurrency.fee_rate)
         else:
-            TradedCurrency.open_positions[i]['long']['stop loss'] = TradedCurrency.open_positions[i]['short']['exit']
+            TradedCurrency.open_positions[i].long.stop_loss = TradedCurrency.open_positions[i].short.exit
 
-        money_back = TradedCurrency.open_positions[i]['short']['qty'] * TradedCurrency.open_positions[i]['short']['entry'] / TradedCurrency.open_positions[i]['short']['leverage']
-        money_back += TradedCurrency.open_positions[i]['short']['qty'] * TradedCurrency.open_positions[i]['short']['entry'] * (TradedCurrency.open_positions[i]['short']['entry']/TradedCurrency.open_positions[i]['short']['exit'] - 1)
-        money_back -= TradedCurrency.open_positions[i]['short']['qty'] * TradedCurrency.open_positions[i]['short']['exit'] * TradedCurrency.fee_rate
+        money_back = TradedCurrency.open_positions[i].short.qty * TradedCurrency.open_positions[i].short.entry / TradedCurrency.open_positions[i].short.leverage
+        money_back += TradedCurrency.open_positions[i].short.qty * TradedCurrency.open_positions[i].short.entry * (TradedCurrency.open_positions[i].short.entry/TradedCurrency.open_positions[i].short.exit - 1)
+        money_back -= TradedCurrency.open_positions[i].short.qty * TradedCurrency.open_positions[i].short.exit * TradedCurrency.fee_rate
         TradedCurrency.capital += money_back
 
     TradedCurrency.update_capital()
     return TradedCurrency
 
 
+def record_account_balance(TradedCurrency):
+    """
+    Ask for a row of the account balance in the balance ledger.
+    However many positions are closed or opened during a tick, the balance is queried once, before the ledgers are flushed.
+    """
+    ledgers.buffer.balance_requested = True
+    return
+
+
+def add_account_balance(TradedCurrency):
+    """ Add the Binance Futures account balance to the balance ledger (the simulated capital in simulation mode), if it was asked for """
+    if not ledgers.buffer.balance_requested:
+        return
+    account_balance = streams.get_futures_account_balance()
+    if not TradedCurrency.real_mode:
+        account_balance['balance'] = TradedCurrency.capital
+    ledgers.balance_ledger.add([account_balance])
+    ledgers.buffer.balance_requested = False
+    return
+
+
+def save_tick(TradedCurrency):
+    """ End of a tick: write the ledger rows of the tick and the changes of the state (see state.write_tick) """
+    try:
+        add_account_balance(TradedCurrency)
+    except Exception as error:
+        print(f'Error: Cannot get the account balance\n{error}')
+    store = state.get_store()
+    content = state.to_state(TradedCurrency)
+    return state.write_tick(store, content if store.has_changed(content) else None)
+
+
 def long_stop_loss_closing(TradedCurrency, i):
     if TradedCurrency.real_mode:
-        stop_order_settings = {
-            'symbol': TradedCurrency.pair,
-            'side': 'SELL',
-            'positionSide': 'LONG',
-            'type': 'MARKET',
-            'quantity': str(TradedCurrency.contracts[i]['long']['order']['executedQty']),
-        }
-        filled_contract = TradedCurrency.place_single_order(stop_order_settings)
-        filled_contract = Binance_API.query_order(TradedCurrency.pair, filled_contract['orderId'])
-        TradedCurrency.contracts[i]['long']['stop loss'] = filled_contract
-        TradedCurrency.contracts[i]['long']['take profit'] = Binance_API.cancel_order(TradedCurrency.pair, TradedCurrency.contracts[i]['long']['take profit']['orderId'])
+        filled_contract, cancelled_take_profit = close_leg(TradedCurrency, i, 'long')
+        TradedCurrency.contracts[i].long.stop_loss = filled_contract
+        TradedCurrency.contracts[i].long.take_profit = cancelled_take_profit
         # Update open_positions
-        TradedCurrency.open_positions[i]['long']['exit time'] = round(tm.time(), 3)
-        TradedCurrency.open_positions[i]['long']['exit'] = np.float(filled_contract['avgPrice'])
-        TradedCurrency.open_positions[i]['long']['triggered on'] = 'STOP LOSS 2'
+        TradedCurrency.open_positions[i].long.exit_time = round(tm.time(), 3)
+        TradedCurrency.open_positions[i].long.exit = np.float(filled_contract['avgPrice'])
+        TradedCurrency.open_positions[i].long.triggered_on = 'STOP LOSS 2'
     else:
-        TradedCurrency.open_positions[i]['long']['exit'] = np.float(TradedCurrency.open_positions[i]['long']['stop loss'])
-        TradedCurrency.open_positions[i]['long']['exit time'] = round(tm.time(), 3)
-        TradedCurrency.open_positions[i]['long']['triggered on'] = 'STOP LOSS 2'
-        money_back = TradedCurrency.open_positions[i]['long']['qty'] * TradedCurrency.open_positions[i]['long']['entry'] / TradedCurrency.open_positions[i]['long']['leverage']
-        money_back += TradedCurrency.open_positions[i]['long']['qty'] * TradedCurrency.open_positions[i]['long']['entry'] * (TradedCurrency.open_positions[i]['long']['exit']/TradedCurrency.open_positions[i]['long']['entry'] - 1)
-        money_back -= TradedCurrency.open_positions[i]['long']['qty'] * TradedCurrency.open_positions[i]['long']['exit'] * TradedCurrency.fee_rate
+        TradedCurrency.open_positions[i].long.exit = np.float(TradedCurrency.open_positions[i].long.stop_loss)
+        TradedCurrency.open_positions[i].long.exit_time = round(tm.time(), 3)
+        TradedCurrency.open_positions[i].long.triggered_on = 'STOP LOSS 2'
+        money_back = TradedCurrency.open_positions[i].long.qty * TradedCurrency.open_positions[i].long.entry / TradedCurrency.open_positions[i].long.leverage
+        money_back += TradedCurrency.open_positions[i].long.qty * TradedCurrency.open_positions[i].long.entry * (TradedCurrency.open_positions[i].long.exit/TradedCurrency.open_positions[i].long.entry - 1)
+        money_back -= TradedCurrency.open_positions[i].long.qty * TradedCurrency.open_positions[i].long.exit * TradedCurrency.fee_rate
         TradedCurrency.capital += money_back
 
     # Store closed contracts and positions in order_ledger & trade_ledger
@@ -212,39 +348,26 @@ def long_stop_loss_closing(TradedCurrency, i):
     TradedCurrency.close_position(i)
 
     # Update portfolio content according to Binance Futures account balance
-    account_balance = Binance_API.get_futures_account_balance() 
-    if not TradedCurrency.real_mode:
-        account_balance['balance'] = TradedCurrency.capital
-    df_balance = utils.read_csv(config.balance_path)
-    df_balance = df_balance.append(account_balance, ignore_index=True)
-    utils.dump_as_csv(df_balance, config.balance_path)
+    record_account_balance(TradedCurrency)
     return TradedCurrency
 
 
 def short_stop_loss_closing(TradedCurrency, i):
     if TradedCurrency.real_mode:    
-        stop_order_settings = {
-            'symbol': TradedCurrency.pair,
-            'side': 'BUY',
-            'positionSide': 'SHORT',
-            'type': 'MARKET',
-            'quantity': str(TradedCurrency.contracts[i]['short']['order']['executedQty']),
-        }
-        filled_contract = TradedCurrency.place_single_order(stop_order_settings)
-        filled_contract = Binance_API.query_order(TradedCurrency.pair, filled_contract['orderId'])
-        TradedCurrency.contracts[i]['short']['stop loss'] = filled_contract
-        TradedCurrency.contracts[i]['short']['take profit'] = Binance_API.cancel_order(TradedCurrency.pair, TradedCurrency.contracts[i]['short']['take profit']['orderId'])
+        filled_contract, cancelled_take_profit = close_leg(TradedCurrency, i, 'short')
+        TradedCurrency.contracts[i].short.stop_loss = filled_contract
+        TradedCurrency.contracts[i].short.take_profit = cancelled_take_profit
         # Update open_positions
-        TradedCurrency.open_positions[i]['short']['exit time'] = round(tm.time(), 3)
-        TradedCurrency.open_positions[i]['short']['exit'] = np.float(filled_contract['avgPrice'])
-        TradedCurrency.open_positions[i]['short']['triggered on'] = 'STOP LOSS 2'
+        TradedCurrency.open_positions[i].short.exit_time = round(tm.time(), 3)
+        TradedCurrency.open_positions[i].short.exit = np.float(filled_contract['avgPrice'])
+        TradedCurrency.open_positions[i].short.triggered_on = 'STOP LOSS 2'
     else:
-        TradedCurrency.open_positions[i]['short']['exit'] =  np.float(TradedCurrency.open_positions[i]['short']['stop loss']) #close_price
-        TradedCurrency.open_positions[i]['short']['exit time'] = round(tm.time(), 3)
-        TradedCurrency.open_positions[i]['short']['triggered on'] = 'STOP LOSS 2'
-        money_back = TradedCurrency.open_positions[i]['short']['qty'] * TradedCurrency.open_positions[i]['short']['entry'] / TradedCurrency.open_positions[i]['short']['leverage']
-        money_back += TradedCurrency.open_positions[i]['short']['qty'] * TradedCurrency.open_positions[i]['short']['entry'] * (TradedCurrency.open_positions[i]['short']['entry']/TradedCurrency.open_positions[i]['short']['exit'] - 1)
-        money_back -= TradedCurrency.open_positions[i]['short']['qty'] * TradedCurrency.open_positions[i]['short']['exit'] * TradedCurrency.fee_rate
+        TradedCurrency.open_positions[i].short.exit =  np.float(TradedCurrency.open_positions[i].short.stop_loss) #close_price
+        TradedCurrency.open_positions[i].short.exit_time = round(tm.time(), 3)
+        TradedCurrency.open_positions[i].short.triggered_on = 'STOP LOSS 2'
+        money_back = TradedCurrency.open_positions[i].short.qty * TradedCurrency.open_positions[i].short.entry / TradedCurrency.open_positions[i].short.leverage
+        money_back += TradedCurrency.open_positions[i].short.qty * TradedCurrency.open_positions[i].short.entry * (TradedCurrency.open_positions[i].short.entry/TradedCurrency.open_positions[i].short.exit - 1)
+        money_back -= TradedCurrency.open_positions[i].short.qty * TradedCurrency.open_positions[i].short.exit * TradedCurrency.fee_rate
         TradedCurrency.capital += money_back
 
         # Store closed contracts and positions in order_ledger & trade_ledger
@@ -252,31 +375,26 @@ def short_stop_loss_closing(TradedCurrency, i):
     TradedCurrency.close_position(i)
 
     # Update portfolio content according to Binance Futures account balance
-    account_balance = Binance_API.get_futures_account_balance() 
-    if not TradedCurrency.real_mode:
-        account_balance['balance'] = TradedCurrency.capital
-    df_balance = utils.read_csv(config.balance_path)
-    df_balance = df_balance.append(account_balance, ignore_index=True)
-    utils.dump_as_csv(df_balance, config.balance_path)
+    record_account_balance(TradedCurrency)
     return TradedCurrency
 
 
 def long_take_profit_closing(TradedCurrency, i):
     if TradedCurrency.real_mode:
-        filled_contract = Binance_API.query_order(TradedCurrency.pair, TradedCurrency.contracts[i]['long']['take profit']['orderId'])
-        TradedCurrency.contracts[i]['long']['take profit'] = filled_contract
-        TradedCurrency.contracts[i]['long']['stop loss'] = 'CANCELLED'
+        filled_contract, cancelled_stop_loss = close_take_profit_leg(TradedCurrency, i, 'long')
+        TradedCurrency.contracts[i].long.take_profit = filled_contract
+        TradedCurrency.contracts[i].long.stop_loss = cancelled_stop_loss
         # Update open_positions
-        TradedCurrency.open_positions[i]['long']['exit time'] = round(tm.time(), 3)
-        TradedCurrency.open_positions[i]['long']['exit'] = np.float(filled_contract['avgPrice'])
-        TradedCurrency.open_positions[i]['long']['triggered on'] = 'TAKE PROFIT'
+        TradedCurrency.open_positions[i].long.exit_time = round(tm.time(), 3)
+        TradedCurrency.open_positions[i].long.exit = np.float(filled_contract['avgPrice'])
+        TradedCurrency.open_positions[i].long.triggered_on = 'TAKE PROFIT'
     else:
-        TradedCurrency.open_positions[i]['long']['exit'] = np.float(TradedCurrency.open_positions[i]['long']['take profit']) #close_price
-        TradedCurrency.open_positions[i]['long']['exit time'] = round(tm.time(), 3)
-        TradedCurrency.open_positions[i]['long']['triggered on'] = 'TAKE PROFIT'
-        money_back = TradedCurrency.open_positions[i]['long']['qty'] * TradedCurrency.open_positions[i]['long']['entry'] / TradedCurrency.open_positions[i]['long']['leverage']
-        money_back += TradedCurrency.open_positions[i]['long']['qty'] * TradedCurrency.open_positions[i]['long']['entry'] * (TradedCurrency.open_positions[i]['long']['exit']/TradedCurrency.open_positions[i]['long']['entry'] - 1)
-        money_back -= TradedCurrency.open_positions[i]['long']['qty'] * TradedCurrency.open_positions[i]['long']['exit'] * TradedCurrency.fee_rate
+        TradedCurrency.open_positions[i].long.exit = np.float(TradedCurrency.open_positions[i].long.take_profit) #close_price
+        TradedCurrency.open_positions[i].long.exit_time = round(tm.time(), 3)
+        TradedCurrency.open_positions[i].long.triggered_on = 'TAKE PROFIT'
+        money_back = TradedCurrency.open_positions[i].long.qty * TradedCurrency.open_positions[i].long.entry / TradedCurrency.open_positions[i].long.leverage
+        money_back += TradedCurrency.open_positions[i].long.qty * TradedCurrency.open_positions[i].long.entry * (TradedCurrency.open_positions[i].long.exit/TradedCurrency.open_positions[i].long.entry - 1)
+        money_back -= TradedCurrency.open_positions[i].long.qty * TradedCurrency.open_positions[i].long.exit * TradedCurrency.fee_rate
         TradedCurrency.capital += money_back
     
     # Store closed contracts and positions in order_ledger & trade_ledger
@@ -284,31 +402,26 @@ def long_take_profit_closing(TradedCurrency, i):
     TradedCurrency.close_position(i)
 
     # Update portfolio content according to Binance Futures account balance
-    account_balance = Binance_API.get_futures_account_balance() 
-    if not TradedCurrency.real_mode:
-        account_balance['balance'] = TradedCurrency.capital
-    df_balance = utils.read_csv(config.balance_path)
-    df_balance = df_balance.append(account_balance, ignore_index=True)
-    utils.dump_as_csv(df_balance, config.balance_path)
+    record_account_balance(TradedCurrency)
     return TradedCurrency
 
 
 def short_take_profit_closing(TradedCurrency, i):
     if TradedCurrency.real_mode:
-        filled_contract = Binance_API.query_order(TradedCurrency.pair, TradedCurrency.contracts[i]['short']['take profit']['orderId'])
-        TradedCurrency.contracts[i]['short']['take profit'] = filled_contract
-        TradedCurrency.contracts[i]['short']['stop loss'] = 'CANCELLED'
+        filled_contract, cancelled_stop_loss = close_take_profit_leg(TradedCurrency, i, 'short')
+        TradedCurrency.contracts[i].short.take_profit = filled_contract
+        TradedCurrency.contracts[i].short.stop_loss = cancelled_stop_loss
         # Update open_positions
-        TradedCurrency.open_positions[i]['short']['exit time'] = round(tm.time(), 3)
-        TradedCurrency.open_positions[i]['short']['exit'] = np.float(filled_contract['avgPrice'])
-        TradedCurrency.open_positions[i]['short']['triggered on'] = 'TAKE PROFIT'
+        TradedCurrency.open_positions[i].short.exit_time = round(tm.time(), 3)
+        TradedCurrency.open_positions[i].short.exit = np.float(filled_contract['avgPrice'])
+        TradedCurrency.open_positions[i].short.triggered_on = 'TAKE PROFIT'
     else:
-        TradedCurrency.open_positions[i]['short']['exit'] = np.float(TradedCurrency.open_positions[i]['short']['take profit']) #close_price
-        TradedCurrency.open_positions[i]['short']['exit time'] = round(tm.time(), 3)
-        TradedCurrency.open_positions[i]['short']['triggered on'] = 'TAKE PROFIT'
-        money_back = TradedCurrency.open_positions[i]['short']['qty'] * TradedCurrency.open_positions[i]['short']['entry'] / TradedCurrency.open_positions[i]['short']['leverage']
-        money_back += TradedCurrency.open_positions[i]['short']['qty'] * TradedCurrency.open_positions[i]['short']['entry'] * (TradedCurrency.open_positions[i]['short']['entry']/TradedCurrency.open_positions[i]['short']['exit'] - 1)
-        money_back -= TradedCurrency.open_positions[i]['short']['qty'] * TradedCurrency.open_positions[i]['short']['exit'] * TradedCurrency.fee_rate
+        TradedCurrency.open_positions[i].short.exit = np.float(TradedCurrency.open_positions[i].short.take_profit) #close_price
+        TradedCurrency.open_positions[i].short.exit_time = round(tm.time(), 3)
+        TradedCurrency.open_positions[i].short.triggered_on = 'TAKE PROFIT'
+        money_back = TradedCurrency.open_positions[i].short.qty * TradedCurrency.open_positions[i].short.entry / TradedCurrency.open_positions[i].short.leverage
+        money_back += TradedCurrency.open_positions[i].short.qty * TradedCurrency.open_positions[i].short.entry * (TradedCurrency.open_positions[i].short.entry/TradedCurrency.open_positions[i].short.exit - 1)
+        money_back -= TradedCurrency.open_positions[i].short.qty * TradedCurrency.open_positions[i].short.exit * TradedCurrency.fee_rate
         TradedCurrency.capital += money_back
 
     # Store closed contracts and positions in order_ledger & trade_ledger
@@ -316,12 +429,7 @@ def short_take_profit_closing(TradedCurrency, i):
     TradedCurrency.close_position(i)
 
     # Update portfolio content according to Binance Futures account balance
-    account_balance = Binance_API.get_futures_account_balance() 
-    if not TradedCurrency.real_mode:
-        account_balance['balance'] = TradedCurrency.capital
-    df_balance = utils.read_csv(config.balance_path)
-    df_balance = df_balance.append(account_balance, ignore_index=True)
-    utils.dump_as_csv(df_balance, config.balance_path)
+    record_account_balance(TradedCurrency)
     return TradedCurrency
 
 
@@ -341,7 +449,7 @@ def initiate_algorithm():
         trade_ledger.csv (empty)
         account_balance.csv (one line)
     
-    Dump currency.pickle
+    Save the state of the currency (see state.py)
     """
     logger.info('Initiating hedge mode algorithm')
 
@@ -365,20 +473,17 @@ def initiate_algorithm():
 
     # Write csv files
     try:
-        order_ledger = pd.DataFrame(columns=config.ORDER_LEDGER_COLUMNS)
-        trade_ledger = pd.DataFrame(columns=config.TRADE_LEDGER_COLUMNS)
-        balance = pd.DataFrame(columns=config.ACCOUNT_BALANCE_COLUMNS)
-        balance.append(account_balance, ignore_index=True)
         file = 'order_ledger'
-        utils.dump_as_csv(order_ledger, config.order_ledger_path)
+        ledgers.order_ledger.create()
         file = 'trade_ledger'
-        utils.dump_as_csv(trade_ledger, config.trade_ledger_path)
+        ledgers.trade_ledger.create()
         file = 'balance'
-        utils.dump_as_csv(balance, config.balance_path)
+        ledgers.balance_ledger.create()
+        ledgers.balance_ledger.append([account_balance])
 
-        # Dump TradedCurrency.pickle
-        file = 'TradedCurrency.pickle'
-        utils.dump_as_pickle(TradedCurrency, config.TradedCurrency_path)
+        # Save the state of TradedCurrency
+        file = 'TradedCurrency state'
+        state.dump_state(TradedCurrency)
     except:
         logger.error(f'Error: Wrong measurements path {file} {config.TradedCurrency_path}')
         return
@@ -387,147 +492,340 @@ def initiate_algorithm():
     return
 
 
-def continue_recurrent_algorithm():
-    logger.info('Continue applying hedge mode strategy')
-
-    TradedCurrency = utils.load_pickle(config.TradedCurrency_path)
+def check_account_settings(TradedCurrency):
     is_cross = check_api_keys_functional(TradedCurrency)
     check_margin_type(TradedCurrency, is_cross)    
     check_position_mode()
     if TradedCurrency.real_mode:
         Binance_API.change_initial_leverage(TradedCurrency.pair, TradedCurrency.leverage)
+    return
+
+
+def ratchet_stop_loss(TradedCurrency, i, position_side, price):
+    """
+    Move the stop loss of an actualised leg beyond the exit of the other leg, by one then two fee rates,
+    as the price goes past these levels.
+    """
+    other_side = 'short' if position_side == 'long' else 'long'
+    leg = TradedCurrency.open_positions[i][position_side]
+    if not leg.actualised or leg.exit != 0:
+        return
+    direction = 1 if position_side == 'long' else -1
+    reference_price = TradedCurrency.open_positions[i][other_side].exit
+    previous_stop_loss = leg.stop_loss
+    for covered_fees in [1, 2]:
+        level = reference_price * (1 + direction*covered_fees*TradedCurrency.fee_rate)
+        previous_level = reference_price * (1 + direction*(covered_fees-1)*TradedCurrency.fee_rate)
+        if leg.stop_loss == previous_level and direction*price > direction*level:
+            leg.stop_loss = level
+            leg.covered_fees = covered_fees
+
+    if leg.stop_loss != previous_stop_loss:
+        TradedCurrency.replace_stop_loss(i, position_side)
+    return
+
+
+def catch_up_open_positions(TradedCurrency, snapshot):
+    """
+    Replay the 1m candles closed since the last check against every stop loss, take profit and ratchet level
+    of the open legs, so that intra-minute touches and skipped invocations are accounted for.
+
+    Triggers are applied in time order (see triggers.find_triggers), on the close of the candle which reached them.
+    A transition moves the levels of the other leg: as the order of prices within a candle is unknown,
+    the new levels are evaluated from the next candle on.
+    """
+    history = candles.get_store(TradedCurrency.pair, '1m').load()
+    if len(history) == 0:
+        return TradedCurrency
+    # Prices of the tick (a live price in the daemon mode) are restored once the candles are replayed
+    price, close_price = snapshot.price, snapshot.close_price
+    last_checked_time = getattr(TradedCurrency, 'last_checked_time', None)
+    if last_checked_time is None:
+        path = history[-1:]
+    else:
+        path = history[np.searchsorted(history['close_time'], last_checked_time, side='right'):]
+
+    transitions = {
+        (triggers.STOP_LOSS, 'long', False): lambda i: first_long_stop_loss_activation(TradedCurrency, i, snapshot),
+        (triggers.STOP_LOSS, 'short', False): lambda i: first_short_stop_loss_activation(TradedCurrency, i, snapshot),
+        (triggers.STOP_LOSS, 'long', True): lambda i: long_stop_loss_closing(TradedCurrency, i),
+        (triggers.STOP_LOSS, 'short', True): lambda i: short_stop_loss_closing(TradedCurrency, i),
+        (triggers.TAKE_PROFIT, 'long', True): lambda i: long_take_profit_closing(TradedCurrency, i),
+        (triggers.TAKE_PROFIT, 'short', True): lambda i: short_take_profit_closing(TradedCurrency, i),
+    }
+    while len(path) > 0:
+        found = triggers.find_triggers(TradedCurrency, path)
+        if len(found) == 0:
+            break
+        k = found[0]['candle']
+        candle = path[k]
+        snapshot.set_price(float(candle['close_price']))
+        for trigger in found:
+            if trigger['candle'] != k:
+                break
+            # A previous trigger of the candle may have closed the position or moved this level
+            if not triggers.is_pending(TradedCurrency, trigger):
+                continue
+            i, side = trigger['slot'], trigger['side']
+            if trigger['kind'] == triggers.RATCHET:
+                ratchet_stop_loss(TradedCurrency, i, side, float(candle['high_price'] if side == 'long' else candle['low_price']))
+            else:
+                actualised = TradedCurrency.open_positions[i][side].actualised
+                transitions[(trigger['kind'], side, actualised)](i)
+            TradedCurrency.update_triggers(i)
+        path = path[k+1:]
+
+    TradedCurrency.last_checked_time = int(history['close_time'][-1])
+    snapshot.price, snapshot.close_price = price, close_price
+    return TradedCurrency
+
+
+def manage_open_position(TradedCurrency, i, snapshot):
+    """ Update the stop loss levels of the position in slot i and close its legs whose stop loss or take profit was reached """
+    # First: update stop loss levels if possible (level 1 & 2)
+    if TradedCurrency.open_positions[i] != None:
+        ratchet_stop_loss(TradedCurrency, i, 'long', snapshot.close_price)
+        ratchet_stop_loss(TradedCurrency, i, 'short', snapshot.close_price)
+
+    # Second: update positions according to stop loss and take profit
+    # Case: long stop loss activated
+    if TradedCurrency.open_positions[i] != None:
+        if TradedCurrency.open_positions[i].long.actualised == False:
+            if TradedCurrency.is_stop_loss_activated(i, 'long', snapshot):
+                TradedCurrency = first_long_stop_loss_activation(TradedCurrency, i, snapshot)
     
-    # TradedCurrency.update_contracts()
-    TradedCurrency.update_capital()
-    ohlc = TradedCurrency.load_latest_ohlc()
+    # Case: short stop loss activated
+    if TradedCurrency.open_positions[i] != None:
+        if TradedCurrency.open_positions[i].short.actualised == False:
+            if TradedCurrency.is_stop_loss_activated(i, 'short', snapshot):
+                TradedCurrency = first_short_stop_loss_activation(TradedCurrency, i, snapshot)
+    
+    # Case: closing actualised positions on long stop loss activation
+    if TradedCurrency.open_positions[i] != None:
+        if TradedCurrency.open_positions[i].long.actualised == True:
+            if TradedCurrency.is_stop_loss_activated(i, 'long', snapshot):
+                TradedCurrency = long_stop_loss_closing(TradedCurrency, i)
+                
+    # Case: closing actualised positions on short stop loss activation
+    if TradedCurrency.open_positions[i] != None:
+        if TradedCurrency.open_positions[i].short.actualised == True:
+            if TradedCurrency.is_stop_loss_activated(i, 'short', snapshot):
+                TradedCurrency = short_stop_loss_closing(TradedCurrency, i)
+
+    # Case: closing actualised positions on long take profit activation
+    if TradedCurrency.open_positions[i] != None:
+        if TradedCurrency.open_positions[i].long.actualised == True:
+            if TradedCurrency.is_take_profit_activated(i, 'long', snapshot):
+                TradedCurrency = long_take_profit_closing(TradedCurrency, i)
+
+    # Case: closing actualised positions on short take profit activation
+    if TradedCurrency.open_positions[i] != None:
+        if TradedCurrency.open_positions[i].short.actualised == True:
+            if TradedCurrency.is_take_profit_activated(i, 'short', snapshot):
+                TradedCurrency = short_take_profit_closing(TradedCurrency, i)
+    return TradedCurrency
+
 
+def manage_open_positions(TradedCurrency, snapshot):
+    """
+    Update stop loss levels and close the legs whose stop loss or take profit was reached.
+
+    Arguments:
+        TradedCurrency (models.Currency): traded currency
+        snapshot (market.MarketSnapshot): market data every check of the tick is taken on
+    """
     # Every minute or so, we need to look if a conditional contract has been activated
     # Therefore, we will be able to update stop loss and take profit levels more accurately
 
-    # First: update stop loss levels if possible (level 1 & 2)
-    for i in range(0, TradedCurrency.max_open_positions):
-        if TradedCurrency.open_positions[i] != None:
-            # Case: long update
-            if TradedCurrency.open_positions[i]['long']['actualised'] and TradedCurrency.open_positions[i]['long']['exit'] == 0:
-
-                reference_price = TradedCurrency.open_positions[i]['short']['exit']
-                stop_loss = TradedCurrency.open_positions[i]['long']['stop loss']
-                if stop_loss/reference_price == 1 and TradedCurrency.get_latest_close_price() > reference_price * (1 + TradedCurrency.fee_rate):
-                    TradedCurrency.open_positions[i]['long']['stop loss'] = reference_price * (1 + TradedCurrency.fee_rate)
-                    TradedCurrency.open_positions[i]['long']['covered fees'] = 1
-
-                stop_loss = TradedCurrency.open_positions[i]['long']['stop loss']
-                if stop_loss/reference_price == (1+TradedCurrency.fee_rate) and TradedCurrency.get_latest_close_price() > reference_price * (1 + 2*TradedCurrency.fee_rate):
-                    TradedCurrency.open_positions[i]['long']['stop loss'] = reference_price * (1 + 2*TradedCurrency.fee_rate)
-                    TradedCurrency.open_positions[i]['long']['covered fees'] = 2
-
-            # Case: short update
-            if TradedCurrency.open_positions[i]['short']['actualised'] and TradedCurrency.open_positions[i]['short']['exit'] == 0:
-
-                reference_price = TradedCurrency.open_positions[i]['long']['exit']
-                stop_loss = TradedCurrency.open_positions[i]['short']['stop loss']
-                if stop_loss/reference_price == 1 and TradedCurrency.get_latest_close_price() < reference_price * (1 - TradedCurrency.fee_rate):
-                    TradedCurrency.open_positions[i]['short']['stop loss'] = reference_price * (1 - TradedCurrency.fee_rate)
-                    TradedCurrency.open_positions[i]['short']['covered fees'] = 1
-
-                stop_loss = TradedCurrency.open_positions[i]['short']['stop loss']
-                if stop_loss/reference_price == (1-TradedCurrency.fee_rate) and TradedCurrency.get_latest_close_price() < reference_price * (1 - 2*TradedCurrency.fee_rate):
-                    TradedCurrency.open_positions[i]['short']['stop loss'] = reference_price * (1 - 2*TradedCurrency.fee_rate)
-                    TradedCurrency.open_positions[i]['short']['covered fees'] = 2
-
-
-        # Second: update positions according to stop loss and take profit
-        # Case: long stop loss activated
-        if TradedCurrency.open_positions[i] != None:
-            if TradedCurrency.open_positions[i]['long']['actualised'] == False:
-                if TradedCurrency.is_stop_loss_activated(i, 'long'):
-                    TradedCurrency = first_long_stop_loss_activation(TradedCurrency, i)
-        
-        # Case: short stop loss activated
-        if TradedCurrency.open_positions[i] != None:
-            if TradedCurrency.open_positions[i]['short']['actualised'] == False:
-                if TradedCurrency.is_stop_loss_activated(i, 'short'):
-                    TradedCurrency = first_short_stop_loss_activation(TradedCurrency, i)
-        
-        # Case: closing actualised positions on long stop loss activation
-        if TradedCurrency.open_positions[i] != None:
-            if TradedCurrency.open_positions[i]['long']['actualised'] == True:
-                if TradedCurrency.is_stop_loss_activated(i, 'long'):
-                    TradedCurrency = long_stop_loss_closing(TradedCurrency, i)
-                    
-        # Case: closing actualised positions on short stop loss activation
-        if TradedCurrency.open_positions[i] != None:
-            if TradedCurrency.open_positions[i]['short']['actualised'] == True:
-                if TradedCurrency.is_stop_loss_activated(i, 'short'):
-                    TradedCurrency = short_stop_loss_closing(TradedCurrency, i)
-
-        # Case: closing actualised positions on long take profit activation
-        if TradedCurrency.open_positions[i] != None:
-            if TradedCurrency.open_positions[i]['long']['actualised'] == True:
-                if TradedCurrency.is_take_profit_activated(i, 'long'):
-                    TradedCurrency = long_take_profit_closing(TradedCurrency, i)
-
-        # Case: closing actualised positions on short take profit activation
-        if TradedCurrency.open_positions[i] != None:
-            if TradedCurrency.open_positions[i]['short']['actualised'] == True:
-                if TradedCurrency.is_take_profit_activated(i, 'short'):
-                    TradedCurrency = short_take_profit_closing(TradedCurrency, i)
+    # In simulation mode, every 1m candle closed since the last check is replayed first
+    if not TradedCurrency.real_mode:
+        catch_up_open_positions(TradedCurrency, snapshot)
+
+    # Exchange-side orders fill on the mark price: in real mode every open slot is checked.
+    # In simulation mode, only the slots with a level crossed by the price are visited.
+    if TradedCurrency.real_mode:
+        slots = [i for i in range(0, TradedCurrency.max_open_positions) if TradedCurrency.open_positions[i] != None]
+    else:
+        slots = TradedCurrency.trigger_index.get_crossed_slots(snapshot.close_price)
+
+    for i in slots:
+        try:
+            TradedCurrency = manage_open_position(TradedCurrency, i, snapshot)
+        except retries.RetryError as error:
+            # The slot is checked again on the next tick: the other slots and the state of this tick are still saved
+            logger.error(f'Error: position {i} cannot be updated\n{error}')
+        TradedCurrency.update_triggers(i)
 
     print('Minutely process executed')
+    return TradedCurrency
+
+
+def get_entry_signal(TradedCurrency, snapshot):
+    """
+    Returns 'crossover' or 'crossunder' if the candle ending at next_timestamp crossed the EMAs, else None.
+
+    The timeframe candle and the last 1m candle close together: when the snapshot holds the 1m candle ending at
+    next_timestamp, its close is compared to the trigger price published before the boundary.
+    Otherwise the EMAs are updated with the timeframe candle first.
+    The EMAs are brought up to next_timestamp in both cases.
+    """
+    trigger = getattr(TradedCurrency, 'ema_trigger', None)
+    close_time = int(1000 * TradedCurrency.next_timestamp.timestamp()) - 1
+    if trigger is not None and trigger.close_time == close_time and int(snapshot.candle['close_time']) == close_time:
+        signal = trigger.check(snapshot.close_price)
+        TradedCurrency.update_ema(snapshot.ohlc)
+        return signal
+    ema = TradedCurrency.update_ema(snapshot.ohlc)
+    if ema.is_crossover():
+        return 'crossover'
+    if ema.is_crossunder():
+        return 'crossunder'
+    return None
+
+
+def open_new_positions(TradedCurrency, snapshot, armed=None):
+    """
+    Open a long and a short position on an EMA crossover, once next_timestamp is reached.
+    Then record the account balance and move next_timestamp to the following candle.
+
+    Arguments:
+        TradedCurrency (models.Currency): traded currency
+        snapshot (market.MarketSnapshot): market data loaded after next_timestamp
+        armed (entry.ArmedEntry): entry orders prepared before next_timestamp (prepared here if None or outdated)
+    """
+    # Define opening trades criteria
+    signal = get_entry_signal(TradedCurrency, snapshot)
+    crossover = signal == 'crossover'
+    crossunder = signal == 'crossunder'
+
+    if (crossover or crossunder) and TradedCurrency.n_open_positions < TradedCurrency.max_open_positions:
+        available_position = TradedCurrency.find_available_position()
+        if available_position == None:
+            logger.error('Error: Currency.find_available_position() returned None.')
+            return
+        # Caclulate amount for the new trade
+        amount = np.floor(TradedCurrency.capital / (TradedCurrency.max_open_positions - TradedCurrency.n_open_positions) * 10**(config.BASE_AMOUNT_PRECISION))
+        amount /= 10**(config.BASE_AMOUNT_PRECISION)
+        # Place contracts and open positions
+        if TradedCurrency.real_mode:
+            templates = None
+            try:
+                if armed is not None and armed.is_valid(TradedCurrency):
+                    initial_contracts = armed.fire()
+                    templates = armed.templates
+                else:
+                    initial_orders = TradedCurrency.prepare_initial_orders(snapshot)
+                    initial_contracts = TradedCurrency.place_orders_simultaneously(initial_orders)
+            except retries.RetryError as error:
+                logger.error(f'Error: entry orders cannot be placed, no position is opened (check the account for fills)\n{error}')
+                return finish_opening(TradedCurrency)
+            # From here the entry orders may be filled: the position is recorded whatever fails next
+            try:
+                # MARKET orders are usually acknowledged filled: they are only queried otherwise
+                if not all(contract['status'] == 'FILLED' for contract in initial_contracts):
+                    initial_contracts = Binance_API_async.run(Binance_API_async.query_orders(
+                        TradedCurrency.pair, [initial_contracts[0]['orderId'], initial_contracts[1]['orderId']]
+                    ))
+            except retries.RetryError as error:
+                logger.error(f'Error: fills of the entry orders cannot be queried, position {available_position} is recorded at the close price\n{error}')
+                initial_contracts = [get_assumed_fill(contract, snapshot.close_price) for contract in initial_contracts]
+            TradedCurrency.contracts[available_position].long.order = initial_contracts[0] if initial_contracts[0]['positionSide'] == 'LONG' else initial_contracts[1]
+            TradedCurrency.contracts[available_position].short.order = initial_contracts[0] if initial_contracts[0]['positionSide'] == 'SHORT' else initial_contracts[1]
+            try:
+                initial_activation_orders = TradedCurrency.prepare_initial_activation_orders(available_position, templates)
+                initial_activation_contracts = TradedCurrency.place_orders_simultaneously(initial_activation_orders)
+            except retries.RetryError as error:
+                # The stop losses and take profits of the position are watched locally, as in simulation mode
+                logger.error(f'Error: take profit and stop loss orders of position {available_position} cannot be placed, its levels are watched locally\n{error}')
+                initial_activation_contracts = []
+                cancel_untracked_orders(TradedCurrency)
+
+            for contract in initial_activation_contracts:
+                if contract['positionSide'] == 'LONG' and contract['type'] == 'TAKE_PROFIT_MARKET':
+                    TradedCurrency.contracts[available_position].long.take_profit = contract
+                if contract['positionSide'] == 'SHORT' and contract['type'] == 'TAKE_PROFIT_MARKET':
+                    TradedCurrency.contracts[available_position].short.take_profit = contract
+                if contract['positionSide'] == 'LONG' and contract['type'] == 'STOP_MARKET':
+                    TradedCurrency.contracts[available_position].long.stop_loss = contract
+                if contract['positionSide'] == 'SHORT' and contract['type'] == 'STOP_MARKET':
+                    TradedCurrency.contracts[available_position].short.stop_loss = contract
+
+        TradedCurrency.set_positions(available_position, snapshot)
+
+    return finish_opening(TradedCurrency)
+
+
+def finish_opening(TradedCurrency):
+    """ End of open_new_positions: record the account balance and move next_timestamp to the following candle """
+    # Update portfolio content according to Binance Futures account balance
+    record_account_balance(TradedCurrency)
+
+    # Update next_timestamp
+    TradedCurrency.next_timestamp += TradedCurrency.timedelta
+    print('Quarterly process executed')
+    return TradedCurrency
+
+
+def cancel_untracked_orders(TradedCurrency):
+    """
+    Cancel the open orders of the pair which no slot refers to, eg. orders of a batch whose response was lost:
+    sized to a leg, they would close the quantity of that leg on the position side shared with the other slots.
+    """
+    tracked = set()
+    for contracts in TradedCurrency.contracts:
+        for side in ['long', 'short']:
+            for contract in [contracts[side].order, contracts[side].stop_loss, contracts[side].take_profit]:
+                if isinstance(contract, dict):
+                    tracked.add(contract['orderId'])
+    try:
+        open_orders = Binance_API_async.run(Binance_API_async.query_current_all_open_orders(TradedCurrency.pair))
+        orderIds = [order['orderId'] for order in open_orders if not order['orderId'] in tracked]
+        # Batches of 10 orders at most
+        for k in range(0, len(orderIds), 10):
+            Binance_API_async.run(Binance_API_async.cancel_multiple_orders(TradedCurrency.pair, orderIds[k:k+10]))
+    except Exception as error:
+        logger.error(f'Error: untracked orders of {TradedCurrency.pair} cannot be cancelled, check the open orders on the exchange\n{error}')
+    return
+
+
+def get_assumed_fill(contract, price):
+    """ Acknowledged MARKET order whose fill cannot be queried: assumed filled for its whole quantity at price """
+    if contract['status'] == 'FILLED':
+        return contract
+    return dict(contract, status='FILLED', avgPrice=str(price), executedQty=str(contract['origQty']))
+
+
+def continue_recurrent_algorithm():
+    logger.info('Continue applying hedge mode strategy')
+
+    TradedCurrency = state.load_state()
+    check_account_settings(TradedCurrency)
+
+    TradedCurrency.update_capital()
+    # Every decision of this run is taken on the same market data
+    snapshot = market.load_snapshot(TradedCurrency.pair, TradedCurrency.timeframe)
+    TradedCurrency.update_ema(snapshot.ohlc)
+
+    TradedCurrency = manage_open_positions(TradedCurrency, snapshot)
 
     # Then we look if a position can be opened every time the server time reaches next_timestamp
-    server_time = Binance_API.get_server_time() / 1000
+    server_time = Binance_API.get_synced_server_time() / 1000
     if server_time >= TradedCurrency.next_timestamp.timestamp() - 30:
+        # Entry orders are prepared in the last seconds before the boundary
+        armed = None
+        if TradedCurrency.n_open_positions < TradedCurrency.max_open_positions:
+            wait_for_next_timestamp(TradedCurrency, lead=config.ENTRY_ARM_LEAD)
+            armed = entry.arm(TradedCurrency, snapshot)
         wait_for_next_timestamp(TradedCurrency)
 
-        # Define opening trades criteria
-        ohlc = TradedCurrency.load_latest_ohlc()
-        slow_2, fast_2 = ohlc['ema_slow'].iloc[len(ohlc)-2], ohlc['ema_fast'].iloc[len(ohlc)-2]
-        slow_1, fast_1 = ohlc['ema_slow'].iloc[len(ohlc)-1], ohlc['ema_fast'].iloc[len(ohlc)-1]
-
-        crossover = fast_2 < slow_2 and fast_1 >= slow_1
-        crossunder = fast_2 > slow_2 and fast_1 <= slow_1
-
-        if (crossover or crossunder) and TradedCurrency.n_open_positions < TradedCurrency.max_open_positions:
-            available_position = TradedCurrency.find_available_position()
-            if available_position == None:
-                logger.error('Error: Currency.find_available_position() returned None.')
-                return
-            # Caclulate amount for the new trade
-            amount = np.floor(TradedCurrency.capital / (TradedCurrency.max_open_positions - TradedCurrency.n_open_positions) * 10**(config.BASE_AMOUNT_PRECISION))
-            amount /= 10**(config.BASE_AMOUNT_PRECISION)
-            # Place contracts and open positions
-            if TradedCurrency.real_mode:
-                initial_orders = TradedCurrency.prepare_initial_orders()
-                initial_contracts = TradedCurrency.place_orders_simultaneously(initial_orders)
-                initial_contracts[0] = Binance_API.query_order(TradedCurrency.pair, initial_contracts[0]['orderId'])
-                initial_contracts[1] = Binance_API.query_order(TradedCurrency.pair, initial_contracts[1]['orderId'])
-                TradedCurrency.contracts[available_position]['long']['order'] = initial_contracts[0] if initial_contracts[0]['positionSide'] == 'LONG' else initial_contracts[1]
-                TradedCurrency.contracts[available_position]['short']['order'] = initial_contracts[0] if initial_contracts[0]['positionSide'] == 'SHORT' else initial_contracts[1]
-                initial_activation_orders = TradedCurrency.prepare_initial_activation_orders(available_position)
-                initial_activation_contracts = TradedCurrency.place_orders_simultaneously(initial_activation_orders)
-                
-                for contract in initial_activation_contracts:
-                    if contract['positionSide'] == 'LONG' and contract['type'] == 'TAKE_PROFIT_MARKET':
-                        TradedCurrency.contracts[available_position]['long']['take profit'] = contract
-                    if contract['positionSide'] == 'SHORT' and contract['type'] == 'TAKE_PROFIT_MARKET':
-                        TradedCurrency.contracts[available_position]['short']['take profit'] = contract
-
-            TradedCurrency.set_positions(available_position)
-
-        # Update portfolio content according to Binance Futures account balance
-        account_balance = Binance_API.get_futures_account_balance() 
-        if not TradedCurrency.real_mode:
-            account_balance['balance'] = TradedCurrency.capital
-        df_balance = utils.read_csv(config.balance_path)
-        df_balance = df_balance.append(account_balance, ignore_index=True)
-        utils.dump_as_csv(df_balance, config.balance_path)
-
-        # Update next_timestamp
-        TradedCurrency.next_timestamp += TradedCurrency.timedelta
-        print('Quarterly process executed')
-    
+        # The candle which just closed is needed: market data is fetched again
+        load_boundary_snapshot(TradedCurrency, snapshot)
+        TradedCurrency = open_new_positions(TradedCurrency, snapshot, armed)
+        if TradedCurrency is None:
+            return
+
     TradedCurrency.update_capital()
-    utils.dump_as_pickle(TradedCurrency, config.TradedCurrency_path)
+    # Nothing is uploaded if the state did not change during the tick
+    save_tick(TradedCurrency)
 
     return
\ No newline at end of file
@@ -0,0 +1,193 @@
+# SSX999 Project Hedge
+
+# Augustin BRISSART
+# GitHub: @augustin999
+
+# June 2021
+
+
+import json
+import asyncio
+import threading
+import time as tm
+import numpy as np
+from aiohttp import web
+
+try:
+    from trader import candles
+    from trader import streams
+except:
+    import candles
+    import streams
+
+
+# Local stand-in for the Binance futures market streams.
+# It plays back recorded (streams.MarketStream record_path) or synthetic messages,
+# so the stream client and the daemon can be tested and benchmarked offline:
+#     server = replay.ReplayServer(replay.generate_messages('BTCUSDT', ['1m', '15m'])).start()
+#     stream = streams.MarketStream('BTCUSDT', ['1m', '15m'], url=server.url).start()
+
+
+# MESSAGES
+# --------
+
+def generate_messages(pair: str, intervals=('1m',), start_time=None, n_seconds=3600, price=35000., volatility=2e-4,
+                      ticks_per_second=4, contractType='PERPETUAL', seed=None):
+    """
+    Synthetic combined stream messages following a random walk of the price.
+
+    Arguments:
+        pair (str): traded pair
+        intervals (list): kline intervals
+        start_time (int): event time of the first message in ms, rounded down to the minute (now if None)
+        n_seconds (int): played back duration
+        price (float): initial price
+        volatility (float): standard deviation of the relative price change between two book ticker updates
+        ticks_per_second (int): book ticker updates per second (klines and mark price are updated every second)
+
+    Response:
+        list of [event time in ms, stream message]
+    """
+    rng = np.random.default_rng(seed)
+    start_time = int(tm.time()*1000) if start_time is None else start_time
+    start_time -= start_time % candles.INTERVAL_MS['1m']
+    kline_names = dict(zip(intervals, streams.get_stream_names(pair, intervals, contractType)))
+    mark_name, ticker_name = streams.get_stream_names(pair, [], contractType)
+    prices = price * np.cumprod(1 + volatility * rng.standard_normal(n_seconds * ticks_per_second))
+    messages = []
+    klines = dict()
+    for second in range(n_seconds):
+        event_time = start_time + 1000 * second
+        for tick in range(ticks_per_second):
+            p = prices[second * ticks_per_second + tick]
+            data = {'e': 'bookTicker', 'E': event_time, 's': pair, 'b': f'{p*(1-1e-5):.2f}', 'B': '1', 'a': f'{p*(1+1e-5):.2f}', 'A': '1'}
+            messages.append([event_time + tick * 1000 // ticks_per_second, {'stream': ticker_name, 'data': data}])
+        p = prices[(second + 1) * ticks_per_second - 1]
+        event_time += 999
+        messages.append([event_time, {'stream': mark_name, 'data': {'e': 'markPriceUpdate', 'E': event_time, 's': pair, 'p': f'{p:.2f}'}}])
+        for interval in intervals:
+            interval_ms = candles.INTERVAL_MS[interval]
+            open_time = event_time - event_time % interval_ms
+            kline = klines.get(interval)
+            if kline is None or kline['t'] != open_time:
+                kline = {'t': open_time, 'T': open_time + interval_ms - 1, 'i': interval, 'o': p, 'h': p, 'l': p, 'n': 0}
+                klines[interval] = kline
+            kline['h'], kline['l'], kline['c'] = max(kline['h'], p), min(kline['l'], p), p
+            kline['n'] += ticks_per_second
+            k = {
+                't': kline['t'], 'T': kline['T'], 'i': interval, 'o': f"{kline['o']:.2f}", 'c': f"{p:.2f}",
+                'h': f"{kline['h']:.2f}", 'l': f"{kline['l']:.2f}", 'v': '1', 'n': kline['n'], 'x': event_time == kline['T'],
+                'q': f'{p:.2f}', 'V': '0.5', 'Q': f'{p/2:.2f}', 'B': '0'
+            }
+            data = {'e': 'continuous_kline', 'E': event_time, 'ps': pair, 'ct': contractType, 'k': k}
+            messages.append([event_time, {'stream': kline_names[interval], 'data': data}])
+    return messages
+
+
+def load_recording(path):
+    """ Messages recorded by a MarketStream, as [reception time in ms, stream message] """
+    with open(path, 'r') as _file:
+        lines = [json.loads(line) for line in _file if line.strip()]
+    return [[line['time'], json.loads(line['message'])] for line in lines]
+
+
+# SERVER
+# ------
+
+class ReplayServer(object):
+    """
+    Serve messages on a combined stream endpoint (/stream?streams=...).
+    Each connection receives the messages of the streams it subscribed to, spaced by their
+    time differences divided by `speed` (as fast as possible if speed is None).
+    """
+
+    def __init__(self, messages: list, speed=1., host='127.0.0.1', port=0):
+        self.messages = messages
+        self.speed = speed
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.runner = None
+        self.sent = 0
+        self.done = threading.Event()
+        return
+
+    @property
+    def url(self):
+        return f'ws://{self.host}:{self.port}'
+
+    async def handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        names = set(request.query.get('streams', '').split('/'))
+        previous_time = None
+        for event_time, message in self.messages:
+            if self.speed is not None and previous_time is not None and event_time > previous_time:
+                await asyncio.sleep((event_time - previous_time) / 1000 / self.speed)
+            previous_time = event_time
+            if ws.closed:
+                return ws
+            if message['stream'] in names:
+                try:
+                    await ws.send_str(json.dumps(message))
+                except ConnectionError:
+                    # Client disconnected during the playback
+                    return ws
+                self.sent += 1
+        self.done.set()
+        await ws.close()
+        return ws
+
+    async def serve(self):
+        app = web.Application()
+        app.router.add_get('/stream', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return
+
+    def start(self):
+        """ Serve from a background thread and return once the server listens """
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name='replay-server', daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.serve(), self.loop).result()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        return
+
+
+def benchmark(messages=None, pair='BTCUSDT', intervals=('1m', '15m'), timeout=60):
+    """
+    Play back messages as fast as possible to a MarketStream (candles are not stored).
+
+    Response:
+        {'messages', 'closed candles', 'seconds', 'messages per second'}
+    """
+    messages = generate_messages(pair, intervals, n_seconds=3600) if messages is None else messages
+    server = ReplayServer(messages, speed=None).start()
+    stream = streams.MarketStream(pair, intervals, url=server.url, store_candles=False)
+    closed = []
+    stream.on_candle(lambda interval, candle: closed.append(interval))
+    start = tm.perf_counter()
+    stream.start()
+    server.done.wait(timeout)
+    while stream.stats['messages'] < server.sent and tm.perf_counter() - start < timeout:
+        tm.sleep(0.01)
+    seconds = tm.perf_counter() - start
+    stream.stop()
+    server.stop()
+    return {
+        'messages': stream.stats['messages'],
+        'closed candles': len(closed),
+        'seconds': round(seconds, 3),
+        'messages per second': round(stream.stats['messages'] / seconds),
+    }
+
+
+if __name__ == '__main__':
+    print(benchmark())
@@ -0,0 +1,228 @@
+# SSX999 Project Hedge
+
+# Augustin BRISSART
+# GitHub: @augustin999
+
+# June 2021
+
+
+import time as tm
+import random
+import asyncio
+import threading
+import aiohttp
+import requests
+
+try:
+    from trader import config
+except:
+    import config
+
+
+# CLASSIFYING ERRORS
+# ------------------
+# Binance reports errors as {'code': <negative int>, 'msg': <str>}.
+# - RETRYABLE: the request was not executed, sending it again is safe.
+# - AMBIGUOUS: the request may have been executed (timeout, disconnection, unknown server error).
+#   Idempotent requests are simply retried. Requests which create orders must first check
+#   whether the previous attempt went through.
+# - FATAL: sending the same request again will fail the same way.
+
+RETRYABLE = 'retryable'
+AMBIGUOUS = 'ambiguous'
+FATAL = 'fatal'
+
+RETRYABLE_CODES = [
+    -1003, # TOO_MANY_REQUESTS
+    -1008, # SERVER_BUSY
+    -1015, # TOO_MANY_ORDERS
+    -1021, # INVALID_TIMESTAMP
+]
+AMBIGUOUS_CODES = [
+    -1000, # UNKNOWN
+    -1001, # DISCONNECTED
+    -1006, # UNEXPECTED_RESP
+    -1007, # TIMEOUT
+]
+
+NETWORK_EXCEPTIONS = (
+    requests.exceptions.RequestException,
+    aiohttp.ClientError,
+    asyncio.TimeoutError,
+    ValueError, # Response body is not JSON (eg. gateway error page)
+)
+
+
+def classify_error(response):
+    """
+    Returns RETRYABLE, AMBIGUOUS or FATAL for an unsuccessful response or a raised network exception.
+    Batch responses are classified on their worst item.
+    """
+    if isinstance(response, Exception):
+        return AMBIGUOUS
+    if isinstance(response, list):
+        kinds = [classify_error(item) for item in response if isinstance(item, dict) and 'code' in item.keys()]
+        for kind in [FATAL, AMBIGUOUS, RETRYABLE]:
+            if kind in kinds:
+                return kind
+        return RETRYABLE
+    if not isinstance(response, dict) or not 'code' in response.keys():
+        return RETRYABLE
+    if response['code'] in RETRYABLE_CODES:
+        return RETRYABLE
+    if response['code'] in AMBIGUOUS_CODES:
+        return AMBIGUOUS
+    return FATAL
+
+
+class RetryError(Exception):
+    """ Raised when a request failed with a fatal error, ran out of attempts or out of invocation time """
+
+    def __init__(self, endpoint: str, response, attempts: int):
+        self.endpoint = endpoint
+        self.response = response
+        self.attempts = attempts
+        super().__init__(f'{endpoint} failed after {attempts} attempt(s): {response}')
+
+
+# RETRY POLICY
+# ------------
+
+class RetryPolicy(object):
+    """
+    Jittered exponential backoff bounded by a number of attempts and by the invocation deadline.
+    The deadline keeps retries from running past the Cloud Function timeout.
+    """
+
+    def __init__(self, max_attempts=config.RETRY_MAX_ATTEMPTS, base_delay=config.RETRY_BASE_DELAY,
+                 max_delay=config.RETRY_MAX_DELAY, budget=config.INVOCATION_BUDGET):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.deadline = None
+        self.lock = threading.Lock()
+        self.stats = dict()
+        self.start_invocation()
+        return
+
+    def start_invocation(self, budget=None):
+        """ Reset the deadline at the beginning of an invocation """
+        budget = self.budget if budget is None else budget
+        self.deadline = tm.monotonic() + budget
+        return
+
+    def remaining_time(self):
+        return self.deadline - tm.monotonic()
+
+    def next_delay(self, attempt: int):
+        """
+        Returns the time to wait before the next attempt ('full jitter' backoff),
+        or None if no attempt is left before max_attempts or the deadline.
+        """
+        if attempt + 1 >= self.max_attempts:
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if delay >= self.remaining_time():
+            return None
+        return delay
+
+    def record(self, endpoint: str, attempt: int, failed=False):
+        with self.lock:
+            if not endpoint in self.stats.keys():
+                self.stats[endpoint] = {'calls': 0, 'retries': 0, 'failures': 0}
+            self.stats[endpoint]['calls'] += 1
+            self.stats[endpoint]['retries'] += attempt
+            self.stats[endpoint]['failures'] += int(failed)
+        return
+
+
+POLICY = RetryPolicy()
+
+
+def start_invocation(budget=None):
+    POLICY.start_invocation(budget)
+    return
+
+
+def get_retry_stats():
+    """
+    Returns {endpoint: {'calls', 'retries', 'failures'}} since the process started.
+    """
+    with POLICY.lock:
+        return {endpoint: dict(stats) for endpoint, stats in POLICY.stats.items()}
+
+
+# RUNNING REQUESTS
+# ----------------
+
+def call_with_retry(endpoint: str, send, is_success, recover=None):
+    """
+    Send a request until it succeeds, following the retry policy.
+
+    Arguments:
+        endpoint (str): label used in retry statistics
+        send (callable): sends the request and returns the decoded response
+        is_success (callable): returns True if the response is the expected one
+        recover (callable): for requests which are not idempotent, checks whether an ambiguous attempt
+            was executed anyway. Returns the executed result, or None.
+
+    Response:
+        the successful (or recovered) response. Raises RetryError otherwise.
+    """
+    attempt = 0
+    while True:
+        try:
+            response = send()
+        except NETWORK_EXCEPTIONS as error:
+            response = error
+        if not isinstance(response, Exception) and is_success(response):
+            POLICY.record(endpoint, attempt)
+            return response
+
+        kind = classify_error(response)
+        if kind == AMBIGUOUS and recover is not None:
+            try:
+                recovered = recover()
+            except NETWORK_EXCEPTIONS:
+                recovered = None
+            if recovered is not None:
+                POLICY.record(endpoint, attempt)
+                return recovered
+        delay = None if kind == FATAL else POLICY.next_delay(attempt)
+        if delay is None:
+            POLICY.record(endpoint, attempt, failed=True)
+            raise RetryError(endpoint, response, attempt + 1)
+        print(f'Error in {endpoint}, retrying in {delay:.2f}s\n{response}')
+        tm.sleep(delay)
+        attempt += 1
+
+
+async def call_with_retry_async(endpoint: str, send, is_success, recover=None):
+    """ Asynchronous counterpart of call_with_retry: send and recover are coroutine functions """
+    attempt = 0
+    while True:
+        try:
+            response = await send()
+        except NETWORK_EXCEPTIONS as error:
+            response = error
+        if not isinstance(response, Exception) and is_success(response):
+            POLICY.record(endpoint, attempt)
+            return response
+
+        kind = classify_error(response)
+        if kind == AMBIGUOUS and recover is not None:
+            try:
+                recovered = await recover()
+            except NETWORK_EXCEPTIONS:
+                recovered = None
+            if recovered is not None:
+                POLICY.record(endpoint, attempt)
+                return recovered
+        delay = None if kind == FATAL else POLICY.next_delay(attempt)
+        if delay is None:
+            POLICY.record(endpoint, attempt, failed=True)
+            raise RetryError(endpoint, response, attempt + 1)
+        print(f'Error in {endpoint}, retrying in {delay:.2f}s\n{response}')
+        await asyncio.sleep(delay)
+        attempt += 1
@@ -0,0 +1,492 @@
+# SSX999 Project Hedge
+
+# Augustin BRISSART
+# GitHub: @augustin999
+
+# June 2021
+
+
+import json
+import time as tm
+import contextlib
+import numpy as np
+import pandas as pd
+from typing import Union
+from pathy.base import Pathy
+from pathlib import Path
+
+try:
+    from trader import config
+    from trader import database
+    from trader import env
+    from trader import indicators
+    from trader import ledgers
+    from trader import models
+    from trader import positions
+    from trader import triggers
+    from trader import utils
+except:
+    import config
+    import database
+    import env
+    import indicators
+    import ledgers
+    import models
+    import positions
+    import triggers
+    import utils
+
+
+# The traded currency is persisted as a versioned JSON document holding its live state only:
+# settings, capital, open positions, the exchange fields of their orders and the running EMAs.
+# Closed trades are in trade_ledger.csv, derived data (trigger index) is rebuilt on load.
+# A document written by an earlier version is brought up to STATE_VERSION by MIGRATIONS, one version at a time.
+# The document is saved as a snapshot followed by a journal of its changes (see StateStore),
+# or in the SQLite database with STATE_BACKEND = 'sqlite' (see SQLiteStateStore).
+
+STATE_VERSION = 1
+
+# Schema of version 1
+SETTINGS = [
+    'base', 'quote', 'pair', 'base_amount_precision', 'base_price_precision', 'timeframe',
+    'leverage', 'stop_loss', 'take_profit', 'real_mode', 'fee_rate',
+]
+COUNTERS = ['capital', 'id', 'n_open_positions', 'max_open_positions', 'last_checked_time']
+LEG_FIELDS = [
+    'entry_time', 'exit_time', 'id', 'entry', 'exit', 'qty', 'leverage',
+    'stop_loss', 'take_profit', 'actualised', 'covered_fees', 'triggered_on',
+]
+CONTRACT_FIELDS = config.ORDER_LEDGER_COLUMNS
+EMA_FIELDS = [
+    'fast_period', 'slow_period', 'interval_ms', 'fast', 'slow',
+    'prev_fast', 'prev_slow', 'n_candles', 'last_open_time', 'last_close_price',
+]
+
+# {version: function turning a state of that version into a state of the next one}
+MIGRATIONS = dict()
+
+# ENCODING
+# --------
+
+def encode_contract(contract):
+    """ Orders are kept with the fields of the order ledger, markers such as 'CANCELLED' as they are """
+    if not isinstance(contract, dict):
+        return contract
+    return {field: contract[field] for field in CONTRACT_FIELDS if field in contract.keys()}
+
+
+def encode_position(position):
+    if position is None:
+        return None
+    return {side: [getattr(position[side], field) for field in LEG_FIELDS] for side in ['long', 'short']}
+
+
+def to_state(TradedCurrency):
+    """
+    Returns the live state of a Currency as a dict of JSON types.
+    """
+    state = {'version': STATE_VERSION}
+    for attribute in SETTINGS + COUNTERS:
+        state[attribute] = getattr(TradedCurrency, attribute, None)
+    state['timedelta'] = int(TradedCurrency.timedelta.total_seconds())
+    state['next_timestamp'] = int(1000 * TradedCurrency.next_timestamp.timestamp())
+    state['open_positions'] = [encode_position(position) for position in TradedCurrency.open_positions]
+    state['contracts'] = [
+        {side: {label: encode_contract(contracts[side][label]) for label in contracts[side].keys()} for side in ['long', 'short']}
+        for contracts in TradedCurrency.contracts
+    ]
+    ema = getattr(TradedCurrency, 'ema', None)
+    state['ema'] = {field: getattr(ema, field) for field in EMA_FIELDS} if ema is not None else None
+    trigger = getattr(TradedCurrency, 'ema_trigger', None)
+    state['ema_trigger'] = [trigger.close_time, trigger.price, trigger.side] if trigger is not None else None
+    return state
+
+
+def to_json_type(value):
+    # NumPy scalars coming from candle arrays or order quantities
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'{type(value).__name__} is not part of the state schema')
+
+
+def encode(TradedCurrency):
+    return json.dumps(to_state(TradedCurrency), separators=(',', ':'), default=to_json_type).encode('utf-8')
+
+
+# DECODING
+# --------
+
+def migrate(state: dict):
+    """ Apply the migrations of a state up to STATE_VERSION """
+    version = state.get('version', 0)
+    if version > STATE_VERSION:
+        raise ValueError(f'State version {version} is more recent than this code (version {STATE_VERSION})')
+    while version < STATE_VERSION:
+        state = MIGRATIONS[version](state)
+        version = state['version']
+    return state
+
+
+def decode_position(position):
+    if position is None:
+        return None
+    return positions.new_position(*[positions.Leg(**dict(zip(LEG_FIELDS, position[side]))) for side in ['long', 'short']])
+
+
+def decode_contracts(contracts: dict):
+    sides = []
+    for side in ['long', 'short']:
+        values = {positions.LegOrders.LABELS[label]: contract for label, contract in contracts[side].items()}
+        sides.append(positions.LegOrders(**values))
+    return positions.Pair(*sides)
+
+
+def from_state(state: dict):
+    """
+    Returns the Currency of a state, migrated first if it was written by an earlier version.
+    """
+    state = migrate(state)
+    TradedCurrency = models.Currency.__new__(models.Currency)
+    for attribute in SETTINGS + COUNTERS:
+        setattr(TradedCurrency, attribute, state[attribute])
+    TradedCurrency.timedelta = pd.Timedelta(seconds=state['timedelta'])
+    TradedCurrency.next_timestamp = pd.Timestamp(state['next_timestamp'], unit='ms')
+    TradedCurrency.open_positions = [decode_position(position) for position in state['open_positions']]
+    TradedCurrency.contracts = [decode_contracts(contracts) for contracts in state['contracts']]
+
+    TradedCurrency.ema = None
+    if state['ema'] is not None:
+        ema = indicators.EMACross(state['ema']['fast_period'], state['ema']['slow_period'], state['ema']['interval_ms'])
+        for field in EMA_FIELDS:
+            setattr(ema, field, state['ema'][field])
+        TradedCurrency.ema = ema
+    TradedCurrency.ema_trigger = indicators.CrossTrigger(*state['ema_trigger']) if state['ema_trigger'] is not None else None
+    TradedCurrency.trigger_index = triggers.build_index(TradedCurrency)
+    return TradedCurrency
+
+
+def decode(content: bytes):
+    return from_state(json.loads(content))
+
+
+# JOURNAL
+# -------
+# Between two snapshots, every dump appends one line to the journal: the parts of the state which changed
+# (a top-level key, or one slot of open_positions or contracts) and a description of the change.
+# On load, the entries more recent than the snapshot are replayed onto it.
+
+SLOTTED = ['open_positions', 'contracts']
+
+
+def diff_states(old: dict, new: dict):
+    """
+    Returns {key: value} for every part of new which differs from old.
+    Keys are top-level keys, or 'open_positions.<slot>' and 'contracts.<slot>'.
+    """
+    changes = dict()
+    for key, value in new.items():
+        if key in SLOTTED and key in old.keys() and len(old[key]) == len(value):
+            for slot, item in enumerate(value):
+                if old[key][slot] != item:
+                    changes[f'{key}.{slot}'] = item
+        elif old.get(key) != value:
+            changes[key] = value
+    return changes
+
+
+def apply_changes(state: dict, changes: dict):
+    for key, value in changes.items():
+        if key.split('.')[0] in SLOTTED and '.' in key:
+            key, slot = key.split('.')
+            state[key][int(slot)] = value
+        else:
+            state[key] = value
+    return state
+
+
+def describe_changes(old: dict, changes: dict):
+    """ Short descriptions of the changes of a journal entry (position opened, leg stopped, stop ratcheted...) """
+    events = []
+    for key, value in changes.items():
+        if not key.startswith('open_positions.'):
+            events.append(f'{key} changed')
+            continue
+        slot = int(key.split('.')[1])
+        previous = old['open_positions'][slot] if slot < len(old.get('open_positions', [])) else None
+        if previous is None:
+            events.append(f'position opened in slot {slot}')
+        elif value is None:
+            events.append(f'position closed in slot {slot}')
+        else:
+            for side in ['long', 'short']:
+                before, after = dict(zip(LEG_FIELDS, previous[side])), dict(zip(LEG_FIELDS, value[side]))
+                if before['exit'] != after['exit']:
+                    events.append(f'{side} leg of slot {slot} closed on {after["triggered_on"]}')
+                elif before['stop_loss'] != after['stop_loss']:
+                    events.append(f'{side} stop loss of slot {slot} moved to {after["stop_loss"]}')
+                elif before != after:
+                    events.append(f'{side} leg of slot {slot} updated')
+    return events
+
+
+def encode_entry(entry: dict):
+    return json.dumps(entry, separators=(',', ':'), default=to_json_type).encode('utf-8') + b'\n'
+
+
+def decode_journal(content: bytes):
+    """ Returns the entries of a journal. A last line cut by an interrupted write is ignored. """
+    entries = []
+    for line in content.splitlines():
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            break
+    return entries
+
+
+# READING AND WRITING
+# -------------------
+
+def get_full_path(path: Union[Path, Pathy]):
+    if env.is_local():
+        return path
+    return config.bucket_dir / path
+
+
+def exists():
+    """ True if a state (or a Currency pickled by earlier versions) was saved """
+    if config.STATE_BACKEND == 'sqlite' and get_store().exists():
+        return True
+    return get_full_path(config.TradedCurrency_path).exists() or get_full_path(config.legacy_TradedCurrency_path).exists()
+
+
+class StateStore(object):
+    """
+    State of the traded currency saved as a snapshot plus a journal of the changes since that snapshot.
+
+    A snapshot is written on the first dump, when the journal reaches STATE_JOURNAL_MAX_ENTRIES entries,
+    or when the saved state was written by an earlier version. It records the sequence number of the last
+    journal entry it includes: entries written before an interrupted compaction are not replayed twice.
+
+    Attributes:
+        path: snapshot path (config.TradedCurrency_path)
+        journal_path: journal path (config.TradedCurrency_journal_path)
+        state (dict): last state saved, None until loaded or saved
+        seq (int): sequence number of the last journal entry
+        n_entries (int): journal entries since the last snapshot
+    """
+
+    def __init__(self, path=config.TradedCurrency_path, journal_path=config.TradedCurrency_journal_path):
+        self.path = path
+        self.journal_path = journal_path
+        self.state = None
+        self.seq = 0
+        self.n_entries = 0
+        return
+
+    def load(self):
+        """
+        Returns the saved Currency: the snapshot with the journal replayed onto it.
+        A Currency pickled by earlier versions is loaded if no state was saved yet: a snapshot is written on the next dump.
+        """
+        if not get_full_path(self.path).exists() and get_full_path(config.legacy_TradedCurrency_path).exists():
+            self.state = None
+            return utils.load_pickle(config.legacy_TradedCurrency_path)
+        state = json.loads(utils.read_bytes(self.path))
+        self.seq = state.pop('seq', 0)
+        self.n_entries = 0
+        if get_full_path(self.journal_path).exists():
+            for entry in decode_journal(utils.read_bytes(self.journal_path)):
+                if entry['seq'] <= self.seq or entry['version'] != state.get('version', 0):
+                    continue
+                apply_changes(state, entry['changes'])
+                self.seq = entry['seq']
+                self.n_entries += 1
+        version = state.get('version', 0)
+        TradedCurrency = from_state(state)
+        # A state of an earlier version is saved again as a snapshot
+        self.state = to_state(TradedCurrency) if version == STATE_VERSION else None
+        return TradedCurrency
+
+    def has_changed(self, state: dict):
+        return self.state is None or len(diff_states(self.state, state)) > 0
+
+    def write(self, state: dict):
+        """
+        Save a state (see to_state): one journal entry with its changes, or a new snapshot.
+
+        Response:
+            True if anything was written
+        """
+        if self.state is not None and self.n_entries < config.STATE_JOURNAL_MAX_ENTRIES:
+            changes = diff_states(self.state, state)
+            if len(changes) == 0:
+                return False
+            entry = {
+                'seq': self.seq + 1,
+                'time': int(1000 * tm.time()),
+                'version': STATE_VERSION,
+                'events': describe_changes(self.state, changes),
+                'changes': changes,
+            }
+            utils.append_bytes(encode_entry(entry), self.journal_path)
+            self.seq += 1
+            self.n_entries += 1
+        else:
+            self.compact(state)
+        self.state = state
+        return True
+
+    def compact(self, state: dict):
+        """ Write a snapshot of state, then empty the journal """
+        snapshot = dict(state, seq=self.seq)
+        utils.write_bytes(json.dumps(snapshot, separators=(',', ':'), default=to_json_type).encode('utf-8'), self.path)
+        utils.write_bytes(b'', self.journal_path)
+        self.n_entries = 0
+        return
+
+    def dump(self, TradedCurrency):
+        return self.write(to_state(TradedCurrency))
+
+
+class SQLiteStateStore(object):
+    """
+    State of the traded currency saved in the SQLite database (STATE_BACKEND = 'sqlite'): one row per top-level key
+    in the state table, one row per slot in the positions table. A write updates the rows of the changes only,
+    in one transaction.
+
+    Attributes:
+        database (database.Database)
+        path: database file
+        state (dict): last state saved, None until loaded or saved
+    """
+
+    # {slotted key: column of the positions table}
+    COLUMNS = {'open_positions': 'position', 'contracts': 'contracts'}
+
+    def __init__(self, database: database.Database):
+        self.database = database
+        self.path = database.path
+        self.state = None
+        return
+
+    def exists(self):
+        return len(self.database.execute('SELECT key FROM state LIMIT 1')) > 0
+
+    def load(self):
+        """
+        Returns the saved Currency.
+        The state saved in files (or a pickled Currency) is loaded if the database holds none yet: it is written to the database on the next dump.
+        """
+        rows = self.database.execute('SELECT key, value FROM state')
+        if len(rows) == 0:
+            self.state = None
+            return StateStore().load()
+        state = {key: json.loads(value) for key, value in rows}
+        slots = self.database.execute('SELECT position, contracts FROM positions ORDER BY slot')
+        state['open_positions'] = [json.loads(position) if position is not None else None for position, _ in slots]
+        state['contracts'] = [json.loads(contracts) if contracts is not None else None for _, contracts in slots]
+        version = state.get('version', 0)
+        TradedCurrency = from_state(state)
+        # A state of an earlier version is saved again as a whole
+        self.state = to_state(TradedCurrency) if version == STATE_VERSION else None
+        return TradedCurrency
+
+    def has_changed(self, state: dict):
+        return self.state is None or len(diff_states(self.state, state)) > 0
+
+    def write(self, state: dict):
+        """
+        Save a state (see to_state): the rows of its changes, or every row after a load of an earlier version.
+
+        Response:
+            True if anything was written
+        """
+        changes = diff_states(self.state, state) if self.state is not None else dict(state)
+        if len(changes) == 0:
+            return False
+        with self.database.transaction() as connection:
+            if self.state is None:
+                connection.execute('DELETE FROM state')
+            for key, value in changes.items():
+                key, _, slot = key.partition('.')
+                if key in SLOTTED:
+                    column = self.COLUMNS[key]
+                    values = [(int(slot), value)] if slot != '' else list(enumerate(value))
+                    if slot == '':
+                        connection.execute('DELETE FROM positions WHERE slot >= ?', (len(value),))
+                    connection.executemany(
+                        f'INSERT INTO positions (slot, {column}) VALUES (?, ?) ON CONFLICT(slot) DO UPDATE SET {column} = excluded.{column}',
+                        [(i, json.dumps(item, separators=(',', ':'), default=to_json_type)) for i, item in values],
+                    )
+                else:
+                    connection.execute(
+                        'INSERT INTO state (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+                        (key, json.dumps(value, separators=(',', ':'), default=to_json_type)),
+                    )
+        self.state = state
+        return True
+
+    def dump(self, TradedCurrency):
+        return self.write(to_state(TradedCurrency))
+
+
+_stores = dict()
+
+
+def get_store(path=config.TradedCurrency_path, journal_path=config.TradedCurrency_journal_path):
+    if config.STATE_BACKEND == 'sqlite':
+        key = ('sqlite', str(config.database_path))
+        if not key in _stores.keys():
+            _stores[key] = SQLiteStateStore(database.get_database())
+        return _stores[key]
+    key = (str(path), str(journal_path))
+    if not key in _stores.keys():
+        _stores[key] = StateStore(path, journal_path)
+    return _stores[key]
+
+
+def load_state():
+    """ Returns the saved Currency """
+    return get_store().load()
+
+
+def dump_state(TradedCurrency):
+    """
+    Save the changes of a Currency since it was loaded or saved last. Nothing is written if nothing changed.
+
+    Response:
+        True if anything was written
+    """
+    return get_store().dump(TradedCurrency)
+
+
+def write_tick(store, content: dict, flush_ledgers=True):
+    """
+    End of a tick: write the ledger rows of the tick (ledgers.buffer) and a state (see to_state, None if unchanged).
+    With both SQLite backends, the rows and the state are written in one transaction: a position is never
+    closed in the state without its trade in the ledger, or the other way round. A ledger which cannot be
+    written then rolls the whole transaction back and its error is raised.
+
+    Response:
+        True if the state was written
+    """
+    shared = config.STATE_BACKEND == 'sqlite' and config.LEDGER_BACKEND == 'sqlite'
+    transaction = database.get_database().transaction() if shared else contextlib.nullcontext()
+    written, items = False, []
+    with ledgers.buffer.flush_lock:
+        try:
+            with transaction:
+                if flush_ledgers:
+                    items = ledgers.buffer.write_pending(strict=shared)
+                if content is not None:
+                    written = store.write(content)
+        except Exception:
+            if shared:
+                # Rows and state rolled back together: the rows are still pending, the state is written as a whole next time
+                items = []
+                store.state = None
+            raise
+        finally:
+            ledgers.buffer.release(items)
+    return written
@@ -0,0 +1,381 @@
+# SSX999 Project Hedge
+
+# Augustin BRISSART
+# GitHub: @augustin999
+
+# June 2021
+
+
+import json
+import random
+import asyncio
+import threading
+import time as tm
+import aiohttp
+
+try:
+    from trader import Binance_API
+    from trader import Binance_API_async
+    from trader import candles
+    from trader import config
+except:
+    import Binance_API
+    import Binance_API_async
+    import candles
+    import config
+
+
+STREAM_URL = 'wss://fstream.binance.com'
+
+
+# DECODING MESSAGES
+# -----------------
+
+def get_stream_names(pair: str, intervals: list, contractType='PERPETUAL'):
+    """ Names of the combined streams of a pair: continuous klines of each interval, mark price and book ticker """
+    names = [f'{pair.lower()}_{contractType.lower()}@continuousKline_{interval}' for interval in intervals]
+    names += [f'{pair.lower()}@markPrice@1s', f'{pair.lower()}@bookTicker']
+    return names
+
+
+def decode_stream_kline(kline: dict):
+    """ Convert the 'k' field of a kline event to a Binance_API.KLINE_DTYPE record """
+    fields = [kline['t'], kline['o'], kline['h'], kline['l'], kline['c'], kline['v'], kline['T'], kline['q'], kline['n'], kline['V'], kline['Q']]
+    return Binance_API.decode_klines([fields])[0]
+
+
+# STREAM CLIENT
+# -------------
+
+class MarketStream(object):
+    """
+    Consume the futures market streams of one pair and keep the latest market data in memory.
+
+    The stream runs on the background event loop of Binance_API_async. Callbacks are called from that loop:
+    - on_candle(callback): callback(interval, candle) for every closed candle, once it is stored in the candle store,
+    - on_price(callback): callback(price) for every book ticker update (mid price).
+    When the stream is stale, getters fall back on the REST endpoints.
+    """
+
+    def __init__(self, pair: str, intervals=('1m',), contractType='PERPETUAL', url=STREAM_URL,
+                 record_path=None, store_candles=True):
+        self.pair = pair
+        self.intervals = list(intervals)
+        self.contractType = contractType
+        self.url = url + '/stream?streams=' + '/'.join(get_stream_names(pair, self.intervals, contractType))
+        self.record_path = record_path
+        self.store_candles = store_candles
+        self.candles = dict() # latest candle of each interval, closed or not
+        self.closed_candles = dict() # latest closed candle of each interval
+        self.price = None
+        self.mark_price = None
+        self.last_message = None
+        self.candle_callbacks = []
+        self.price_callbacks = []
+        self.stats = {'messages': 0, 'connections': 0}
+        self.future = None
+        self.stopped = False
+        return
+
+    def on_candle(self, callback):
+        self.candle_callbacks.append(callback)
+        return
+
+    def on_price(self, callback):
+        self.price_callbacks.append(callback)
+        return
+
+    def handle(self, message: dict):
+        """
+        Update the market data from one combined stream message.
+
+        Response:
+            list of [interval, candle] closed by this message
+        """
+        data = message['data']
+        self.last_message = tm.monotonic()
+        self.stats['messages'] += 1
+        closed = []
+        if data['e'] in ['kline', 'continuous_kline']:
+            candle = decode_stream_kline(data['k'])
+            self.candles[data['k']['i']] = candle
+            if data['k']['x']:
+                self.closed_candles[data['k']['i']] = candle
+                closed.append([data['k']['i'], candle])
+        elif data['e'] == 'markPriceUpdate':
+            self.mark_price = float(data['p'])
+        elif data['e'] == 'bookTicker':
+            self.price = (float(data['b']) + float(data['a'])) / 2
+            for callback in self.price_callbacks:
+                callback(self.price)
+        return closed
+
+    def store_candle(self, interval: str, candle):
+        candles.get_store(self.pair, interval, self.contractType).append_closed(candle)
+        return
+
+    async def listen(self):
+        """ Receive messages until stopped, reconnecting with a jittered backoff """
+        loop = asyncio.get_event_loop()
+        attempt = 0
+        record = open(self.record_path, 'a') if self.record_path is not None else None
+        try:
+            while not self.stopped:
+                try:
+                    async with Binance_API_async.CLIENT.get_session().ws_connect(self.url, heartbeat=config.STREAM_STALE_AFTER) as ws:
+                        self.stats['connections'] += 1
+                        attempt = 0
+                        async for msg in ws:
+                            if msg.type != aiohttp.WSMsgType.TEXT:
+                                break
+                            if record is not None:
+                                record.write(json.dumps({'time': int(tm.time()*1000), 'message': msg.data}) + '\n')
+                            for interval, candle in self.handle(json.loads(msg.data)):
+                                if self.store_candles:
+                                    # The candle store is file backed: keep its writes out of the event loop
+                                    await loop.run_in_executor(None, self.store_candle, interval, candle)
+                                for callback in self.candle_callbacks:
+                                    callback(interval, candle)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    print(f'Market stream disconnected: {error}')
+                except Exception as error:
+                    print(f'Error in market stream, reconnecting: {error}')
+                if not self.stopped:
+                    delay = random.uniform(0, min(config.STREAM_RECONNECT_MAX_DELAY, 2**attempt))
+                    attempt += 1
+                    await asyncio.sleep(delay)
+        finally:
+            if record is not None:
+                record.close()
+        return
+
+    def start(self):
+        self.stopped = False
+        self.future = asyncio.run_coroutine_threadsafe(self.listen(), Binance_API_async.get_event_loop())
+        return self
+
+    def stop(self):
+        self.stopped = True
+        if self.future is not None:
+            self.future.cancel()
+        return
+
+    def is_stale(self):
+        return self.last_message is None or tm.monotonic() - self.last_message > config.STREAM_STALE_AFTER
+
+    def get_price(self):
+        """ Latest book ticker mid price, or the REST ticker price if the stream is stale """
+        if self.is_stale() or self.price is None:
+            return Binance_API.get_price(self.pair)
+        return self.price
+
+    def get_mark_price(self):
+        if self.is_stale() or self.mark_price is None:
+            return Binance_API.get_mark_price(self.pair)
+        return self.mark_price
+
+    def get_last_closed_candle(self, interval='1m'):
+        """ Latest closed candle received on the stream, or None (the candle store remains the reference) """
+        if self.is_stale():
+            return None
+        return self.closed_candles.get(interval)
+
+
+# USER DATA STREAM
+# ----------------
+
+class AccountBook(object):
+    """
+    In-memory orders, positions and balances of the account, kept up to date by a UserDataStream.
+    Orders use the format returned by Binance_API.query_order.
+    """
+
+    def __init__(self):
+        self.orders = dict()
+        self.positions = dict()
+        self.balances = dict()
+        self.outdated_balances = set()
+        self.lock = threading.Lock()
+        return
+
+    def set_order(self, order: dict):
+        """ Store an order unless a more recent version of it is already known """
+        with self.lock:
+            known = self.orders.get(order['orderId'])
+            if known is None or int(known['updateTime']) <= int(order['updateTime']):
+                self.orders[order['orderId']] = order
+        return
+
+    def get_order(self, orderId: int):
+        with self.lock:
+            return self.orders.get(orderId)
+
+    def set_balance(self, balance: dict):
+        """ Store a balance as returned by Binance_API.get_futures_account_balance """
+        with self.lock:
+            self.balances[balance['asset']] = balance
+            self.outdated_balances.discard(balance['asset'])
+        return
+
+    def get_balance(self, asset='USDT'):
+        """ Returns the balance of an asset, or None if unknown or outdated by an account update """
+        with self.lock:
+            if asset in self.outdated_balances:
+                return None
+            return self.balances.get(asset)
+
+    def apply(self, event: dict):
+        """ Update the book from an ORDER_TRADE_UPDATE or ACCOUNT_UPDATE event """
+        if event['e'] == 'ORDER_TRADE_UPDATE':
+            self.set_order(Binance_API.parse_order_update(event['o']))
+        elif event['e'] == 'ACCOUNT_UPDATE':
+            balances, positions = Binance_API.parse_account_update(event['a'])
+            with self.lock:
+                for asset, balance in balances.items():
+                    self.balances.setdefault(asset, {'asset': asset}).update(balance)
+                    # Available balance is not part of the event: it is requested again on next read
+                    self.outdated_balances.add(asset)
+                self.positions.update(positions)
+        return
+
+    def get_pending_orderIds(self):
+        with self.lock:
+            return [orderId for orderId, order in self.orders.items() if not order['status'] in Binance_API.FINAL_ORDER_STATUSES]
+
+
+class UserDataStream(object):
+    """
+    Consume the user data stream of the account and keep an AccountBook up to date.
+
+    The listenKey is created when connecting, kept alive every USER_STREAM_KEEPALIVE_INTERVAL seconds
+    and replaced when Binance reports it expired. After a disconnection, pending orders and balances
+    are reconciled with REST requests before the book is trusted again.
+    """
+
+    def __init__(self, url=STREAM_URL):
+        self.url = url
+        self.book = AccountBook()
+        self.listen_key = None
+        self.connected = False
+        self.future = None
+        self.stopped = False
+        self.stats = {'events': 0, 'connections': 0, 'reconciliations': 0}
+        return
+
+    def is_synced(self):
+        return self.connected
+
+    def handle(self, event: dict):
+        self.stats['events'] += 1
+        if event['e'] == 'listenKeyExpired':
+            return False
+        self.book.apply(event)
+        return True
+
+    async def keep_alive(self):
+        while True:
+            await asyncio.sleep(config.USER_STREAM_KEEPALIVE_INTERVAL)
+            await Binance_API_async.keep_alive_listen_key()
+
+    async def reconcile(self):
+        """ Catch up with the events missed while disconnected """
+        pending = [self.book.get_order(orderId) for orderId in self.book.get_pending_orderIds()]
+        orders = await Binance_API_async.gather(*[Binance_API_async.query_order(order['symbol'], order['orderId']) for order in pending])
+        for order in orders:
+            self.book.set_order(order)
+        with self.book.lock:
+            self.book.outdated_balances.update(self.book.balances.keys())
+        self.stats['reconciliations'] += 1
+        return
+
+    async def listen(self):
+        attempt = 0
+        while not self.stopped:
+            keep_alive = None
+            try:
+                self.listen_key = await Binance_API_async.create_listen_key()
+                async with Binance_API_async.CLIENT.get_session().ws_connect(f'{self.url}/ws/{self.listen_key}', heartbeat=config.STREAM_STALE_AFTER) as ws:
+                    keep_alive = asyncio.ensure_future(self.keep_alive())
+                    if self.stats['connections'] > 0:
+                        await self.reconcile()
+                    self.stats['connections'] += 1
+                    self.connected = True
+                    attempt = 0
+                    async for msg in ws:
+                        if msg.type != aiohttp.WSMsgType.TEXT or not self.handle(json.loads(msg.data)):
+                            break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                print(f'User data stream disconnected: {error}')
+            except Exception as error:
+                print(f'Error in user data stream, reconnecting: {error}')
+            finally:
+                self.connected = False
+                if keep_alive is not None:
+                    keep_alive.cancel()
+            if not self.stopped:
+                delay = random.uniform(0, min(config.STREAM_RECONNECT_MAX_DELAY, 2**attempt))
+                attempt += 1
+                await asyncio.sleep(delay)
+        return
+
+    def start(self):
+        self.stopped = False
+        self.future = asyncio.run_coroutine_threadsafe(self.listen(), Binance_API_async.get_event_loop())
+        return self
+
+    def stop(self):
+        self.stopped = True
+        self.connected = False
+        if self.future is not None:
+            self.future.cancel()
+        if self.listen_key is not None:
+            Binance_API.close_listen_key()
+        return
+
+
+USER_STREAM = None
+
+
+def start_user_stream(url=STREAM_URL):
+    global USER_STREAM
+    if USER_STREAM is None:
+        USER_STREAM = UserDataStream(url).start()
+    return USER_STREAM
+
+
+def stop_user_stream():
+    global USER_STREAM
+    if USER_STREAM is not None:
+        USER_STREAM.stop()
+        USER_STREAM = None
+    return
+
+
+def get_account_book():
+    """ Returns the account book if a user data stream is running and synced, else None """
+    if USER_STREAM is None or not USER_STREAM.is_synced():
+        return None
+    return USER_STREAM.book
+
+
+# Readers of the account state: the account book is used when available,
+# REST requests otherwise (Cloud Function runs, disconnected stream, orders unknown to the book)
+
+def query_order(pair: str, orderId: int):
+    book = get_account_book()
+    order = book.get_order(orderId) if book is not None else None
+    if order is None:
+        order = Binance_API.query_order(pair, orderId)
+        if book is not None:
+            book.set_order(order)
+    return order
+
+
+def get_futures_account_balance():
+    book = get_account_book()
+    balance = book.get_balance('USDT') if book is not None else None
+    if balance is None:
+        balance = Binance_API.get_futures_account_balance()
+        if book is not None:
+            book.set_balance(balance)
+    return dict(balance)
@@ -0,0 +1,206 @@
+# SSX999 Project Hedge
+
+# Augustin BRISSART
+# GitHub: @augustin999
+
+# June 2021
+
+
+import bisect
+import numpy as np
+
+
+# Price levels of the open legs, evaluated against a path of 1m candles in one NumPy pass.
+# A level is reached by a candle when its high goes over it (levels above the price)
+# or when its low goes under it (levels below the price), so intra-minute touches are seen.
+
+RATCHET = 0 # next stop loss update of an actualised leg (covered fees 1 or 2)
+STOP_LOSS = 1
+TAKE_PROFIT = 2
+
+LONG = 0
+SHORT = 1
+SIDES = ['long', 'short']
+
+LEVEL_DTYPE = np.dtype([
+    ('slot', np.int32),
+    ('side', np.int8),
+    ('kind', np.int8),
+    ('level', np.float64),
+    ('above', np.bool_),
+])
+
+
+def get_position_levels(slot: int, position, fee_rate: float):
+    """
+    Levels of one position slot, as (slot, side, kind, level, above) tuples.
+    """
+    levels = []
+    if position is None:
+        return levels
+    long, short = position.long, position.short
+    if long.exit == 0:
+        levels.append((slot, LONG, STOP_LOSS, long.stop_loss, False))
+    if short.exit == 0:
+        levels.append((slot, SHORT, STOP_LOSS, short.stop_loss, True))
+    if long.actualised and long.exit == 0:
+        levels.append((slot, LONG, TAKE_PROFIT, long.take_profit, True))
+        if long.stop_loss == short.exit:
+            levels.append((slot, LONG, RATCHET, short.exit * (1+fee_rate), True))
+        elif long.stop_loss == short.exit * (1+fee_rate):
+            levels.append((slot, LONG, RATCHET, short.exit * (1+2*fee_rate), True))
+    if short.actualised and short.exit == 0:
+        levels.append((slot, SHORT, TAKE_PROFIT, short.take_profit, False))
+        if short.stop_loss == long.exit:
+            levels.append((slot, SHORT, RATCHET, long.exit * (1-fee_rate), False))
+        elif short.stop_loss == long.exit * (1-fee_rate):
+            levels.append((slot, SHORT, RATCHET, long.exit * (1-2*fee_rate), False))
+    return levels
+
+
+def get_levels(TradedCurrency):
+    """
+    Returns every level at which an open leg needs an update (see processes.manage_open_positions)
+    as a LEVEL_DTYPE array.
+    """
+    levels = []
+    for i, position in enumerate(TradedCurrency.open_positions):
+        levels += get_position_levels(i, position, TradedCurrency.fee_rate)
+    return np.array(levels, dtype=LEVEL_DTYPE)
+
+
+def find_first_touches(levels: np.ndarray, candles: np.ndarray):
+    """
+    Index of the first candle reaching each level, -1 for levels the path never reaches.
+
+    Arguments:
+        levels (LEVEL_DTYPE array)
+        candles (Binance_API.KLINE_DTYPE array): candle path, in time order
+    """
+    if len(levels) == 0 or len(candles) == 0:
+        return np.full(len(levels), -1)
+    high = np.asarray(candles['high_price'], dtype=np.float64)[:, None]
+    low = np.asarray(candles['low_price'], dtype=np.float64)[:, None]
+    # (n_candles, n_levels) matrix of touches
+    reached = np.where(levels['above'], high > levels['level'], low < levels['level'])
+    first = reached.argmax(axis=0)
+    first[~reached.any(axis=0)] = -1
+    return first
+
+
+def find_triggers(TradedCurrency, candles: np.ndarray):
+    """
+    First trigger of every leg level on a candle path.
+
+    Response:
+        list of {'candle', 'slot', 'side', 'kind', 'level'} in time order ('candle' is an index in candles).
+        Triggers of the same candle follow the order of processes.manage_open_positions:
+        slot, then ratchets, stop losses and take profits, long before short.
+    """
+    levels = get_levels(TradedCurrency)
+    first = find_first_touches(levels, candles)
+    touched = np.nonzero(first >= 0)[0]
+    order = np.lexsort((levels['side'][touched], levels['kind'][touched], levels['slot'][touched], first[touched]))
+    triggers = []
+    for j in touched[order]:
+        triggers.append({
+            'candle': int(first[j]),
+            'slot': int(levels['slot'][j]),
+            'side': SIDES[levels['side'][j]],
+            'kind': int(levels['kind'][j]),
+            'level': float(levels['level'][j]),
+        })
+    return triggers
+
+
+def is_pending(TradedCurrency, trigger: dict):
+    """ True if the level of a trigger is still one of the levels of its leg """
+    levels = get_levels(TradedCurrency)
+    match = (levels['slot'] == trigger['slot']) & (levels['side'] == SIDES.index(trigger['side']))
+    match &= (levels['kind'] == trigger['kind']) & (levels['level'] == trigger['level'])
+    return bool(match.any())
+
+
+# TRIGGER INDEX
+# -------------
+
+class TriggerIndex(object):
+    """
+    Levels of the open legs of a Currency (hence of one pair), kept sorted per direction,
+    and the free position slots.
+
+    A price only visits the legs it crossed: levels above the price are reached when the price goes over them,
+    levels below when it goes under them, each found by bisection.
+    The index is updated slot by slot (Currency.update_triggers) after every change of a position.
+
+    Attributes:
+        above (list): (level, slot, side, kind) sorted by level, reached when the price goes over level
+        below (list): (level, slot, side, kind) sorted by level, reached when the price goes under level
+        entries (list): keys of each slot in above and below, as (above, key)
+        occupied (list): True for the slots holding a position
+        free (list): stack of free slots, the last freed on top. Occupied slots may remain in it and are skipped.
+        stacked (list): True for the slots in free (a slot is stacked once at most)
+    """
+
+    def __init__(self, n_slots: int):
+        self.above = []
+        self.below = []
+        self.entries = [[] for _ in range(n_slots)]
+        self.occupied = [False] * n_slots
+        self.free = list(range(n_slots - 1, -1, -1))
+        self.stacked = [True] * n_slots
+        return
+
+    def update(self, slot: int, position, fee_rate: float):
+        """ Replace the levels of a slot by those of its position (None once closed) """
+        for above, key in self.entries[slot]:
+            book = self.above if above else self.below
+            del book[bisect.bisect_left(book, key)]
+        self.entries[slot] = []
+        for _, side, kind, level, above in get_position_levels(slot, position, fee_rate):
+            key = (level, slot, side, kind)
+            bisect.insort(self.above if above else self.below, key)
+            self.entries[slot].append((above, key))
+
+        self.occupied[slot] = position is not None
+        if position is None and not self.stacked[slot]:
+            self.free.append(slot)
+            self.stacked[slot] = True
+        elif position is not None and len(self.free) > 0 and self.free[-1] == slot:
+            self.stacked[self.free.pop()] = False
+        return
+
+    def get_free_slot(self):
+        """ Returns the last freed slot (in amortised O(1)), or None if every slot holds a position """
+        while len(self.free) > 0 and self.occupied[self.free[-1]]:
+            self.stacked[self.free.pop()] = False
+        return self.free[-1] if len(self.free) > 0 else None
+
+    def crossed(self, price: float):
+        """
+        Levels reached by a price.
+
+        Response:
+            list of (slot, side, kind), side being 'long' or 'short'
+        """
+        n_above = bisect.bisect_left(self.above, (price,))
+        n_below = bisect.bisect_right(self.below, (price, np.inf))
+        return [(slot, SIDES[side], kind) for _, slot, side, kind in self.above[:n_above] + self.below[n_below:]]
+
+    def get_crossed_slots(self, price: float):
+        """ Slots with at least one level reached by a price, in increasing order """
+        return sorted(set(slot for slot, _, _ in self.crossed(price)))
+
+    def get_bounds(self):
+        """ Price interval out of which a level is reached: (highest level below, lowest level above) """
+        lower = self.below[-1][0] if len(self.below) > 0 else -np.inf
+        upper = self.above[0][0] if len(self.above) > 0 else np.inf
+        return lower, upper
+
+
+def build_index(TradedCurrency):
+    """ TriggerIndex of the open positions of a Currency """
+    index = TriggerIndex(TradedCurrency.max_open_positions)
+    for i, position in enumerate(TradedCurrency.open_positions):
+        index.update(i, position, TradedCurrency.fee_rate)
+    return index
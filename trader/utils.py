@@ -6,11 +6,18 @@
 # June 2021
 
 
+import io
+import os
 import pickle
+import logging
+import threading
+import time as tm
+from collections import OrderedDict
 from typing import Union
 
 import pandas as pd
 from google.cloud import storage
+from google.cloud.exceptions import NotFound
 from pathy.base import Pathy
 from pathlib import Path
 
@@ -21,11 +28,124 @@ except:
     import config
     import env
 
+logger = logging.getLogger('trader')
+
+
+# BUCKET TRANSPORT
+# ----------------
+
+# Every read and write of the bucket goes through one storage client per process (its authenticated
+# HTTP session is reused by every request) and through cached bucket and blob handles.
+# Transfers are measured per object: see get_transfer_stats.
+
+MAX_CACHED_BLOBS = 256
+
+_client = None
+_client_pid = None
+_bucket = None
+_blobs = OrderedDict()
+_lock = threading.Lock()
+
+# {(blob name, operation): [calls, bytes, seconds]}
+_transfers = dict()
+
+
+def get_client():
+    """ Storage client of the process (a forked process creates its own) """
+    global _client, _client_pid, _bucket
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = storage.Client()
+            _client_pid = os.getpid()
+            _bucket = _client.bucket(config.bucket_dir.name)
+            _blobs.clear()
+        return _client
+
+
+def get_bucket():
+    get_client()
+    return _bucket
+
+
+def get_blob_name(path: Union[Path, Pathy, str]):
+    """ Name of a blob in the bucket, for paths given relative to the bucket or as gs:// paths """
+    path = str(path)
+    bucket_prefix = str(config.bucket_dir) + '/'
+    return path[len(bucket_prefix):] if path.startswith(bucket_prefix) else path
+
 
 def get_blob(path: Union[Path, Pathy]):
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(config.bucket_dir.name)
-    return bucket.blob(path)
+    """ Cached handle of a blob (no request is sent) """
+    bucket = get_bucket()
+    name = get_blob_name(path)
+    with _lock:
+        if name in _blobs.keys():
+            _blobs.move_to_end(name)
+            return _blobs[name]
+        blob = bucket.blob(name)
+        _blobs[name] = blob
+        if len(_blobs) > MAX_CACHED_BLOBS:
+            _blobs.popitem(last=False)
+        return blob
+
+
+def record_transfer(name: str, operation: str, n_bytes: int, start: float):
+    """ Add a request on a blob, started at start (time.perf_counter), to the transfer statistics """
+    seconds = tm.perf_counter() - start
+    with _lock:
+        stats = _transfers.setdefault((name, operation), [0, 0, 0.])
+        stats[0] += 1
+        stats[1] += n_bytes
+        stats[2] += seconds
+    logger.debug(f'{operation} {name}: {n_bytes} bytes in {1000 * seconds:.1f} ms')
+    return
+
+
+def get_transfer_stats(reset=False):
+    """
+    Requests sent to the bucket since the start of the process (or the last reset).
+
+    Response:
+        DataFrame with the columns object, operation, calls, bytes, seconds and mean ms
+    """
+    with _lock:
+        transfers = dict(_transfers)
+        if reset:
+            _transfers.clear()
+    rows = [[name, operation, calls, n_bytes, seconds, 1000 * seconds / calls] for (name, operation), (calls, n_bytes, seconds) in transfers.items()]
+    return pd.DataFrame(rows, columns=['object', 'operation', 'calls', 'bytes', 'seconds', 'mean ms'])
+
+
+def upload(content: bytes, path: Union[Path, Pathy]):
+    blob = get_blob(path)
+    start = tm.perf_counter()
+    blob.upload_from_string(content)
+    record_transfer(blob.name, 'upload', len(content), start)
+    return
+
+
+def download(path: Union[Path, Pathy], start_byte=None, end_byte=None):
+    blob = get_blob(path)
+    start = tm.perf_counter()
+    content = blob.download_as_string(start=start_byte, end=end_byte)
+    record_transfer(blob.name, 'download', len(content), start)
+    return content
+
+
+def get_metadata(path: Union[Path, Pathy]):
+    """ Returns the blob of a path with up-to-date metadata (size, component count), or None if it does not exist """
+    blob = get_blob(path)
+    start = tm.perf_counter()
+    try:
+        blob.reload()
+    except NotFound:
+        blob = None
+    record_transfer(get_blob_name(path), 'metadata', 0, start)
+    return blob
+
+
+# FILES
+# -----
 
 
 def dump_as_pickle(content, path: Union[Path, Pathy]):
@@ -33,29 +153,45 @@ def dump_as_pickle(content, path: Union[Path, Pathy]):
         with open(path, 'wb') as _file:
             pickle.dump(content, _file)
     else:
-        blob = get_blob(path=str(path))
-        pickle_out = pickle.dumps(content)
-        blob.upload_from_string(pickle_out)
+        upload(pickle.dumps(content), path)
     return
 
 
+def write_bytes(content: bytes, path: Union[Path, Pathy]):
+    if env.is_local():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as _file:
+            _file.write(content)
+    else:
+        upload(content, path)
+    return
+
+
+def read_bytes(path: Union[Path, Pathy]):
+    if env.is_local():
+        with open(str(path), 'rb') as _file:
+            return _file.read()
+    return download(path)
+
+
 def load_pickle(path: Union[Path, Pathy]):
     if env.is_local():
         with open(str(path), 'rb') as _file:
             return pickle.load(_file)
-    blob = get_blob(path=str(path))
-    pickle_in = blob.download_as_string()
-    return pickle.loads(pickle_in)
+    return pickle.loads(download(path))
 
 
 def dump_as_csv(content: pd.DataFrame, path: Union[Path, Pathy]):
-    # Pandas can write directly in a Bucket
-    content.to_csv(str(path), sep=config.CSV_SEP, encoding='utf-8')
+    if env.is_local():
+        content.to_csv(str(path), sep=config.CSV_SEP, encoding='utf-8')
+    else:
+        upload(content.to_csv(sep=config.CSV_SEP).encode('utf-8'), path)
     return
 
 
 def read_csv(path: Union[Path, Pathy]):
-    df = pd.read_csv(str(path), sep=config.CSV_SEP, encoding='utf-8')
+    _file = str(path) if env.is_local() else io.BytesIO(download(path))
+    df = pd.read_csv(_file, sep=config.CSV_SEP, encoding='utf-8')
     if df.columns[0] == 'Unnamed: 0':
         df = df[df.columns[1:]]
     return df
@@ -65,6 +201,90 @@ def read_file(path: Union[Path, Pathy]):
     if env.is_local():
         with open(path, 'r') as _file:
             return _file.read().strip()
-    blob = get_blob(path=str(path))
-    _file = blob.download_as_string()
-    return _file.strip()
+    return download(path).strip()
+
+
+def get_size(path: Union[Path, Pathy]):
+    """ Returns the size of a file in bytes, or None if it does not exist """
+    if env.is_local():
+        return os.path.getsize(path) if os.path.exists(path) else None
+    blob = get_metadata(path)
+    return blob.size if blob is not None else None
+
+
+def get_info(path: Union[Path, Pathy]):
+    """
+    Returns {'size': bytes, 'components': number of composed objects} of a file, or None if it does not exist.
+    Local files count as one component.
+    """
+    if env.is_local():
+        return {'size': os.path.getsize(path), 'components': 1} if os.path.exists(path) else None
+    blob = get_metadata(path)
+    if blob is None:
+        return None
+    return {'size': blob.size, 'components': blob.component_count or 1}
+
+
+def read_head(path: Union[Path, Pathy], size: int):
+    """ Returns the first size bytes of a file """
+    if env.is_local():
+        with open(path, 'rb') as _file:
+            return _file.read(size)
+    return download(path, 0, size-1)
+
+
+def list_names(path: Union[Path, Pathy], prefix: str):
+    """ Returns the names of the files of a directory which start with prefix """
+    if env.is_local():
+        return sorted(_file.name for _file in Path(path).glob(prefix + '*'))
+    directory = get_blob_name(path).rstrip('/') + '/'
+    start = tm.perf_counter()
+    names = [blob.name for blob in get_client().list_blobs(get_bucket(), prefix=directory + prefix)]
+    record_transfer(directory + prefix, 'list', 0, start)
+    return sorted(name[len(directory):] for name in names)
+
+
+def append_bytes(content: bytes, path: Union[Path, Pathy]):
+    """
+    Append content at the end of a file without rewriting it.
+    On the bucket, content is uploaded as a temporary object then composed onto the existing blob.
+    """
+    if env.is_local():
+        with open(path, 'ab') as _file:
+            _file.write(content)
+        return
+    blob = get_metadata(path)
+    if blob is None:
+        upload(content, path)
+        return
+    tail = get_blob_name(path) + '.tail'
+    upload(content, tail)
+    start = tm.perf_counter()
+    blob.compose([blob, get_blob(tail)])
+    get_blob(tail).delete()
+    record_transfer(blob.name, 'compose', len(content), start)
+    return
+
+
+def delete(path: Union[Path, Pathy]):
+    """ Delete a file, if it exists """
+    if env.is_local():
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    blob = get_blob(path)
+    start = tm.perf_counter()
+    try:
+        blob.delete()
+    except NotFound:
+        pass
+    record_transfer(blob.name, 'delete', 0, start)
+    return
+
+
+def download_to_file(path: Union[Path, Pathy], local_path: Path):
+    blob = get_blob(path)
+    start = tm.perf_counter()
+    blob.download_to_filename(str(local_path))
+    record_transfer(blob.name, 'download', os.path.getsize(local_path), start)
+    return